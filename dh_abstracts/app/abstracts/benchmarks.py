@@ -0,0 +1,182 @@
+"""
+Microbenchmarks of hot model, view and export helpers.
+
+Each benchmark prepares its inputs from the database, then calls the helper
+under test a fixed number of times, timing every call and counting its
+queries. Calls run in a transaction that is rolled back afterwards, so helpers
+that write (Conference.save, Conference.import_xml_file) see the same data
+every time. Results are plain dicts, which the benchmark command stores as JSON
+per commit and compares against a baseline: a benchmark regresses when its
+fastest call gets slower by more than a tolerance, or when it makes more
+queries. The fastest call is the least disturbed by whatever else the machine
+was doing, so it is compared rather than the median.
+
+The benchmark command runs them against a synthetic corpus from
+abstracts.synthetic, so the same seed and scale always give the same dataset.
+"""
+
+from contextlib import redirect_stdout
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import override_settings
+from glob import glob
+from operator import attrgetter
+from statistics import mean, median
+from tempfile import TemporaryDirectory
+import csv
+import io
+import os
+import time
+
+from abstracts import models
+from abstracts.instrumentation import RequestMetrics
+from abstracts.management.commands.export_tables import Command as ExportCommand
+from abstracts.matching import InstitutionIndex
+from abstracts.views import annotate_multiple_series, annotate_single_series
+
+# The sample documents the TEI import is tested with
+TEI_FILES = sorted(
+    glob(os.path.join(os.path.dirname(__file__), "static/tei/valid_tei/*.xml"))
+)
+
+# Number of objects the per-object benchmarks call their helper on
+SAMPLE_SIZE = 50
+
+
+def bench_annotate_multiple_series():
+    return lambda: list(annotate_multiple_series(models.ConferenceSeries.objects.all()))
+
+
+def bench_annotate_single_series():
+    series = list(models.ConferenceSeries.objects.order_by("pk"))
+    return lambda: [annotate_single_series(s.conferences.all()) for s in series]
+
+
+def bench_most_recent_attributes():
+    # The most prolific authors, who have the most attributes to rank
+    authors = list(
+        models.Author.objects.annotate(n_authorships=Count("authorships")).order_by(
+            "-n_authorships", "pk"
+        )[:SAMPLE_SIZE]
+    )
+
+    def run():
+        for author in authors:
+            list(author.most_recent_attributes(models.Appellation))
+            list(author.most_recent_attributes(models.Affiliation))
+
+    return run
+
+
+def bench_conference_save():
+    conferences = list(models.Conference.objects.order_by("pk")[:SAMPLE_SIZE])
+
+    def run():
+        for conference in conferences:
+            conference.save()
+
+    return run
+
+
+def bench_conference_import_xml_file():
+    conference = models.Conference.objects.order_by("pk").first()
+
+    def run():
+        institutions = InstitutionIndex()
+        for filepath in TEI_FILES:
+            conference.import_xml_file(filepath, institutions)
+
+    return run
+
+
+def bench_write_model_csv():
+    command = ExportCommand()
+
+    def run():
+        for export_conf in settings.PUBLIC_DATA_TABLE_CONFIG["CONFIGURATION"]:
+            command.write_model_csv(
+                qs=attrgetter(export_conf["model"])(models).objects.all(),
+                writer=csv.writer(io.StringIO()),
+                exclude_fields=export_conf["exclude_fields"],
+                include_string=export_conf.get("include_string", False),
+                censor_works=True,
+            )
+
+    return run
+
+
+def bench_write_denormalized_csvs():
+    command = ExportCommand()
+
+    def run():
+        with TemporaryDirectory() as tdir:
+            with override_settings(DATA_OUTPUT_PATH=tdir):
+                with redirect_stdout(io.StringIO()):
+                    command.write_denormalized_csvs(compresslevel=1)
+
+    return run
+
+
+# Each function prepares its inputs and returns the call to time
+BENCHMARKS = {
+    "annotate_multiple_series": bench_annotate_multiple_series,
+    "annotate_single_series": bench_annotate_single_series,
+    "Author.most_recent_attributes": bench_most_recent_attributes,
+    "Conference.save": bench_conference_save,
+    "Conference.import_xml_file": bench_conference_import_xml_file,
+    "Command.write_model_csv": bench_write_model_csv,
+    "write_denormalized_csvs": bench_write_denormalized_csvs,
+}
+
+
+def run_benchmark(name, repeat=5, warmup=1):
+    """
+    Time `repeat` calls of a benchmark after `warmup` untimed ones, each in a rolled back transaction, and return its timings in milliseconds and query count
+    """
+    timings = []
+    db_timings = []
+    n_queries = []
+    for i in range(warmup + repeat):
+        with transaction.atomic():
+            call = BENCHMARKS[name]()
+            # Counted by an execute wrapper, as exports make more queries than connection.queries keeps
+            metrics = RequestMetrics()
+            with connection.execute_wrapper(metrics.time_query):
+                start = time.perf_counter()
+                call()
+                elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        if i >= warmup:
+            timings.append(elapsed * 1000)
+            db_timings.append(metrics.db_time * 1000)
+            n_queries.append(metrics.queries)
+    return {
+        "median_ms": round(median(timings), 2),
+        "mean_ms": round(mean(timings), 2),
+        "min_ms": round(min(timings), 2),
+        "max_ms": round(max(timings), 2),
+        "db_ms": round(median(db_timings), 2),
+        "queries": max(n_queries),
+        "repeat": repeat,
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Return (name, change) rows comparing each benchmark in `results` with `baseline`, and the names of the benchmarks that regressed
+    """
+    rows = []
+    regressed = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            rows.append((name, "no baseline"))
+            continue
+        ratio = result["min_ms"] / previous["min_ms"]
+        change = f"{previous['min_ms']:.1f} -> {result['min_ms']:.1f} ms ({ratio - 1:+.0%}), {previous['queries']} -> {result['queries']} queries"
+        if ratio > 1 + tolerance or result["queries"] > previous["queries"]:
+            regressed.append(name)
+            change += " REGRESSED"
+        rows.append((name, change))
+    return rows, regressed
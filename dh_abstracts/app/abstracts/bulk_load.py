@@ -0,0 +1,411 @@
+"""
+Declarative bulk loading of CSV rows into models.
+
+A CSVLoader maps columns onto one model's fields, foreign keys and
+many-to-many relations. Rows are processed in batches: every value in a batch
+that refers to another model (a work type, keyword, organizer, institution...)
+is resolved through a memoized Lookup with one query per model, and whatever is
+missing is bulk created. Rows are then bulk created, or bulk updated when they
+match an existing object, and many-to-many links are bulk inserted. Loads run
+in a single transaction, which a dry run rolls back at the end, and return a
+LoadReport counting what was (or would have been) created, updated and skipped.
+"""
+
+from collections import Counter
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from abstracts import models
+from abstracts.matching import InstitutionIndex, normalize_name
+import csv
+import re
+
+
+def add_m2m(relation, pairs):
+    """
+    Bulk create (source ID, target ID) rows for a many-to-many relation, skipping any that already exist.
+
+    `relation` is the descriptor on the source model, which may be the reverse side of the field.
+    """
+    through = relation.through
+    source = relation.field.m2m_field_name()
+    target = relation.field.m2m_reverse_field_name()
+    if relation.reverse:
+        source, target = target, source
+    through.objects.bulk_create(
+        [
+            through(**{f"{source}_id": source_id, f"{target}_id": target_id})
+            for source_id, target_id in dict.fromkeys(pairs)
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def split_values(value, sep=";"):
+    """
+    Split a delimited cell on the regular expression `sep`, dropping blank values
+    """
+    return [v.strip() for v in re.split(sep, value) if v.strip() != ""]
+
+
+class LoadReport:
+    """
+    Counts of objects created and updated by a load, and the rows it skipped
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.created = Counter()
+        self.updated = Counter()
+        self.skipped = []
+
+    def skip(self, row_number, reason):
+        self.skipped.append((row_number, reason))
+
+    def __str__(self):
+        lines = [f"{self.rows} rows read"]
+        for model_name, n in sorted(self.created.items()):
+            lines.append(f"{n} {model_name} created")
+        for model_name, n in sorted(self.updated.items()):
+            lines.append(f"{n} {model_name} updated")
+        lines.append(f"{len(self.skipped)} rows skipped")
+        for row_number, reason in self.skipped:
+            lines.append(f"  row {row_number}: {reason}")
+        return "\n".join(lines)
+
+
+class Lookup:
+    """
+    Memoized lookup of `model` objects by the values of `fields`.
+
+    Keys are single values, or tuples when there are several fields. resolve() looks up all the keys a batch needs with one query, and bulk creates the missing ones when `create` is True, using `new(key)` if given to build them. Keys that are neither found nor created resolve to None.
+    """
+
+    def __init__(self, model, fields=("title",), create=True, new=None):
+        self.model = model
+        self.fields = fields
+        self.create = create
+        self.new = new
+        self.cache = {}
+
+    def key_of(self, obj):
+        values = tuple(getattr(obj, f) for f in self.fields)
+        return values if len(self.fields) > 1 else values[0]
+
+    def fetch(self, keys):
+        """
+        Return {key: object} for the keys that already exist, preferring the oldest object
+        """
+        key_tuples = [k if len(self.fields) > 1 else (k,) for k in keys]
+        # Filtering each field separately returns a superset, so keep only exact keys
+        candidates = self.model.objects.filter(
+            **{
+                f"{f}__in": {k[i] for k in key_tuples}
+                for i, f in enumerate(self.fields)
+            }
+        ).order_by("pk")
+        wanted = set(keys)
+        found = {}
+        for obj in candidates:
+            key = self.key_of(obj)
+            if key in wanted:
+                found.setdefault(key, obj)
+        return found
+
+    def build(self, key):
+        """
+        Return an unsaved object for a key that doesn't exist yet, or None to leave it unresolved
+        """
+        if self.new is not None:
+            return self.new(key)
+        values = key if len(self.fields) > 1 else (key,)
+        return self.model(**dict(zip(self.fields, values)))
+
+    def resolve(self, keys, report):
+        missing = [k for k in dict.fromkeys(keys) if k not in self.cache]
+        if len(missing) == 0:
+            return
+        found = self.fetch(missing)
+        self.cache.update(found)
+        if self.create:
+            new = {}
+            for key in missing:
+                if key not in found:
+                    obj = self.build(key)
+                    if obj is not None:
+                        new[key] = obj
+            self.model.objects.bulk_create(new.values())
+            self.cache.update(new)
+            report.created[self.model.__name__] += len(new)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+
+class OrganizerLookup(Lookup):
+    """
+    Find organizers by abbreviation or, failing that, by name, creating missing ones with the key as both
+    """
+
+    def __init__(self):
+        super().__init__(
+            models.Organizer,
+            ("abbreviation",),
+            new=lambda key: models.Organizer(name=key, abbreviation=key),
+        )
+
+    def fetch(self, keys):
+        candidates = models.Organizer.objects.filter(
+            Q(abbreviation__in=keys) | Q(name__in=keys)
+        )
+        by_abbreviation = {o.abbreviation: o for o in candidates}
+        by_name = {o.name: o for o in candidates}
+        return {
+            k: by_abbreviation.get(k) or by_name[k]
+            for k in keys
+            if k in by_abbreviation or k in by_name
+        }
+
+
+class InstitutionLookup(Lookup):
+    """
+    Match (name, city, country ID) keys to institutions with an InstitutionIndex, creating institutions for names that match nothing.
+
+    Keys are matched in order, so an institution created for one key can be matched by later, similar names. Keys with an empty name resolve to None.
+    """
+
+    def __init__(self, index=None):
+        super().__init__(models.Institution, ("name", "city", "country_id"))
+        self.index = index
+
+    def resolve(self, keys, report):
+        if self.index is None:
+            self.index = InstitutionIndex()
+        new = []
+        for key in dict.fromkeys(keys):
+            if key in self.cache:
+                continue
+            name, city, country_id = key
+            if normalize_name(name) == "":
+                self.cache[key] = None
+                continue
+            institution = self.index.match(name, country_id)
+            if institution is None:
+                institution = models.Institution(
+                    name=name, city=city, country_id=country_id
+                )
+                self.index.add(institution)
+                new.append(institution)
+            self.cache[key] = institution
+        models.Institution.objects.bulk_create(new)
+        report.created["Institution"] += len(new)
+
+
+class CSVLoader:
+    """
+    Load rows from a csv.DictReader into `model`, one object per row.
+
+    Subclasses set `model` and, usually in __init__:
+
+    - fields: {field name: column name, or function of the row}
+    - foreign_keys: {field name: (column name or function of the row, Lookup)}
+    - many_to_many: {field name: (function of the row returning a list of keys, Lookup)}
+    - match_fields: names in `fields` whose values identify an existing object in match_queryset() to update rather than create. Rows of a batch with the same values also share one new object, updated by each row in turn.
+    - create: whether rows that match no existing object are created, or skipped
+
+    before_load() and after_save() can be overridden to write anything else.
+
+    A row is skipped and reported if a function of it raises an exception. Database errors abort the whole load.
+    """
+
+    model = None
+    match_fields = ()
+    create = True
+    batch_size = 500
+
+    def __init__(self, batch_size=None):
+        self.fields = {}
+        self.foreign_keys = {}
+        self.many_to_many = {}
+        if batch_size is not None:
+            self.batch_size = batch_size
+        self.report = LoadReport()
+
+    def match_queryset(self):
+        return self.model.objects.all()
+
+    def before_load(self):
+        """
+        Called inside the load's transaction before any rows are read
+        """
+        pass
+
+    def after_save(self, saved):
+        """
+        Called with a list of (row, object) pairs once a batch's objects and many-to-many links are saved
+        """
+        pass
+
+    def load(self, rows, dry_run=False):
+        """
+        Load an iterable of dict rows and return a LoadReport. With dry_run, everything is rolled back at the end.
+        """
+        with transaction.atomic():
+            self.before_load()
+            batch = []
+            for row_number, row in enumerate(rows, start=1):
+                self.report.rows += 1
+                batch.append((row_number, row))
+                if len(batch) >= self.batch_size:
+                    self.load_batch(batch)
+                    batch = []
+            if len(batch) > 0:
+                self.load_batch(batch)
+            if dry_run:
+                transaction.set_rollback(True)
+        return self.report
+
+    def column(self, spec, row):
+        return spec(row) if callable(spec) else row[spec]
+
+    def read_row(self, row):
+        values = {f: self.column(spec, row) for f, spec in self.fields.items()}
+        fk_keys = {
+            f: self.column(spec, row) for f, (spec, _) in self.foreign_keys.items()
+        }
+        m2m_keys = {f: list(spec(row)) for f, (spec, _) in self.many_to_many.items()}
+        return values, fk_keys, m2m_keys
+
+    def load_batch(self, batch):
+        prepared = []
+        for row_number, row in batch:
+            try:
+                prepared.append((row_number, row, *self.read_row(row)))
+            except Exception as e:
+                self.report.skip(row_number, repr(e))
+
+        # Resolve everything the batch refers to before building any objects
+        for f, (_, lookup) in self.foreign_keys.items():
+            lookup.resolve(
+                [p[3][f] for p in prepared if p[3][f] is not None], self.report
+            )
+        for f, (_, lookup) in self.many_to_many.items():
+            lookup.resolve([k for p in prepared for k in p[4][f]], self.report)
+
+        existing = self.find_existing([p[2] for p in prepared])
+        to_create = []
+        # New objects by match key, so that rows with the same key create only one
+        new_matches = {}
+        to_update = {}
+        saved = []
+        for row_number, row, values, fk_keys, m2m_keys in prepared:
+            for f, (_, lookup) in self.foreign_keys.items():
+                values[f] = None if fk_keys[f] is None else lookup.get(fk_keys[f])
+            key = self.match_key(values)
+            match = existing.get(key)
+            if match is not None:
+                for f, v in values.items():
+                    setattr(match, f, v)
+                to_update[match.pk] = match
+                obj = match
+            elif key in new_matches:
+                obj = new_matches[key]
+                for f, v in values.items():
+                    setattr(obj, f, v)
+            elif self.create:
+                obj = self.model(**values)
+                to_create.append(obj)
+                if key is not None:
+                    new_matches[key] = obj
+            else:
+                self.report.skip(
+                    row_number, f"No existing {self.model.__name__} matches"
+                )
+                continue
+            saved.append((row, obj, m2m_keys))
+
+        self.model.objects.bulk_create(to_create)
+        self.report.created[self.model.__name__] += len(to_create)
+        update_fields = [
+            f for f in [*self.fields, *self.foreign_keys] if f not in self.match_fields
+        ]
+        if len(to_update) > 0 and len(update_fields) > 0:
+            self.model.objects.bulk_update(to_update.values(), update_fields)
+        self.report.updated[self.model.__name__] += len(to_update)
+
+        for f, (_, lookup) in self.many_to_many.items():
+            add_m2m(
+                getattr(self.model, f),
+                [
+                    (obj.pk, lookup.get(k).pk)
+                    for row, obj, m2m_keys in saved
+                    for k in m2m_keys[f]
+                    if lookup.get(k) is not None
+                ],
+            )
+        self.after_save([(row, obj) for row, obj, _ in saved])
+
+    def match_key(self, values):
+        if len(self.match_fields) == 0:
+            return None
+        return tuple(values[f] for f in self.match_fields)
+
+    def find_existing(self, values_list):
+        """
+        Return {match key: object} for the existing objects the batch's rows match, preferring the oldest object
+        """
+        if len(self.match_fields) == 0:
+            return {}
+        keys = {self.match_key(v) for v in values_list}
+        existing = {}
+        for obj in (
+            self.match_queryset()
+            .filter(
+                **{
+                    f"{f}__in": {k[i] for k in keys}
+                    for i, f in enumerate(self.match_fields)
+                }
+            )
+            .order_by("pk")
+        ):
+            key = tuple(getattr(obj, f) for f in self.match_fields)
+            if key in keys:
+                existing.setdefault(key, obj)
+        return existing
+
+
+class CSVLoadCommand(BaseCommand):
+    """
+    Base for management commands that load a CSV file with a CSVLoader.
+
+    Subclasses set `loader_class`, and list in `loader_options` the names of any options of their own that are passed to it as keyword arguments.
+    """
+
+    loader_class = None
+    loader_options = ()
+    default_filepath = None
+
+    def add_arguments(self, parser):
+        parser.add_argument("filepath", nargs="?", default=self.default_filepath)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be loaded, then roll everything back.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=CSVLoader.batch_size,
+            help="Number of rows to write at once.",
+        )
+
+    def handle(self, *args, **options):
+        loader = self.loader_class(
+            batch_size=options["batch_size"],
+            **{name: options[name] for name in self.loader_options},
+        )
+        with open(options["filepath"], newline="") as csvfile:
+            report = loader.load(csv.DictReader(csvfile), dry_run=options["dry_run"])
+        print(report)
+        if options["dry_run"]:
+            print("Dry run: nothing was saved")
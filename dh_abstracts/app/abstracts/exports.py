@@ -0,0 +1,504 @@
+"""
+Helpers for writing the data exports.
+
+Rows of the denormalized works export are built from a fixed number of bulk
+queries: rather than traversing relations work by work, every related label is
+loaded once into an in-memory lookup keyed by conference or work ID, and works
+are then streamed from the database in ID order. Rows are compressed directly
+into zip members that are atomically moved into place when complete.
+
+Each run also writes a JSON manifest (data dictionaries, row counts, sizes,
+checksums) that the downloads page renders without touching the models.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from operator import attrgetter
+from django.db.models import Case, When, Value, F, TextField
+from django.conf import settings
+from abstracts import models
+import csv
+import hashlib
+import io
+import json
+import os
+import tempfile
+import zipfile
+
+EXPORT_CHUNK_SIZE = 2000
+
+# Each archive gets a sidecar holding its SHA-256 digest, used as the download ETag
+CHECKSUM_SUFFIX = ".sha256"
+
+
+def conference_label(conf, series_titles, host_names):
+    """
+    Mirror Conference.__str__ using preloaded series titles and hosting institution names instead of issuing queries
+    """
+    year = conf["year"]
+    if conf["short_title"] != "":
+        return f"{year} - {conf['short_title']}"
+    elif conf["theme_title"] != "":
+        return f"{year} - {conf['theme_title']}"
+    elif conf["city"] != "":
+        if len(series_titles) > 0:
+            return f"{year} - {conf['city']} - {series_titles[0]}"
+        elif len(host_names) > 0:
+            return f"{year} - {conf['city']} - {host_names[0]}"
+        else:
+            return f"{year} - {conf['city']}"
+    else:
+        if len(host_names) > 0:
+            return f"{year} - {host_names[0]}"
+        elif len(series_titles) > 0:
+            return f"{year} - {series_titles[0]}"
+        else:
+            return f"{year}"
+
+
+def display_name(abbreviation, name):
+    # Organizers and series display their abbreviation when they have one
+    return abbreviation if abbreviation else name
+
+
+def conference_lookup():
+    """
+    Return a dict of conference ID -> denormalized conference columns
+    """
+    organizers = defaultdict(list)
+    for (
+        conf_id,
+        abbreviation,
+        name,
+    ) in models.Organizer.conferences_organized.through.objects.order_by(
+        "organizer__abbreviation"
+    ).values_list(
+        "conference_id", "organizer__abbreviation", "organizer__name"
+    ):
+        organizers[conf_id].append(display_name(abbreviation, name))
+
+    # Conference.series is ordered by abbreviation, so the first title in each list matches series.first()
+    series_labels = defaultdict(list)
+    series_titles = defaultdict(list)
+    for conf_id, abbreviation, title in models.SeriesMembership.objects.order_by(
+        "series__abbreviation"
+    ).values_list("conference_id", "series__abbreviation", "series__title"):
+        series_labels[conf_id].append(display_name(abbreviation, title))
+        series_titles[conf_id].append(title)
+
+    host_names = defaultdict(list)
+    for (
+        conf_id,
+        name,
+    ) in models.Conference.hosting_institutions.through.objects.order_by(
+        "institution__name", "institution_id"
+    ).values_list(
+        "conference_id", "institution__name"
+    ):
+        host_names[conf_id].append(name)
+
+    lookup = {}
+    for conf in models.Conference.objects.values(
+        "id",
+        "year",
+        "short_title",
+        "theme_title",
+        "city",
+        "state_province_region",
+        "country__pref_name",
+        "url",
+    ):
+        conf_id = conf["id"]
+        lookup[conf_id] = {
+            "label": conference_label(
+                conf, series_titles[conf_id], host_names[conf_id]
+            ),
+            "short_title": conf["short_title"],
+            "theme_title": conf["theme_title"],
+            "year": conf["year"],
+            "organizers": ";".join(organizers[conf_id]),
+            "series": ";".join(series_labels[conf_id]),
+            "hosting_institutions": ";".join(host_names[conf_id]),
+            "city": conf["city"],
+            "state_province_region": conf["state_province_region"],
+            "country": conf["country__pref_name"],
+            "url": conf["url"],
+        }
+    return lookup
+
+
+def restrict_to_works(qs, works):
+    # Limit rows of a work-linked table to the given works, if any
+    if works is None:
+        return qs
+    return qs.filter(work__in=works.values("pk"))
+
+
+def work_author_lookup(works=None):
+    """
+    Return a dict of work ID -> semicolon-separated author names, in authorship order
+    """
+    names = defaultdict(list)
+    authorships = restrict_to_works(models.Authorship.objects.all(), works)
+    for work_id, first_name, last_name in authorships.order_by(
+        "work_id", "authorship_order"
+    ).values_list("work_id", "appellation__first_name", "appellation__last_name"):
+        names[work_id].append(f"{first_name} {last_name}")
+    return {work_id: ";".join(n) for work_id, n in names.items()}
+
+
+def work_tag_lookup(field_name, works=None):
+    """
+    Return a dict of work ID -> semicolon-separated tag titles for one of the Work tag fields (keywords, languages, topics)
+    """
+    through = getattr(models.Work, field_name).through
+    tag_field = getattr(models.Work, field_name).field.m2m_reverse_field_name()
+    titles = defaultdict(list)
+    tag_rows = restrict_to_works(through.objects.all(), works)
+    for work_id, title in tag_rows.order_by(f"{tag_field}__title").values_list(
+        "work_id", f"{tag_field}__title"
+    ):
+        titles[work_id].append(title)
+    return {work_id: ";".join(t) for work_id, t in titles.items()}
+
+
+def denormalized_work_rows(works=None, conferences=None):
+    """
+    Yield one list per work, ordered by ID, with columns matching settings.DENORMALIZED_HEADERS
+
+    By default every work is exported. Pass a Work queryset to export only those works, and a prebuilt conference_lookup() to reuse it across calls.
+    """
+    if conferences is None:
+        conferences = conference_lookup()
+    authors = work_author_lookup(works)
+    keywords = work_tag_lookup("keywords", works)
+    languages = work_tag_lookup("languages", works)
+    topics = work_tag_lookup("topics", works)
+
+    if works is None:
+        works = models.Work.objects.all()
+
+    work_rows = (
+        works.order_by("id")
+        .annotate(
+            # Include the fulltext if it is licensed, otherwise leave blank
+            public_full_text=Case(
+                When(full_text_license__isnull=True, then=Value("")),
+                default=F("full_text"),
+                output_field=TextField(),
+            )
+        )
+        .values_list(
+            "id",
+            "conference_id",
+            "title",
+            "url",
+            "work_type__title",
+            "public_full_text",
+            "full_text_type",
+            "full_text_license__title",
+            "parent_session_id",
+        )
+    )
+
+    for (
+        work_id,
+        conference_id,
+        title,
+        url,
+        work_type,
+        full_text,
+        full_text_type,
+        full_text_license,
+        parent_session_id,
+    ) in work_rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        conf = conferences[conference_id]
+        yield [
+            work_id,
+            conf["label"],
+            conf["short_title"],
+            conf["theme_title"],
+            conf["year"],
+            conf["organizers"],
+            conf["series"],
+            conf["hosting_institutions"],
+            conf["city"],
+            conf["state_province_region"],
+            conf["country"],
+            conf["url"],
+            title,
+            url,
+            authors.get(work_id, ""),
+            work_type,
+            full_text,
+            full_text_type,
+            full_text_license,
+            parent_session_id,
+            keywords.get(work_id, ""),
+            languages.get(work_id, ""),
+            topics.get(work_id, ""),
+        ]
+
+
+def filtered_denormalized_work_rows(works, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield denormalized rows for an arbitrary Work queryset in ID order.
+
+    Matching IDs are read through a server-side cursor and related labels are only loaded for one chunk of works at a time, so memory stays bounded no matter how many works match.
+    """
+    conferences = conference_lookup()
+    work_ids = works.order_by("pk").values_list("pk", flat=True)
+    chunk = []
+    for work_id in work_ids.iterator(chunk_size=chunk_size):
+        chunk.append(work_id)
+        if len(chunk) >= chunk_size:
+            yield from denormalized_work_rows(
+                models.Work.objects.filter(pk__in=chunk), conferences
+            )
+            chunk = []
+    if len(chunk) > 0:
+        yield from denormalized_work_rows(
+            models.Work.objects.filter(pk__in=chunk), conferences
+        )
+
+
+class Echo:
+    """
+    A file-like object whose write() hands the written value straight back, so that csv.writer can be used to produce lines for a streaming response
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    """
+    Yield CSV-formatted lines, starting with the denormalized header row
+    """
+    writer = csv.writer(Echo(), dialect=csv.unix_dialect, quoting=csv.QUOTE_ALL)
+    yield writer.writerow([h["name"] for h in settings.DENORMALIZED_HEADERS])
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(rows):
+    """
+    Yield one JSON object per line, keyed by the denormalized header names
+    """
+    header_names = [h["name"] for h in settings.DENORMALIZED_HEADERS]
+    for row in rows:
+        yield json.dumps(dict(zip(header_names, row))) + "\n"
+
+
+@contextmanager
+def atomic_zip(path, compresslevel=9):
+    """
+    Write a zip archive to a temporary file next to `path` and rename it into place only once it is complete, so that readers never see a partially-written archive
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=".", suffix=".zip.tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            with zipfile.ZipFile(
+                tmp_file,
+                "w",
+                compression=zipfile.ZIP_DEFLATED,
+                compresslevel=compresslevel,
+            ) as dat_zip:
+                yield dat_zip
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        # mkstemp creates owner-only files, but these artifacts are served publicly
+        os.chmod(tmp_path, 0o644)
+        digest = file_sha256(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    write_checksum(path, digest)
+
+
+def atomic_write_text(path, text):
+    """
+    Write a small text file next to its destination and rename it into place
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path, block_size=1 << 20):
+    """
+    Return the hex SHA-256 digest of a file, read in blocks
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_checksum(path, digest):
+    """
+    Atomically write the checksum sidecar for an artifact, in sha256sum format
+    """
+    atomic_write_text(
+        f"{path}{CHECKSUM_SUFFIX}", f"{digest}  {os.path.basename(path)}\n"
+    )
+
+
+def read_checksum(path):
+    """
+    Return the recorded SHA-256 digest of an artifact, or None if it has no sidecar
+    """
+    try:
+        with open(f"{path}{CHECKSUM_SUFFIX}") as f:
+            return f.read().split()[0]
+    except (FileNotFoundError, IndexError):
+        return None
+
+
+@contextmanager
+def zip_csv_writer(dat_zip, arcname):
+    """
+    Yield a csv.writer that compresses rows straight into a new member of an open zip archive
+    """
+    with dat_zip.open(arcname, "w", force_zip64=True) as member:
+        with io.TextIOWrapper(member, encoding="utf-8", newline="") as csv_file:
+            yield csv.writer(csv_file, dialect=csv.unix_dialect, quoting=csv.QUOTE_ALL)
+
+
+def field_required(field):
+    if field.get_internal_type() in ("CharField", "TextField") and field.blank:
+        return False
+    if field.null:
+        return False
+    return True
+
+
+def data_dictionary(dt_config, table_rows=None):
+    """
+    Describe every CSV of a data table export configuration, its fields, and (if known) how many rows were written to it
+    """
+    if table_rows is None:
+        table_rows = {}
+    dictionary = []
+    for m in dt_config["CONFIGURATION"]:
+        model = attrgetter(m["model"])(models)
+        if "manual_model_description" in m:
+            model_description = m["manual_model_description"]
+        else:
+            model_description = getattr(model, "model_description", None)
+        all_model_fields = [
+            {
+                "name": f.name,
+                "relation": f.is_relation,
+                "help_text": str(f.help_text),
+                "related_model": str(f.related_model)
+                .replace("<class 'abstracts.models.", "")
+                .replace("'>", ""),
+                "type": f.get_internal_type(),
+                "required": field_required(f),
+            }
+            for f in model._meta.fields
+            if not f.one_to_many and f.name not in m["exclude_fields"]
+        ]
+        if m.get("include_string", False):
+            all_model_fields.append(
+                {
+                    "name": "label",
+                    "relation": None,
+                    "help_text": "General label for this object",
+                    "related_model": None,
+                    "type": "CharField",
+                    "required": True,
+                }
+            )
+        dictionary.append(
+            {
+                "model": m["model"],
+                "model_description": model_description,
+                "csv_name": m["csv_name"],
+                "rows": table_rows.get(m["csv_name"]),
+                "fields": all_model_fields,
+            }
+        )
+    return dictionary
+
+
+def artifact_entry(path, table_rows):
+    """
+    Describe a written export archive for the manifest
+    """
+    stat = os.stat(path)
+    return {
+        "file_name": os.path.basename(path),
+        "size": stat.st_size,
+        "sha256": read_checksum(path),
+        "last_updated": datetime.fromtimestamp(
+            stat.st_mtime, tz=timezone.utc
+        ).isoformat(),
+        "tables": table_rows,
+    }
+
+
+def build_manifest(artifacts=None):
+    """
+    Assemble the manifest describing the public, private, and denormalized exports.
+
+    `artifacts` maps each of those export names to an artifact_entry(). Exports missing from it are still described by their data dictionary, without any file metadata.
+    """
+    if artifacts is None:
+        artifacts = {}
+    return {
+        "generated": datetime.now(timezone.utc).isoformat(),
+        "artifacts": artifacts,
+        "data_dictionaries": {
+            "public": data_dictionary(
+                settings.PUBLIC_DATA_TABLE_CONFIG,
+                artifacts.get("public", {}).get("tables", {}),
+            ),
+            "private": data_dictionary(
+                settings.PRIVATE_DATA_TABLE_CONFIG,
+                artifacts.get("private", {}).get("tables", {}),
+            ),
+            "denormalized": settings.DENORMALIZED_HEADERS,
+        },
+    }
+
+
+def manifest_path():
+    return f"{settings.DATA_OUTPUT_PATH}/{settings.DATA_MANIFEST_NAME}"
+
+
+def write_manifest(manifest):
+    atomic_write_text(manifest_path(), json.dumps(manifest, indent=2))
+
+
+# The parsed manifest, kept until the file on disk is replaced
+_manifest_cache = {}
+
+
+def load_manifest():
+    """
+    Return the manifest written by the last export_tables run, or None if there is none.
+
+    The parsed manifest is held in memory and only re-read when the file's modification time or size changes.
+    """
+    path = manifest_path()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if _manifest_cache.get("key") != key:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        _manifest_cache.clear()
+        _manifest_cache.update(key=key, manifest=manifest)
+    return _manifest_cache["manifest"]
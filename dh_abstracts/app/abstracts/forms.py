@@ -447,6 +447,21 @@ class TopicMergeForm(forms.Form):
     )
 
 
+class LanguageMultiMergeForm(forms.Form):
+    sources = forms.ModelMultipleChoiceField(
+        queryset=Language.objects.all(),
+        widget=ModelSelect2Multiple(url="language-autocomplete"),
+        required=True,
+        help_text="Select the languages that you want to merge together",
+    )
+    into = forms.ModelChoiceField(
+        queryset=Language.objects.all(),
+        widget=ModelSelect2(url="language-autocomplete"),
+        required=True,
+        help_text="Select the target language to merge into",
+    )
+
+
 class LanguageMergeForm(forms.Form):
     into = forms.ModelChoiceField(
         queryset=Language.objects.all(),
@@ -0,0 +1,186 @@
+"""
+Per-request performance metrics for production.
+
+RequestMetricsMiddleware counts and times every database query a request
+makes, times template rendering and counts cache hits and misses. It reports
+them in a JSON log line at INFO on the "abstracts.instrumentation" logger and,
+when settings.SERVER_TIMING_HEADER is on, in a Server-Timing response header.
+It logs a warning whenever a request goes over the budgets in
+settings.REQUEST_BUDGETS for its view name.
+
+Cache hits and misses are only counted by the Instrumented* cache backends
+below. The bodies of streaming responses are produced after the middleware has
+returned, so their queries are not included.
+"""
+
+from contextlib import ExitStack
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import MemcachedCache
+from django.db import connections
+from django.template.base import Template
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# The metrics of the request being handled, if any
+current_metrics = ContextVar("current_metrics", default=None)
+
+
+class RequestMetrics:
+    """
+    Counters for one request. Times are in seconds.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.template_time = 0.0
+        self.total_time = 0.0
+        self.rendering = False
+
+    def time_query(self, execute, sql, params, many, context):
+        """
+        A database execute wrapper, see connection.execute_wrapper()
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    def as_dict(self):
+        return {
+            "queries": self.queries,
+            "db_ms": round(self.db_time * 1000, 1),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "template_ms": round(self.template_time * 1000, 1),
+            "total_ms": round(self.total_time * 1000, 1),
+        }
+
+    def server_timing(self):
+        return ", ".join(
+            [
+                f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+                f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+                f"template;dur={self.template_time * 1000:.1f}",
+                f"total;dur={self.total_time * 1000:.1f}",
+            ]
+        )
+
+
+def request_budget(view_name):
+    """
+    The budget for a view name: the "default" limits, overridden by any set for that name
+    """
+    budgets = getattr(settings, "REQUEST_BUDGETS", {})
+    return {**budgets.get("default", {}), **budgets.get(view_name, {})}
+
+
+_render = Template.render
+
+
+def _timed_render(self, context):
+    # Included templates render inside their parent, so only the outermost render is timed
+    metrics = current_metrics.get()
+    if metrics is None or metrics.rendering:
+        return _render(self, context)
+    metrics.rendering = True
+    start = time.perf_counter()
+    try:
+        return _render(self, context)
+    finally:
+        metrics.template_time += time.perf_counter() - start
+        metrics.rendering = False
+
+
+class RequestMetricsMiddleware:
+    """
+    Measure each request, and report the measurements in its response header and the log
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        Template.render = _timed_render
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.time_query))
+                response = self.get_response(request)
+        finally:
+            metrics.total_time = time.perf_counter() - start
+            current_metrics.reset(token)
+
+        match = request.resolver_match
+        view_name = match.view_name if match is not None else ""
+        measurements = metrics.as_dict()
+        logger.info(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.path,
+                    "view": view_name,
+                    "status": response.status_code,
+                    **measurements,
+                }
+            )
+        )
+        for measure, limit in request_budget(view_name).items():
+            if measurements[measure] > limit:
+                logger.warning(
+                    f"{request.method} {request.path} ({view_name}) exceeded its {measure} budget: {measurements[measure]} > {limit}"
+                )
+        if getattr(settings, "SERVER_TIMING_HEADER", False):
+            response["Server-Timing"] = metrics.server_timing()
+        return response
+
+
+class CacheMetricsMixin:
+    """
+    Count the hits and misses of cache reads made while handling a request
+    """
+
+    def get(self, key, default=None, version=None):
+        missing = object()
+        value = super().get(key, missing, version=version)
+        metrics = current_metrics.get()
+        if metrics is not None:
+            if value is missing:
+                metrics.cache_misses += 1
+            else:
+                metrics.cache_hits += 1
+        return default if value is missing else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        # Backends without a native get_many call get() for each key, which shouldn't count again
+        token = current_metrics.set(None)
+        try:
+            values = super().get_many(keys, version=version)
+        finally:
+            current_metrics.reset(token)
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.cache_hits += len(values)
+            metrics.cache_misses += len(keys) - len(values)
+        return values
+
+
+class InstrumentedMemcachedCache(CacheMetricsMixin, MemcachedCache):
+    pass
+
+
+class InstrumentedLocMemCache(CacheMetricsMixin, LocMemCache):
+    pass
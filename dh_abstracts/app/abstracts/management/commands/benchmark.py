@@ -0,0 +1,147 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+from datetime import datetime, timezone
+from os.path import exists
+import django
+import json
+import os
+import platform
+import subprocess
+
+from abstracts import models
+from abstracts.benchmarks import BENCHMARKS, compare, run_benchmark
+from abstracts.synthetic import CorpusGenerator
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Command(BaseCommand):
+    help = "Time hot helpers against a seeded synthetic corpus in a test database, and compare them to a baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "benchmarks",
+            nargs="*",
+            help=f"Names of the benchmarks to run, out of {', '.join(BENCHMARKS)}. Runs all of them by default.",
+        )
+        parser.add_argument(
+            "--scale",
+            type=float,
+            default=0.1,
+            help="Scale factor of the synthetic corpus, see generate_corpus.",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Random seed of the synthetic corpus."
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Number of timed calls of each benchmark.",
+        )
+        parser.add_argument(
+            "--output-dir",
+            default="benchmarks",
+            help="Directory for the results, written as <commit>.json.",
+        )
+        parser.add_argument(
+            "--baseline",
+            default="benchmarks/baseline.json",
+            help="Results file to compare against.",
+        )
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Also write these results to the baseline file.",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Slowdown of the fastest call, as a fraction, beyond which a benchmark has regressed.",
+        )
+        parser.add_argument(
+            "--keepdb",
+            action="store_true",
+            help="Keep the test database and its corpus for the next run.",
+        )
+
+    def handle(self, *args, **options):
+        names = options["benchmarks"] or list(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if len(unknown) > 0:
+            raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+        old_config = setup_databases(
+            verbosity=0,
+            interactive=False,
+            keepdb=options["keepdb"],
+            aliases={"default"},
+        )
+        try:
+            if not models.Work.objects.exists():
+                print(f"Generating a corpus at scale {options['scale']:g}")
+                CorpusGenerator(scale=options["scale"], seed=options["seed"]).generate()
+            results = {}
+            for name in names:
+                results[name] = run_benchmark(name, repeat=options["repeat"])
+                print(
+                    f"{name}: {results[name]['min_ms']:.1f} ms fastest, {results[name]['median_ms']:.1f} ms median, {results[name]['queries']} queries"
+                )
+            with connection.cursor() as cursor:
+                cursor.execute("SHOW server_version")
+                postgres_version = cursor.fetchone()[0]
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+
+        commit = current_commit()
+        run = {
+            "commit": commit,
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "postgres": postgres_version,
+            "scale": options["scale"],
+            "seed": options["seed"],
+            "results": results,
+        }
+        os.makedirs(options["output_dir"], exist_ok=True)
+        output_path = os.path.join(options["output_dir"], f"{commit}.json")
+        with open(output_path, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"Results written to {output_path}")
+
+        if exists(options["baseline"]):
+            with open(options["baseline"], "r") as f:
+                baseline = json.load(f)
+            print(f"Compared to {baseline['commit']}:")
+            if (baseline["scale"], baseline["seed"]) != (
+                options["scale"],
+                options["seed"],
+            ):
+                print("  (the baseline used a different corpus)")
+            rows, regressed = compare(
+                results, baseline["results"], tolerance=options["tolerance"]
+            )
+            for name, change in rows:
+                print(f"  {name}: {change}")
+        else:
+            regressed = []
+            print(f"No baseline at {options['baseline']}")
+
+        if options["save_baseline"]:
+            with open(options["baseline"], "w") as f:
+                json.dump(run, f, indent=2)
+            print(f"Baseline written to {options['baseline']}")
+        elif len(regressed) > 0:
+            raise CommandError(f"{len(regressed)} benchmarks regressed")
@@ -1,18 +1,28 @@
 from django.core.management.base import BaseCommand
-from abstracts import models
-from django.db import transaction
-from django.db.models import Q
+from abstracts.orphans import OrphanSweeper
 
 
 class Command(BaseCommand):
     help = "Erase hanging records"
 
-    def handle(self, *args, **options):
-        models.Author.objects.exclude(authorships__isnull=False).all().delete()
-        models.Affiliation.objects.exclude(asserted_by__isnull=False).all().delete()
-        models.Institution.objects.exclude(
-            Q(affiliations__asserted_by__isnull=False) | Q(conferences__isnull=False)
-        ).all().delete()
-        models.Keyword.objects.exclude(works__isnull=False).all().delete()
-        models.Appellation.objects.exclude(asserted_by__isnull=False).all().delete()
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the hanging records.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=OrphanSweeper.batch_size,
+            help="Number of records to delete per statement.",
+        )
 
+    def handle(self, *args, **options):
+        sweeper = OrphanSweeper(batch_size=options["batch_size"])
+        if options["dry_run"]:
+            for label, n in sweeper.counts().items():
+                print(f"{label}: {n} hanging")
+            return
+        for label in sweeper.querysets:
+            print(f"{label}: {sweeper.delete(label)} deleted")
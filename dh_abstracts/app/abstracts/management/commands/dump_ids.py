@@ -6,6 +6,13 @@ import json
 class Command(BaseCommand):
     help = "Export dictionary of entity IDs for testing"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default="/vol/data/all_ids.json",
+            help="Path of the JSON file to write.",
+        )
+
     def handle(self, *args, **options):
         all_ids = {
             "works": list(models.Work.objects.all().values_list("id", flat=True)),
@@ -29,5 +36,5 @@ class Command(BaseCommand):
             ),
         }
 
-        json.dump(all_ids, open("/vol/data/all_ids.json", "w"))
-
+        with open(options["output"], "w") as f:
+            json.dump(all_ids, f)
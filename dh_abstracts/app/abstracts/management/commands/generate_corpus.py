@@ -0,0 +1,54 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from abstracts import models
+from abstracts.synthetic import CorpusGenerator, scaled_counts
+
+
+class Command(BaseCommand):
+    help = "Fill an empty database with a synthetic corpus for benchmarking, and write its all_ids.json"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale",
+            type=float,
+            default=1,
+            help="Size of the corpus relative to the current one, e.g. 10 for ten times as many works, authors and authorships.",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Random seed. The same seed and scale generate the same corpus.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of works to write per transaction.",
+        )
+        parser.add_argument(
+            "--ids-output",
+            default="/vol/data/all_ids.json",
+            help="Path of the entity IDs file for the locust suite, as written by dump_ids.",
+        )
+
+    def handle(self, *args, **options):
+        if models.Work.objects.exists():
+            raise CommandError(
+                "The database already has works. Generate synthetic corpora into an empty database, e.g. after make wipe."
+            )
+
+        def progress(n_generated, n_works):
+            print(f"{n_generated}/{n_works} works generated")
+
+        print(f"Generating {scaled_counts(options['scale'])['works']} works")
+        report = CorpusGenerator(
+            scale=options["scale"],
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            progress=progress,
+        ).generate()
+        for model_name, n in sorted(report.created.items()):
+            print(f"{n} {model_name} created")
+        call_command("dump_ids", output=options["ids_output"])
+        print(f"IDs written to {options['ids_output']}")
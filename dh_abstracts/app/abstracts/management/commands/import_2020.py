@@ -1,137 +1,199 @@
-from django.core.management.base import BaseCommand
 from abstracts import models
+from abstracts.bulk_load import (
+    CSVLoadCommand,
+    CSVLoader,
+    InstitutionLookup,
+    Lookup,
+    add_m2m,
+    split_values,
+)
+from abstracts.tei import content_hash
+from django.contrib.postgres.search import SearchVector
+from django.db.models import Min
 import re
-import csv
-from django.db import transaction
 
 
-class Command(BaseCommand):
-    help = "One-time load of DH 2020"
+def parse_authors(value):
+    """
+    "Last, First (1,2); Other, Name (3)" -> [(first name, last name, [institution numbers])]
+    """
+    authors = []
+    for author in value.split(";"):
+        name = re.match(r"^[^(]+", author).group(0)
+        last_name = name.split(",")[0].strip()
+        first_name = name.split(",")[1].strip()
+        raw_institutions = re.search(r"\(([0-9](?:,[0-9])*)\)", author)
+        if raw_institutions is not None:
+            institution_nos = [int(i) for i in raw_institutions.group(1).split(",")]
+        else:
+            institution_nos = [0]
+        authors.append((first_name, last_name, institution_nos))
+    return authors
 
-    def add_arguments(self, parser):
-        pass
-
-    @transaction.atomic
-    def handle(self, *args, **options):
-        with open("/vol/data/metadata_V4.csv", "r") as csvfile:
-            reader = csv.DictReader(csvfile)
-            adho2020 = models.Conference.objects.get(id=495)
-            # Delete handful of hand-entered papers
-            models.Work.objects.filter(conference=adho2020).delete()
-            for work in reader:
-                print(work)
-                # Grab authors
-                authors_dict = []
-                for author in work["authors"].split(";"):
-                    name = re.match(r"^[^(]+", author).group(0)
-                    last_name = name.split(",")[0].strip()
-                    first_name = name.split(",")[1].strip()
-                    print(name)
-                    print(last_name)
-                    print(first_name)
-                    raw_institutions = re.search(r"\(([0-9](?:,[0-9])*)\)", author)
-                    if raw_institutions is not None:
-                        institution_nos = [
-                            int(i) for i in raw_institutions.group(1).split(",")
-                        ]
-                    else:
-                        institution_nos = [0]
-                    appellation_object = models.Appellation.objects.get_or_create(
-                        first_name=first_name, last_name=last_name
-                    )[0]
-                    author_object = models.Author.objects.filter(
-                        authorships__appellation__first_name=first_name.strip(),
-                        authorships__appellation__last_name=last_name.strip(),
-                    ).first()
-                    authors_dict.append(
-                        {
-                            "appellation_object": appellation_object,
-                            "author_object": author_object,
-                            "institution_nos": institution_nos,
-                        }
+
+def parse_organisations(value):
+    """
+    "1: Some University; 2: Other Institute" -> {institution number: name}
+    """
+    if re.search(r"\d: ", value) is None:
+        return {0: value}
+    return {
+        int(re.search(r"(\d)", institution).group(1)): re.search(
+            r"\d: (.+)", institution
+        ).group(1)
+        for institution in re.findall(r"\d:[^0-9;]+", value)
+    }
+
+
+class WorkLoader(CSVLoader):
+    """
+    Load the ConfTool metadata export for the conference with primary key `conference`: one work per row, with its keywords and authors
+    """
+
+    model = models.Work
+
+    def __init__(self, conference, **kwargs):
+        super().__init__(**kwargs)
+        self.conference = models.Conference.objects.get(pk=conference)
+        self.appellations = Lookup(models.Appellation, ("first_name", "last_name"))
+        self.institutions = InstitutionLookup()
+        self.affiliations = Lookup(models.Affiliation, ("department", "institution_id"))
+        self.fields = {
+            "conference_id": lambda row: self.conference.pk,
+            "title": "title_plain",
+            "full_text": "Abstract",
+            "full_text_type": lambda row: "txt",
+        }
+        self.foreign_keys = {"work_type": ("acceptance", Lookup(models.WorkType))}
+        self.many_to_many = {
+            "keywords": (
+                lambda row: split_values(row["keywords"], sep=r"[,;]"),
+                Lookup(models.Keyword),
+            )
+        }
+
+    def authors(self, row):
+        """
+        [(first name, last name, [institution names])] for each author of a row's work
+        """
+        organisations = parse_organisations(row["organisations"])
+        return [
+            (first_name, last_name, [organisations[n] for n in institution_nos])
+            for first_name, last_name, institution_nos in parse_authors(row["authors"])
+        ]
+
+    def read_row(self, row):
+        # Parse the authors up front so that a malformed list skips the row
+        self.authors(row)
+        values, fk_keys, m2m_keys = super().read_row(row)
+        # Work.save maintains the text hash and rendition, which bulk_create bypasses
+        values["full_text_hash"] = content_hash(values["full_text"].encode("utf-8"))
+        values.update(
+            models.Work.full_text_rendition(
+                values["full_text"], values["full_text_type"]
+            )
+        )
+        return values, fk_keys, m2m_keys
+
+    def before_load(self):
+        # Replace the handful of works entered by hand before the full metadata was available
+        models.Work.objects.filter(conference=self.conference).delete()
+
+    def after_save(self, saved):
+        models.Work.objects.filter(pk__in=[work.pk for _, work in saved]).update(
+            search_text=SearchVector("title", weight="A")
+            + SearchVector("full_text", weight="B")
+        )
+
+        authors = [(work, self.authors(row)) for row, work in saved]
+        names = [
+            (first_name, last_name)
+            for _, work_authors in authors
+            for first_name, last_name, _ in work_authors
+        ]
+        self.appellations.resolve(names, self.report)
+        self.institutions.resolve(
+            [
+                (institution_name, "", None)
+                for _, work_authors in authors
+                for _, _, institution_names in work_authors
+                for institution_name in institution_names
+            ],
+            self.report,
+        )
+        self.affiliations.resolve(
+            [
+                ("", institution.pk)
+                for institution in self.institutions.cache.values()
+                if institution is not None
+            ],
+            self.report,
+        )
+
+        # An appellation belongs to the lowest-numbered author who has used it, otherwise to a new author
+        appellations = {name: self.appellations.get(name) for name in names}
+        author_ids = dict(
+            models.Authorship.objects.filter(
+                appellation__in=[a.pk for a in appellations.values()]
+            )
+            .values("appellation_id")
+            .annotate(author_id=Min("author_id"))
+            .values_list("appellation_id", "author_id")
+        )
+        new_authors = {
+            name: models.Author(appellations_index=f"{name[0]} {name[1]}")
+            for name, appellation in appellations.items()
+            if appellation.pk not in author_ids
+        }
+        models.Author.objects.bulk_create(new_authors.values())
+        self.report.created["Author"] += len(new_authors)
+
+        # One authorship per (author, work): a name listed twice in a row adds
+        # its affiliations to the first authorship.
+        authorships = {}
+        authorship_affiliations = []
+        for work, work_authors in authors:
+            n_work_authors = 0
+            for first_name, last_name, institution_names in work_authors:
+                name = (first_name, last_name)
+                appellation = appellations[name]
+                author_id = author_ids.get(appellation.pk) or new_authors[name].pk
+                authorship = authorships.get((author_id, work.pk))
+                if authorship is None:
+                    n_work_authors += 1
+                    authorship = models.Authorship(
+                        work=work,
+                        appellation=appellation,
+                        author_id=author_id,
+                        authorship_order=n_work_authors,
                     )
-                print(authors_dict)
-
-                institution_dict = []
-                if re.search(r"\d: ", work["organisations"]) is not None:
-                    for institution in re.findall(
-                        r"\d:[^0-9;]+", work["organisations"]
-                    ):
-                        number = re.search(r"(\d)", institution)
-                        institution_no = int(number.group(1))
-                        namestring = re.search(r"\d: (.+)", institution).group(1)
-                        institution_dict.append(
-                            {
-                                "institution_no": institution_no,
-                                "institution_name": namestring,
-                            }
-                        )
-                else:
-                    institution_no = 0
-                    namestring = work["organisations"]
-                    institution_dict.append(
-                        {
-                            "institution_no": institution_no,
-                            "institution_name": namestring,
-                        }
+                    authorships[(author_id, work.pk)] = authorship
+                for institution_name in institution_names:
+                    institution = self.institutions.get((institution_name, "", None))
+                    if institution is None:
+                        continue
+                    authorship_affiliations.append(
+                        (authorship, self.affiliations.get(("", institution.pk)))
                     )
+        models.Authorship.objects.bulk_create(authorships.values())
+        self.report.created["Authorship"] += len(authorships)
+        add_m2m(
+            models.Authorship.affiliations,
+            [(a.pk, affiliation.pk) for a, affiliation in authorship_affiliations],
+        )
+
 
-                keywords = []
-                for kw in re.split(r"[,;]", work["keywords"]):
-                    keyword = models.Keyword.objects.get_or_create(title=kw.strip())[0]
-                    keywords.append(keyword)
-
-                disciplines = []
-                for disc in re.split(r",", work["tg5_Disciplines_Fields_of_Study"]):
-                    discipline = models.Discipline.objects.get_or_create(
-                        title=disc.strip()
-                    )[0]
-                    disciplines.append(discipline)
-
-                abstract = models.Work.objects.create(
-                    conference=adho2020,
-                    title=work["title_plain"],
-                    full_text=work["Abstract"],
-                    full_text_type="txt",
-                    work_type=models.WorkType.objects.get_or_create(
-                        title=work["acceptance"]
-                    )[0],
-                )
-
-                abstract.keywords.set(keywords)
-                abstract.disciplines.set(disciplines)
-
-                for author in authors_dict:
-                    if author["author_object"] is None:
-                        real_author = models.Author.objects.create()
-                    else:
-                        real_author = author["author_object"]
-
-                    authorship = models.Authorship.objects.get_or_create(
-                        work=abstract,
-                        appellation=author["appellation_object"],
-                        author=real_author,
-                    )[0]
-
-                    for institution_no in author["institution_nos"]:
-                        institution_name = [
-                            i["institution_name"]
-                            for i in institution_dict
-                            if i["institution_no"] == institution_no
-                        ][0]
-                        candidate_institutions = models.Institution.objects.filter(
-                            name=institution_name
-                        )
-                        if bool(candidate_institutions):
-                            institution = candidate_institutions[0]
-                        else:
-                            institution = models.Institution.objects.create(
-                                name=institution_name
-                            )
-                        affiliation = models.Affiliation.objects.get_or_create(
-                            department="", institution=institution
-                        )[0]
-                        authorship.affiliations.add(affiliation)
-
-        for a in models.Author.objects.all():
-            a.save()
+class Command(CSVLoadCommand):
+    help = "Load the DH 2020 ConfTool metadata export"
+    loader_class = WorkLoader
+    loader_options = ("conference",)
+    default_filepath = "/vol/data/metadata_V4.csv"
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--conference",
+            type=int,
+            default=495,
+            help="Primary key of the conference that the works belong to.",
+        )
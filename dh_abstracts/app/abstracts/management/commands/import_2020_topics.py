@@ -1,164 +1,172 @@
-from django.core.management.base import BaseCommand
 from abstracts import models
-import re
-import csv
-from django.db import transaction
+from abstracts.bulk_load import CSVLoadCommand, CSVLoader, Lookup
 
+ALLOWED_TOPICS = [
+    "English",
+    "Contemporary",
+    "Europe",
+    "North America",
+    "20th Century",
+    "Global",
+    "19th Century",
+    "Literary studies",
+    "Interface design, development, and analysis",
+    "digital libraries creation, management, and analysis",
+    "music and sound digitization, encoding, and analysis",
+    "manuscripts description, representation, and analysis",
+    "database creation, management, and analysis",
+    "text encoding and markup language creation, deployment, and analysis",
+    "virtual and augmented reality creation, systems, and analysis",
+    "annotation structures, systems, and methods",
+    "software development, systems, analysis and methods",
+    "data publishing projects, systems, and methods",
+    "sustainable procedures, systems, and methods",
+    "metadata standards, systems, and methods",
+    "digital publishing projects, systems, and methods",
+    "copyright, licensing, and permissions standards, systems, and processes",
+    "Humanities computing",
+    "History",
+    "scholarly editing and editions development, analysis, and methods",
+    "text mining and analysis",
+    "Library & information science",
+    "18th Century",
+    "15th-17th Century",
+    "Asia",
+    "Computer science",
+    "Comparative (2 or more geographical areas)",
+    "project design, organization, management",
+    "public humanities collaborations and methods",
+    "artificial intelligence and machine learning",
+    "spatial & spatio-temporal analysis, modeling and visualization",
+    "Cultural studies",
+    "Education/ pedagogy",
+    "cultural analytics",
+    "natural language processing",
+    "digital archiving",
+    "BCE-4th Century",
+    "meta-criticism (reflections on digital humanities and humanities computing)",
+    "data modeling",
+    "Media studies",
+    "curricular and pedagogical development and analysis",
+    "Book and print history",
+    "Linguistics",
+    "network analysis and graphs theory and application",
+    "Africa",
+    "digital research infrastructures development and analysis",
+    "digital access, privacy, and ethics analysis",
+    "Art history",
+    "social media analysis and methods",
+    "linked (open) data",
+    "South America",
+    "Geography and geo-humanities",
+    "digital activism and advocacy",
+    "Asian studies",
+    "information retrieval and querying algorithms and methods",
+    "crowdsourcing",
+    "First nations and indigenous studies",
+    "Informatics",
+    "image processing and analysis",
+    "Feminist studies",
+    "Philology",
+    "Musicology",
+    "semantic analysis",
+    "attribution studies and stylometric analysis",
+    "Gender and sexuality studies",
+    "bibliographic analysis",
+    "electronic literature production and analysis",
+    "Spanish",
+    "History of science",
+    "digitization (2D & 3D)",
+    "data, object, and artefact preservation",
+    "Design studies",
+    "Communication studies",
+    "African and African American Studies",
+    "Performance Studies: Dance, Theatre",
+    "Central/Eastern European Studies",
+    "Philosophy",
+    "Literacy, composition, and creative writing",
+    "Sociology",
+    "French",
+    "open access methods",
+    "digital biography, personography, and prosopography",
+    "Translation studies",
+    "Theology and religious studies",
+    "Law and legal studies",
+    "Australia/Oceania",
+    "digital ecologies and digital communities creation management and analysis",
+    "rhetorical analysis",
+    "Galleries and museum studies",
+    "Archaeology",
+    "physical & minimal computing",
+    "Political science",
+    "Anthropology",
+    "user experience design and analysis",
+    "eco-criticism and environmental analysis",
+    "Film and cinema arts studies",
+    "Environmental, ocean, and waterway studies",
+    "Chicano/a/x, Latino/a/x studies",
+    "mixed-media analysis",
+    "optical character recognition and handwriting recognition",
+    "ethnographic analysis",
+    "digital art production and analysis",
+    "mobile applications development and analysis",
+    "Games studies",
+    "South Asian studies",
+    "systems and information architecture and usability",
+    "Cognitive sciences and psychology",
+    "concordancing and indexing",
+    "Disability and differently-abled studies",
+    "Language acquisition",
+    "3D printing, critical making",
+    "media archaeology",
+    "Logic and epistemology",
+    "Ethnography and folklore",
+    "Transgender and non-binary studies",
+    "Statistics",
+]
 
-class Command(BaseCommand):
-    help = "One-time load of DH 2020"
 
-    def add_arguments(self, parser):
-        pass
+class WorkTopicLoader(CSVLoader):
+    """
+    Add topics from the conference's controlled vocabulary to works of the conference with primary key `conference` that have already been loaded, matched by title
+    """
+
+    model = models.Work
+    match_fields = ("title",)
+    create = False
+
+    def __init__(self, conference, **kwargs):
+        super().__init__(**kwargs)
+        self.conference = models.Conference.objects.get(pk=conference)
+        self.topics = Lookup(models.Topic)
+        self.fields = {"title": "title_plain"}
+        self.many_to_many = {"topics": (self.row_topics, self.topics)}
 
-    @transaction.atomic
-    def handle(self, *args, **options):
+    def row_topics(self, row):
+        topics = [t for t in ALLOWED_TOPICS if t in row["topics"]]
+        if len(topics) == 0:
+            raise ValueError(f"No allowed topics in {row['topics']!r}")
+        return topics
 
-        allowed_topics = [
-            "English",
-            "Contemporary",
-            "Europe",
-            "North America",
-            "20th Century",
-            "Global",
-            "19th Century",
-            "Literary studies",
-            "Interface design, development, and analysis",
-            "digital libraries creation, management, and analysis",
-            "music and sound digitization, encoding, and analysis",
-            "manuscripts description, representation, and analysis",
-            "database creation, management, and analysis",
-            "text encoding and markup language creation, deployment, and analysis",
-            "virtual and augmented reality creation, systems, and analysis",
-            "annotation structures, systems, and methods",
-            "software development, systems, analysis and methods",
-            "data publishing projects, systems, and methods",
-            "sustainable procedures, systems, and methods",
-            "metadata standards, systems, and methods",
-            "digital publishing projects, systems, and methods",
-            "copyright, licensing, and permissions standards, systems, and processes",
-            "Humanities computing",
-            "History",
-            "scholarly editing and editions development, analysis, and methods",
-            "text mining and analysis",
-            "Library & information science",
-            "18th Century",
-            "15th-17th Century",
-            "Asia",
-            "Computer science",
-            "Comparative (2 or more geographical areas)",
-            "project design, organization, management",
-            "public humanities collaborations and methods",
-            "artificial intelligence and machine learning",
-            "spatial & spatio-temporal analysis, modeling and visualization",
-            "Cultural studies",
-            "Education/ pedagogy",
-            "cultural analytics",
-            "natural language processing",
-            "digital archiving",
-            "BCE-4th Century",
-            "meta-criticism (reflections on digital humanities and humanities computing)",
-            "data modeling",
-            "Media studies",
-            "curricular and pedagogical development and analysis",
-            "Book and print history",
-            "Linguistics",
-            "network analysis and graphs theory and application",
-            "Africa",
-            "digital research infrastructures development and analysis",
-            "digital access, privacy, and ethics analysis",
-            "Art history",
-            "social media analysis and methods",
-            "linked (open) data",
-            "South America",
-            "Geography and geo-humanities",
-            "digital activism and advocacy",
-            "Asian studies",
-            "information retrieval and querying algorithms and methods",
-            "crowdsourcing",
-            "First nations and indigenous studies",
-            "Informatics",
-            "image processing and analysis",
-            "Feminist studies",
-            "Philology",
-            "Musicology",
-            "semantic analysis",
-            "attribution studies and stylometric analysis",
-            "Gender and sexuality studies",
-            "bibliographic analysis",
-            "electronic literature production and analysis",
-            "Spanish",
-            "History of science",
-            "digitization (2D & 3D)",
-            "data, object, and artefact preservation",
-            "Design studies",
-            "Communication studies",
-            "African and African American Studies",
-            "Performance Studies: Dance, Theatre",
-            "Central/Eastern European Studies",
-            "Philosophy",
-            "Literacy, composition, and creative writing",
-            "Sociology",
-            "French",
-            "open access methods",
-            "digital biography, personography, and prosopography",
-            "Translation studies",
-            "Theology and religious studies",
-            "Law and legal studies",
-            "Australia/Oceania",
-            "digital ecologies and digital communities creation management and analysis",
-            "rhetorical analysis",
-            "Galleries and museum studies",
-            "Archaeology",
-            "physical & minimal computing",
-            "Political science",
-            "Anthropology",
-            "user experience design and analysis",
-            "eco-criticism and environmental analysis",
-            "Film and cinema arts studies",
-            "Environmental, ocean, and waterway studies",
-            "Chicano/a/x, Latino/a/x studies",
-            "mixed-media analysis",
-            "optical character recognition and handwriting recognition",
-            "ethnographic analysis",
-            "digital art production and analysis",
-            "mobile applications development and analysis",
-            "Games studies",
-            "South Asian studies",
-            "systems and information architecture and usability",
-            "Cognitive sciences and psychology",
-            "concordancing and indexing",
-            "Disability and differently-abled studies",
-            "Language acquisition",
-            "3D printing, critical making",
-            "media archaeology",
-            "Logic and epistemology",
-            "Ethnography and folklore",
-            "Transgender and non-binary studies",
-            "Statistics",
-        ]
+    def match_queryset(self):
+        return models.Work.objects.filter(conference=self.conference)
 
-        for t in allowed_topics:
-            res = models.Topic.objects.get_or_create(title=t)
-            print(res)
+    def before_load(self):
+        # Create the whole vocabulary, whether or not every topic gets used
+        self.topics.resolve(ALLOWED_TOPICS, self.report)
 
-        with open("/vol/data/metadata_V4.csv", "r") as csvfile:
-            reader = csv.DictReader(csvfile)
-            adho2020 = models.Conference.objects.get(id=495)
-            for work in reader:
-                # Get work
-                print(work["title_plain"])
-                target_work = models.Work.objects.get(
-                    conference=adho2020, title=work["title_plain"]
-                )
-                print(target_work)
-                # Check allowed topics
-                topics = work["topics"]
-                matching_topic_strings = [t for t in allowed_topics if t in topics]
-                print(matching_topic_strings)
-                # Add matching ones
-                if len(matching_topic_strings) < 1:
-                    raise
-                for t in matching_topic_strings:
-                    target_work.topics.add(models.Topic.objects.get(title=t))
 
+class Command(CSVLoadCommand):
+    help = "Add DH 2020 topics to works already loaded by import_2020"
+    loader_class = WorkTopicLoader
+    loader_options = ("conference",)
+    default_filepath = "/vol/data/metadata_V4.csv"
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--conference",
+            type=int,
+            default=495,
+            help="Primary key of the conference that the works belong to.",
+        )
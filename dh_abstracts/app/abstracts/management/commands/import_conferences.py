@@ -1,116 +1,121 @@
-from glob import glob
-from django.core.management.base import BaseCommand
 from abstracts import models
-import re
-import csv
+from abstracts.bulk_load import (
+    CSVLoadCommand,
+    CSVLoader,
+    InstitutionLookup,
+    Lookup,
+    OrganizerLookup,
+    split_values,
+)
+from abstracts.matching import InstitutionIndex
 import datetime
-from django.db import transaction
 
 
-def get_country(s):
+def parse_date(value):
     try:
-        return models.Country.objects.get(names__name=s)
-    except:
+        return datetime.datetime.strptime(value, "%m/%d/%Y")
+    except ValueError:
         return None
 
 
-def get_organizer(s):
-    try:
-        return models.Organizer.objects.get(abbreviation=s)
-    except:
-        try:
-            return models.Organizer.objects.get(name=s)
-        except:
-            return models.Organizer.objects.create(name=s, abbreviation=s)
-
-
-class Command(BaseCommand):
-    help = "One-time load of DH conferences spreadsheet into the database"
-
-    def add_arguments(self, parser):
-        parser.add_argument("filepath", nargs="+")
-
-    @transaction.atomic
-    def handle(self, *args, **options):
-
-        with open(options["filepath"][0], newline="") as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                # Find/create hosting institutions
-                print(row)
-                this_country = get_country(row["Country"])
-                hosting_institutions = []
-                if row["Hosting Institution(s) Location"] != "":
-                    for inst in row["Hosting Institution(s) Location"].split(";"):
-                        this_institution = models.Institution.objects.get_or_create(
-                            name=inst
-                        )[0]
-                        # Add city and country info if it's not there already
-                        if this_institution.city == "":
-                            this_institution.city = row["City"]
-                            this_institution.country = this_country
-                            this_institution.save()
-                        hosting_institutions.append(this_institution)
-
-                # Find/create organizations
-                conf_organizers = []
-                if row["Professional/Regional Organization (if applicable)"] != "":
-                    for org in row[
-                        "Professional/Regional Organization (if applicable)"
-                    ].split(";"):
-                        this_org = get_organizer(org)
-                        conf_organizers.append(this_org)
-
-                format_str = "%m/%d/%Y"
-
-                try:
-                    start_date = datetime.datetime.strptime(
-                        row["Start Date"], format_str
+class ConferenceLoader(CSVLoader):
+    model = models.Conference
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.institutions = InstitutionIndex()
+        self.series = Lookup(
+            models.ConferenceSeries,
+            ("abbreviation",),
+            new=lambda abbreviation: models.ConferenceSeries(
+                abbreviation=abbreviation, title=abbreviation
+            ),
+        )
+        self.fields = {
+            "year": lambda row: int(row["Year"]),
+            "theme_title": "Theme Title",
+            "short_title": "Hosting Institution(s) Location",
+            "start_date": lambda row: parse_date(row["Start Date"]),
+            "end_date": lambda row: parse_date(row["End Date"]),
+            "city": "City",
+            "state_province_region": "State/Province/Region",
+            "country_id": self.country,
+            "url": "URL",
+            "references": "Reference",
+            "notes": "Notes",
+            "contributors": lambda row: row["Contributors of Details"].rstrip(","),
+            "attendance": "Attendance",
+        }
+        self.many_to_many = {
+            "organizers": (
+                lambda row: split_values(
+                    row["Professional/Regional Organization (if applicable)"]
+                ),
+                OrganizerLookup(),
+            ),
+            "hosting_institutions": (
+                lambda row: [
+                    (inst, row["City"], self.country(row))
+                    for inst in split_values(row["Hosting Institution(s) Location"])
+                ],
+                InstitutionLookup(self.institutions),
+            ),
+        }
+
+    def country(self, row):
+        return self.institutions.country(row["Country"])
+
+    def series_numbers(self, row):
+        # "ABBR - 12;OTHER - 3"
+        return [
+            (abbreviation, int(number))
+            for abbreviation, number in (
+                s.split(" - ") for s in split_values(row["Recurring Title"])
+            )
+        ]
+
+    def read_row(self, row):
+        # Parse the series column up front so that a malformed one skips the row
+        self.series_numbers(row)
+        return super().read_row(row)
+
+    def after_save(self, saved):
+        # Fill in the location of hosting institutions that don't have one yet
+        hosting_institutions = self.many_to_many["hosting_institutions"][1]
+        located = {}
+        for row, conference in saved:
+            for key in self.many_to_many["hosting_institutions"][0](row):
+                institution = hosting_institutions.get(key)
+                if institution is not None and institution.city == "":
+                    institution.city = row["City"]
+                    institution.country_id = conference.country_id
+                    located[institution.pk] = institution
+        models.Institution.objects.bulk_update(located.values(), ["city", "country"])
+
+        self.series.resolve(
+            [s for row, _ in saved for s, _ in self.series_numbers(row)], self.report
+        )
+        untitled = {}
+        memberships = []
+        for row, conference in saved:
+            for abbreviation, number in self.series_numbers(row):
+                series = self.series.get(abbreviation)
+                if series.title == "":
+                    series.title = abbreviation
+                    untitled[series.pk] = series
+                memberships.append(
+                    models.SeriesMembership(
+                        conference=conference, series=series, number=number
                     )
-                except:
-                    start_date = None
-                try:
-                    end_date = datetime.datetime.strptime(row["End Date"], format_str)
-                except:
-                    end_date = None
-
-                # Create the base conference
-                conference = models.Conference.objects.create(
-                    year=int(row["Year"]),
-                    theme_title=row["Theme Title"],
-                    short_title=row["Hosting Institution(s) Location"],
-                    start_date=start_date,
-                    end_date=end_date,
-                    city=row["City"],
-                    state_province_region=row["State/Province/Region"],
-                    country=this_country,
-                    url=row["URL"],
-                    references=row["Reference"],
-                    notes=row["Notes"],
-                    contributors=row["Contributors of Details"].rstrip(","),
-                    attendance=row["Attendance"],
-                    primary_contact=row["Primary Contact"],
                 )
+        models.ConferenceSeries.objects.bulk_update(untitled.values(), ["title"])
+        models.SeriesMembership.objects.bulk_create(memberships)
+        self.report.created["SeriesMembership"] += len(memberships)
 
-                conference.organizers.set(conf_organizers)
-                conference.hosting_institutions.set(hosting_institutions)
+        # Build the search text from the organizers, series and hosts saved above
+        models.Conference.refresh_search_text([c.pk for _, c in saved])
 
-                # Create and set series
-                if row["Recurring Title"] != "":
-                    for series_string in row["Recurring Title"].split(";"):
-                        split_series = series_string.split(" - ")
-                        series = models.ConferenceSeries.objects.get_or_create(
-                            abbreviation=split_series[0]
-                        )[0]
-                        if series.title == "":
-                            series.title = split_series[0]
-                            series.save()
-                        membership = models.SeriesMembership.objects.create(
-                            conference=conference,
-                            series=series,
-                            number=int(split_series[1]),
-                        )
 
-                print(conference)
-                print(conf_organizers)
-                print(hosting_institutions)
+class Command(CSVLoadCommand):
+    help = "Load a DH conferences spreadsheet into the database"
+    loader_class = ConferenceLoader
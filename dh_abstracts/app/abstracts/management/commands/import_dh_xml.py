@@ -4,10 +4,11 @@ Import Works
 
 from abstracts.models import Conference
 from django.core.management.base import BaseCommand
+import zipfile
 
 
 class Command(BaseCommand):
-    help = "Load a directory of ADHO TEI XML files into the database, linking to existing records and creating new ones as needed."
+    help = "Load a directory or zip file of ADHO TEI XML files into the database, linking to existing records and creating new ones as needed."
 
     def add_arguments(self, parser):
         parser.add_argument("filepath", nargs="+")
@@ -24,4 +25,13 @@ class Command(BaseCommand):
         Find conference. If you put in a bad ID, then this stops right away.
         """
         target_conference = Conference.objects.get(pk=options["default_conference"])
-        target_conference.import_xml_directory(options["filepath"][0])
+        filepath = options["filepath"][0]
+        if zipfile.is_zipfile(filepath):
+            import_results = target_conference.import_xml_zip(filepath)
+        else:
+            import_results = target_conference.import_xml_directory(filepath)
+        for err in import_results["failed_files"]:
+            print(f"{err['filepath']}: {err['error']}")
+        print(
+            f"{len(import_results['successful_files'])} files imported, {len(import_results['skipped_files'])} unchanged, {len(import_results['failed_files'])} failed"
+        )
@@ -1,13 +1,31 @@
 from django.core.management.base import BaseCommand
-from django.conf import settings
 from abstracts import models
 
 
 class Command(BaseCommand):
     help = "Refresh appellation autocomplete field on authors"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "author_ids",
+            nargs="*",
+            type=int,
+            help="IDs of the authors to refresh. Refreshes every author by default.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of authors to update per statement.",
+        )
+
     def handle(self, *args, **options):
-        for author in models.Author.objects.all():
-            print(author.id)
-            author.save()
-            print(author.appellations_index)
+        def progress(n_processed, n_authors):
+            print(f"{n_processed}/{n_authors} authors refreshed")
+
+        n_changed = models.Author.reindex_appellations(
+            author_ids=options["author_ids"] or None,
+            batch_size=options["batch_size"],
+            progress=progress,
+        )
+        print(f"{n_changed} appellation indexes changed")
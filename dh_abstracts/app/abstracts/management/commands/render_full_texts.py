@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from abstracts import models
+
+
+class Command(BaseCommand):
+    help = "Store the HTML rendition and summary of work full texts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Re-render every work, not just those that have never been rendered.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of full texts to load and update at once.",
+        )
+
+    def handle(self, *args, **options):
+        def progress(n_processed, n_works):
+            print(f"{n_processed}/{n_works} works rendered")
+
+        n_rendered = models.Work.render_full_texts(
+            rerender=options["all"],
+            batch_size=options["batch_size"],
+            progress=progress,
+        )
+        print(f"{n_rendered} full texts rendered")
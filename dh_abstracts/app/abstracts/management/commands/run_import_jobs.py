@@ -0,0 +1,39 @@
+"""
+Run queued TEI import jobs
+"""
+
+from abstracts.models import ImportJob
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+import time
+
+
+class Command(BaseCommand):
+    help = "Import TEI zip files uploaded through the conference XML import page, polling for new jobs until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once there are no more queued jobs instead of waiting for new ones.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2,
+            help="Seconds to wait between checks for new jobs.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            job = ImportJob.claim_next()
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+                # Don't hold on to connections the database has dropped while idle
+                close_old_connections()
+                continue
+            print(f"Running {job}")
+            job.run()
+            print(f"Finished {job}")
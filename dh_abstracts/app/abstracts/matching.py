@@ -0,0 +1,149 @@
+"""
+In-memory resolution of institution and country names for imports.
+
+Every institution and country label is loaded once into dictionaries keyed by a
+normalized form of the name, so that matching an affiliation costs no queries
+and does not depend on database row order.
+"""
+
+from collections import defaultdict
+from difflib import SequenceMatcher
+from django.db.models import Count
+from abstracts import models
+import heapq
+import re
+import unicodedata
+
+WORD = re.compile(r"\w+")
+
+# Minimum difflib similarity ratio for a fuzzy institution match
+FUZZY_CUTOFF = 0.9
+FUZZY_CANDIDATES = 5
+
+
+def normalize_name(name):
+    """
+    Reduce a name to a lookup key: case, accents, punctuation, spacing, "&" vs. "and", and a leading "the" are ignored
+    """
+    decomposed = unicodedata.normalize("NFKD", name.casefold().replace("&", " and "))
+    words = WORD.findall("".join(c for c in decomposed if not unicodedata.combining(c)))
+    if words[:1] == ["the"]:
+        words = words[1:]
+    return " ".join(words)
+
+
+def similarity(key, candidate):
+    """
+    The difflib similarity ratio of a candidate name to a looked up one, scored as difflib.get_close_matches does, or 0 if it is below FUZZY_CUTOFF
+    """
+    matcher = SequenceMatcher()
+    matcher.set_seq2(key)
+    matcher.set_seq1(candidate)
+    if (
+        matcher.real_quick_ratio() >= FUZZY_CUTOFF
+        and matcher.quick_ratio() >= FUZZY_CUTOFF
+    ):
+        ratio = matcher.ratio()
+        if ratio >= FUZZY_CUTOFF:
+            return ratio
+    return 0
+
+
+class InstitutionIndex:
+    """
+    Match institution and country names against everything in the database, loaded with a few queries.
+
+    Institutions created while importing should be passed to add(), so that later rows in the same import match them. If their creation is rolled back, discard_added() forgets them again.
+    """
+
+    def __init__(self):
+        self.institutions = defaultdict(list)
+        # The closest existing names to each name that had no exact match, as (similarity, key) pairs, best first
+        self.fuzzy_matches = {}
+        # Institutions passed to add(), in order
+        self.added = []
+        for institution in models.Institution.objects.order_by("pk"):
+            self.institutions[normalize_name(institution.name)].append(institution)
+
+        # A label shared by several countries resolves to the one with the most institutions
+        labels = list(models.CountryLabel.objects.values_list("name", "country_id"))
+        ranked_countries = {}
+        for country_id, pref_name, n_institutions in models.Country.objects.annotate(
+            n_institutions=Count("institutions")
+        ).values_list("id", "pref_name", "n_institutions"):
+            ranked_countries[country_id] = (n_institutions, -country_id)
+            labels.append((pref_name, country_id))
+        self.countries = {}
+        for name, country_id in labels:
+            key = normalize_name(name)
+            current = self.countries.get(key)
+            if (
+                current is None
+                or ranked_countries[country_id] > ranked_countries[current]
+            ):
+                self.countries[key] = country_id
+
+    def add(self, institution):
+        key = normalize_name(institution.name)
+        if key not in self.institutions:
+            # A new name may be a closer match for names already looked up, and is the only one they need comparing with
+            for missed_key, matches in self.fuzzy_matches.items():
+                score = similarity(missed_key, key)
+                if score > 0:
+                    self.fuzzy_matches[missed_key] = heapq.nlargest(
+                        FUZZY_CANDIDATES, matches + [(score, key)]
+                    )
+        self.institutions[key].append(institution)
+        self.added.append(institution)
+
+    def discard_added(self, since=0):
+        """
+        Forget the institutions passed to add() after the first `since` of them
+        """
+        removed_keys = set()
+        for institution in self.added[since:]:
+            key = normalize_name(institution.name)
+            self.institutions[key].remove(institution)
+            if len(self.institutions[key]) == 0:
+                del self.institutions[key]
+                removed_keys.add(key)
+        del self.added[since:]
+        # Names that matched a removed one may have a runner-up, so they are looked up again
+        self.fuzzy_matches = {
+            missed_key: matches
+            for missed_key, matches in self.fuzzy_matches.items()
+            if removed_keys.isdisjoint(k for _, k in matches)
+        }
+
+    def country(self, name):
+        """
+        Return the ID of the country with this name or alias, or None
+        """
+        return self.countries.get(normalize_name(name))
+
+    def match(self, name, country_id=None):
+        """
+        Return the best existing Institution for a name, or None.
+
+        An exact match on the normalized name is preferred, in the given country if possible. Otherwise the closest similar name is accepted, as long as it is in the given country whenever one is known. Names that normalize to nothing, such as an empty name, only match exactly.
+        """
+        key = normalize_name(name)
+        candidates = self.institutions.get(key)
+        if candidates:
+            for institution in candidates:
+                if institution.country_id == country_id:
+                    return institution
+            return candidates[0]
+        if key == "":
+            return None
+
+        if key not in self.fuzzy_matches:
+            scores = ((similarity(key, k), k) for k in self.institutions.keys())
+            self.fuzzy_matches[key] = heapq.nlargest(
+                FUZZY_CANDIDATES, (pair for pair in scores if pair[0] > 0)
+            )
+        for _, similar_key in self.fuzzy_matches[key]:
+            for institution in self.institutions[similar_key]:
+                if country_id is None or institution.country_id in (None, country_id):
+                    return institution
+        return None
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.14 on 2026-10-19 18:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('abstracts', '0076_auto_20210108_1230'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('upload_path', models.CharField(help_text='Uploaded zip file, removed once the job has finished', max_length=500)),
+                ('status', models.CharField(choices=[('q', 'Queued'), ('v', 'Validating files'), ('w', 'Writing to the database'), ('s', 'Imported'), ('f', 'Failed')], db_index=True, default='q', max_length=1)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('n_files', models.PositiveIntegerField(default=0)),
+                ('n_processed', models.PositiveIntegerField(default=0)),
+                ('successful_files', models.JSONField(default=list)),
+                ('failed_files', models.JSONField(default=list, help_text='List of {filepath, error} for each file that failed')),
+                ('error', models.TextField(blank=True, default='', help_text='Error that stopped the whole job, if any')),
+                ('conference', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='abstracts.conference')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.14 on 2026-10-19 18:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abstracts', '0077_import_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileimporttries',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 of the imported file', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='fileimporttries',
+            name='work',
+            field=models.ForeignKey(blank=True, help_text='Work created or matched by this import', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_attempts', to='abstracts.work'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='skipped_files',
+            field=models.JSONField(default=list, help_text='Files already imported into the conference with the same contents'),
+        ),
+        migrations.AddField(
+            model_name='work',
+            name='full_text_hash',
+            field=models.CharField(default='', editable=False, help_text='SHA-256 of the full text, used to match re-imported works without comparing entire texts', max_length=64),
+        ),
+        # Same digest as abstracts.tei.content_hash(work.full_text.encode("utf-8"))
+        migrations.RunSQL(
+            "UPDATE abstracts_work SET full_text_hash = encode(sha256(convert_to(full_text, 'UTF8')), 'hex')",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='fileimporttries',
+            index=models.Index(fields=['conference', 'content_hash'], name='abstracts_f_confere_d99698_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='work',
+            index=models.Index(fields=['conference', 'full_text_hash'], name='abstracts_w_confere_c1096b_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.14 on 2026-10-19 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abstracts', '0078_content_hashes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='work',
+            name='full_text_html',
+            field=models.TextField(editable=False, help_text='The full text as HTML paragraphs for the work page, or null if it has not been rendered yet', null=True),
+        ),
+        migrations.AddField(
+            model_name='work',
+            name='full_text_summary',
+            field=models.TextField(blank=True, default='', editable=False, help_text='The start of the full text as plain text, for link previews'),
+        ),
+    ]
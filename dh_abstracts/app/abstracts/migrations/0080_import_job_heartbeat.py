@@ -0,0 +1,26 @@
+# Generated by Django 3.2.14 on 2026-10-19 20:03
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def start_heartbeats(apps, schema_editor):
+    # Jobs running during the upgrade last reported progress no later than they started
+    ImportJob = apps.get_model("abstracts", "ImportJob")
+    ImportJob.objects.filter(heartbeat__isnull=True).update(heartbeat=F("started"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abstracts', '0079_full_text_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, help_text="Last time the job's runner reported progress", null=True),
+        ),
+        migrations.RunPython(start_heartbeats, migrations.RunPython.noop),
+    ]
@@ -1,19 +1,31 @@
 import datetime
-from django.db import models, DatabaseError, transaction
-from django.db.models import Max, Count
+import os
+import time
+import zipfile
+from django.db import models, connection, DatabaseError, transaction
+from django.db.models import Max, Count, Q, ExpressionWrapper
+from django.db.models.functions import Length
 from django.utils import timezone
 from django.urls import reverse
+from django.utils.html import linebreaks, strip_tags
 from django.contrib.sites.models import Site
 from django.contrib.redirects.models import Redirect
 from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.contrib.auth.models import User
 from filer.fields.file import FilerFileField
-from os.path import basename
+from os.path import basename, exists
 from glob import glob
-from lxml import etree
-import html
-import re
+from django.conf import settings
+from .tei import (
+    content_hash,
+    parse_tei_file,
+    parse_tei_files,
+    parse_tei_zip_members,
+    zip_tei_members,
+    TEIZipError,
+)
+from .templatetags.query_filters import reduce_lines
 
 
 class ChangeTrackedModel(models.Model):
@@ -67,6 +79,14 @@ class ConferenceSeries(models.Model):
         ordering = ["abbreviation"]
 
 
+class ConferenceQuerySet(models.QuerySet):
+    # Long descriptive columns that conference cards in work and author listings never display
+    list_deferred_fields = ("notes", "references", "attendance", "search_text")
+
+    def for_list(self):
+        return self.defer(*self.list_deferred_fields)
+
+
 class Conference(models.Model):
     ENTRY_STATUS = (
         ("n", "Not started"),
@@ -192,6 +212,8 @@ class Conference(models.Model):
         help_text="Any searchable text that should lead to this conference",
     )
 
+    objects = ConferenceQuerySet.as_manager()
+
     class Meta:
         ordering = ["-year"]
 
@@ -206,6 +228,14 @@ class Conference(models.Model):
             .count()
         )
 
+    def build_search_text(self, hosting_objects, series_objects, organizer_objects):
+        return " ".join(
+            [str(self.year), self.short_title, self.city]
+            + [str(hi) for hi in hosting_objects]
+            + [" ".join([sr.title, sr.abbreviation]) for sr in series_objects]
+            + [" ".join([sr.name, sr.abbreviation]) for sr in organizer_objects]
+        )
+
     def save(self, *args, **kwargs):
         # Save the object to the DB first so that we can filter on many-to-many relations
         super().save(*args, **kwargs)
@@ -217,16 +247,31 @@ class Conference(models.Model):
             conferences_organized=self
         ).distinct()
         # Generate the search text string and save again before returning
-        new_search_text = " ".join(
-            [str(self.year), self.short_title, self.city]
-            + [str(hi) for hi in hosting_objects]
-            + [" ".join([sr.title, sr.abbreviation]) for sr in series_objects]
-            + [" ".join([sr.name, sr.abbreviation]) for sr in organizer_objects]
+        self.search_text = self.build_search_text(
+            hosting_objects, series_objects, organizer_objects
         )
-        self.search_text = new_search_text
         res = super().save(*args, **kwargs)
         return res
 
+    @classmethod
+    def refresh_search_text(cls, conference_ids):
+        """
+        Rebuild the search text of many conferences at once, e.g. after their hosting institutions were merged, with a fixed number of queries
+        """
+        conferences = list(
+            cls.objects.filter(pk__in=conference_ids).prefetch_related(
+                "hosting_institutions", "series", "organizers"
+            )
+        )
+        for conference in conferences:
+            conference.search_text = conference.build_search_text(
+                conference.hosting_institutions.all(),
+                # A conference can be in the same series more than once
+                dict.fromkeys(conference.series.all()),
+                conference.organizers.all(),
+            )
+        cls.objects.bulk_update(conferences, ["search_text"])
+
     def __str__(self):
         if self.short_title != "":
             return f"{self.year} - {self.short_title}"
@@ -249,116 +294,203 @@ class Conference(models.Model):
     def get_absolute_url(self):
         return reverse("conference_edit", kwargs={"pk": self.pk})
 
-    def import_xml_directory(self, dirpath):
+    def import_xml_directory(self, dirpath, progress=None):
+        """
+        Import every TEI file in a directory, or none of them if any fail.
+
+        `progress`, if given, is called with (ImportJob status code, files processed, total files) as validation proceeds and again once writing starts.
+        """
         all_files = glob(f"{dirpath}/**/*.xml", recursive=True)
+        return self.import_parsed_tei(
+            parse_tei_files(all_files, workers=settings.TEI_IMPORT_WORKERS),
+            len(all_files),
+            progress,
+        )
+
+    def import_xml_zip(self, zip_path, progress=None):
+        """
+        Import every TEI file in a zip archive, or none of them if any fail, reading them straight from the archive rather than extracting it.
+
+        Raises TEIZipError without importing anything if the archive is over the TEI_ZIP_* size limits.
+        """
+        with zipfile.ZipFile(zip_path) as zf:
+            members = zip_tei_members(
+                zf,
+                max_members=settings.TEI_ZIP_MAX_MEMBERS,
+                max_member_size=settings.TEI_ZIP_MAX_MEMBER_SIZE,
+                max_total_size=settings.TEI_ZIP_MAX_TOTAL_SIZE,
+            )
+            return self.import_parsed_tei(
+                parse_tei_zip_members(zf, members, workers=settings.TEI_IMPORT_WORKERS),
+                len(members),
+                progress,
+            )
+
+    def import_parsed_tei(self, parse_results, n_files, progress=None):
+        """
+        Write the results of abstracts.tei.parse_tei_files into this conference if every file parsed, rolling back if any file fails to write.
+
+        Files whose exact contents were already imported into this conference, and whose work still exists, are skipped.
+        """
+        from .matching import InstitutionIndex
+        from .tei_import import TEIRecordWriter
+
+        if progress is None:
+            progress = lambda status, n_processed, n_files: None
+        # Parse and validate every file in parallel first, so all malformed files are reported at once and nothing is written if any are found
+        parsed_files = []
+        progress("v", 0, n_files)
+        for parsed in parse_results:
+            parsed_files.append(parsed)
+            progress("v", len(parsed_files), n_files)
+        successful_files = [p["filepath"] for p in parsed_files if p["error"] is None]
+        failed_files = [
+            {"filepath": p["filepath"], "error": p["error"]}
+            for p in parsed_files
+            if p["error"] is not None
+        ]
+        if len(failed_files) > 0:
+            return {
+                "successful_files": successful_files,
+                "skipped_files": [],
+                "failed_files": failed_files,
+            }
+
+        unchanged_hashes = set(
+            FileImportTries.objects.filter(
+                conference=self,
+                content_hash__in={p["record"]["content_hash"] for p in parsed_files},
+                work__isnull=False,
+            ).values_list("content_hash", flat=True)
+        )
+        skipped_files = [
+            p["filepath"]
+            for p in parsed_files
+            if p["record"]["content_hash"] in unchanged_hashes
+        ]
+        parsed_files = [
+            p
+            for p in parsed_files
+            if p["record"]["content_hash"] not in unchanged_hashes
+        ]
+
+        progress("w", n_files, n_files)
         successful_files = []
-        failed_files = []
         try:
-            # Run the entire loop inside a transaction block, catching per-file errors as they happen. At the end of the loop, if there are any failed files, raise an exception that will roll back all of the imports
+            # Run the entire import inside a transaction block. At the end, if there are any failed files, raise an exception that will roll back all of the imports
             with transaction.atomic():
-                for filepath in all_files:
-                    try:
-                        self.import_xml_file(filepath)
-                        successful_files.append(filepath)
-                    except Exception as e:
-                        failed_files.append({"filepath": filepath, "error": repr(e)})
-                        continue
+                try:
+                    with transaction.atomic():
+                        successful_files = TEIRecordWriter(
+                            self, [p["record"] for p in parsed_files]
+                        ).write()
+                except Exception:
+                    # The batch can't say which file caused an error, so roll it back and write file by file, catching per-file errors as they happen. Each file gets its own savepoint so one failure doesn't abort the others.
+                    institutions = InstitutionIndex()
+                    for parsed in parsed_files:
+                        filepath = parsed["filepath"]
+                        n_added = len(institutions.added)
+                        try:
+                            with transaction.atomic():
+                                self.import_tei_record(
+                                    parsed["record"],
+                                    self.start_import_attempt(
+                                        filepath, parsed["record"]["content_hash"]
+                                    ),
+                                    institutions,
+                                )
+                            successful_files.append(filepath)
+                        except Exception as e:
+                            failed_files.append(
+                                {"filepath": filepath, "error": repr(e)}
+                            )
+                            # Drop institutions the rolled-back file may have added
+                            institutions.discard_added(n_added)
+                            continue
                 if len(failed_files) > 0:
                     raise DatabaseError("Errors found. Rolling back all files")
         except:
             pass
         finally:
-            return {"successful_files": successful_files, "failed_files": failed_files}
+            return {
+                "successful_files": successful_files,
+                "skipped_files": skipped_files,
+                "failed_files": failed_files,
+            }
 
-    def import_xml_file(self, filepath):
+    def start_import_attempt(self, filepath, content_hash=""):
         fn = FileImport.objects.get_or_create(path=filepath)
-        attempt = FileImportTries(file_name=fn[0], conference=self)
-        attempt.save()
-        xml = etree.parse(filepath)
-        xmlschema = etree.XMLSchema(
-            etree.parse("abstracts/static/tei/schema/dh_tei.xsd")
+        attempt = FileImportTries(
+            file_name=fn[0], conference=self, content_hash=content_hash
         )
-        ns = {"tei": "http://www.tei-c.org/ns/1.0"}
-        xmlschema.assertValid(xml)
+        attempt.save()
+        return attempt
 
-        work_type = xml.xpath(
-            "//tei:keywords[@n='category']/tei:term/text()", namespaces=ns
-        )
-        if len(work_type) == 0:
-            raise Exception("Worktype not given as <keyword type='category'>")
-        work_type = work_type[0].lower()
-        # titles + subtitles will result in multiple possible title nodes. We just concatenate them here.
-        work_title = " ".join(
-            xml.xpath("//tei:titleStmt//tei:title/text()", namespaces=ns)
-        ).strip()
-        work_full_text = html.unescape(etree.tostring(
-            xml.xpath("/tei:TEI/tei:text", namespaces=ns)[0], pretty_print=True
-        ).decode("utf-8"))
-        keywords = xml.xpath(
-            "//tei:keywords[@n='keywords']/tei:term/text()", namespaces=ns
-        )
-        topics = xml.xpath(
-            "//tei:keywords[@n='topics']/tei:term/text()",
-            namespaces=ns,
+    def import_xml_file(self, filepath, institutions=None):
+        """
+        Import one TEI file into this conference. Pass an InstitutionIndex to reuse it when importing several files.
+        """
+        record = parse_tei_file(filepath)
+        attempt = self.start_import_attempt(filepath, record["content_hash"])
+        self.import_tei_record(record, attempt, institutions)
+        return filepath
+
+    def import_tei_record(self, record, attempt, institutions=None):
+        """
+        Create a work and its authorships in this conference from a record returned by abstracts.tei.parse_tei_file
+
+        Pass an InstitutionIndex to reuse it across several records.
+        """
+        from .matching import InstitutionIndex
+
+        if institutions is None:
+            institutions = InstitutionIndex()
+        language = Language.objects.get(code=record["language_code"])
+
+        # Look works up by the indexed hash of their text rather than comparing whole texts
+        work_key = Work.import_key(record["title"], record["full_text_hash"])
+        new_work = next(
+            (
+                w
+                for w in Work.objects.filter(
+                    conference=self,
+                    full_text_type="xml",
+                    full_text_hash=record["full_text_hash"],
+                ).order_by("pk")
+                if Work.import_key(w.title, w.full_text_hash) == work_key
+            ),
+            None,
         )
-        language_code = xml.xpath("/tei:TEI/tei:text/@xml:lang", namespaces=ns)
-        if len(language_code) == 0:
-            raise Exception("<text> element does not have a 'lang' attribute")
-        language = Language.objects.get(code=language_code[0])
-
-        new_work = Work.objects.get_or_create(
-            conference=self,
-            title=work_title,
-            work_type=WorkType.objects.get_or_create(title=work_type)[0],
-            full_text=work_full_text,
-            full_text_type="xml",
-        )[0]
+        if new_work is None:
+            new_work = Work.objects.create(
+                conference=self,
+                title=record["title"],
+                work_type=WorkType.objects.get_or_create(title=record["work_type"])[0],
+                full_text=record["full_text"],
+                full_text_type="xml",
+            )
+        attempt.work = new_work
+        attempt.save(update_fields=["work"])
 
         new_work.languages.add(language)
 
-        for kw in keywords:
-            for kkw in re.split("[;,]", kw):
-                target_kw = Keyword.objects.get_or_create(title=kkw.strip().lower())
-                attempt.add_get_or_create_response(target_kw)
-                new_work.keywords.add(target_kw[0])
+        for kw in record["keywords"]:
+            target_kw = Keyword.objects.get_or_create(title=kw)
+            attempt.add_get_or_create_response(target_kw)
+            new_work.keywords.add(target_kw[0])
 
-        for tp in topics:
-            for ttp in re.split("[;,]", tp):
-                target_tp = Topic.objects.get_or_create(title=ttp.lower())
-                attempt.add_get_or_create_response(target_tp)
-                new_work.topics.add(target_tp[0])
+        for tp in record["topics"]:
+            target_tp = Topic.objects.get_or_create(title=tp)
+            attempt.add_get_or_create_response(target_tp)
+            new_work.topics.add(target_tp[0])
 
         """
         Authors
         """
 
-        n_authors = len(
-            xml.xpath(
-                "/tei:TEI/tei:teiHeader/tei:fileDesc/tei:titleStmt/tei:author",
-                namespaces=ns,
-            )
-        )
-        for idx in range(n_authors):
-            first_name = xml.xpath(
-                f"/tei:TEI/tei:teiHeader/tei:fileDesc/tei:titleStmt/tei:author[{idx+1}]/tei:persName/tei:forename/text()",
-                namespaces=ns,
-            )
-            last_name = xml.xpath(
-                f"/tei:TEI/tei:teiHeader/tei:fileDesc/tei:titleStmt/tei:author[{idx+1}]/tei:persName/tei:surname/text()",
-                namespaces=ns,
-            )
-
-            if len(first_name) == 0:
-                first_name = ""
-            else:
-                first_name = first_name[0]
-            if len(last_name) == 0:
-                last_name = ""
-            else:
-                last_name = last_name[0]
-
+        for idx, author in enumerate(record["authors"]):
             target_app = Appellation.objects.get_or_create(
-                first_name=first_name, last_name=last_name
+                first_name=author["first_name"], last_name=author["last_name"]
             )
             attempt.add_get_or_create_response(target_app)
             target_app = target_app[0]
@@ -373,75 +505,28 @@ class Conference(models.Model):
                 target_author = possible_authors.first()
                 attempt.add_create_response(target_author)
 
-            all_affiliations = xml.xpath(
-                f"/tei:TEI/tei:teiHeader/tei:fileDesc/tei:titleStmt/tei:author[{idx+1}]/tei:affiliation",
-                namespaces=ns,
-            )
             final_affiliation_list = []
-            for aff_idx in range(len(all_affiliations)):
-
-                # Get affiliation name if present
-                affiliation_name = xml.xpath(
-                    f"/tei:TEI/tei:teiHeader/tei:fileDesc/tei:titleStmt/tei:author[{idx+1}]/tei:affiliation[{aff_idx + 1}]/tei:orgName/tei:name[@type='sub']/text()",
-                    namespaces=ns,
-                )
-
-                if len(affiliation_name) == 0:
-                    affiliation_name = ""
-                else:
-                    affiliation_name = affiliation_name[0]
-
-                # Match institution if possible
-                institution_name = xml.xpath(
-                    f"/tei:TEI/tei:teiHeader/tei:fileDesc/tei:titleStmt/tei:author[{idx+1}]/tei:affiliation[{aff_idx + 1}]/tei:orgName/tei:name[@type='main']/text()",
-                    namespaces=ns,
+            for affiliation in author["affiliations"]:
+                # Match institution if possible, otherwise create it
+                country_id = institutions.country(affiliation["country"])
+                top_institution = institutions.match(
+                    affiliation["institution"], country_id
                 )
-
-                if len(institution_name) == 0:
-                    institution_name = ""
-                else:
-                    institution_name = institution_name[0]
-                top_institution = Institution.objects.filter(
-                    name__icontains=institution_name
-                ).first()
                 if top_institution is None:
-                    # Try to find country, then create the institution
-                    city_name = xml.xpath(
-                        f"/tei:TEI/tei:teiHeader/tei:fileDesc/tei:titleStmt/tei:author[{idx+1}]/tei:affiliation[{aff_idx + 1}]/tei:district/text()",
-                        namespaces=ns,
-                    )
-                    if len(city_name) == 0:
-                        city_name = ""
-                    else:
-                        city_name = city_name[0]
-
-                    country_name = xml.xpath(
-                        f"/tei:TEI/tei:teiHeader/tei:fileDesc/tei:titleStmt/tei:author[{idx+1}]/tei:affiliation[{aff_idx + 1}]/tei:country/text()",
-                        namespaces=ns,
-                    )
-                    if len(country_name) == 0:
-                        country_name = ""
-                    else:
-                        country_name = country_name[0]
-
-                    top_country = (
-                        Country.objects.filter(names__name=country_name)
-                        .annotate(n_institutions=Count("institutions", distinct=True))
-                        .order_by("-n_institutions")
-                        .first()
-                    )
+                    # Created on its unique key, so that a city differing from an existing row's doesn't clash with it
                     top_institution = Institution.objects.get_or_create(
-                        name=institution_name,
-                        city=city_name,
-                        country=top_country,
+                        name=affiliation["institution"],
+                        country_id=country_id,
+                        defaults={"city": affiliation["city"]},
                     )
                     attempt.add_get_or_create_response(top_institution)
                     top_institution = top_institution[0]
+                    institutions.add(top_institution)
 
                 # Create an affiliation
 
                 top_affiliation = Affiliation.objects.get_or_create(
-                    department=affiliation_name,
+                    department=affiliation["department"],
                     institution=top_institution,
                 )
                 attempt.add_get_or_create_response(top_affiliation)
@@ -458,7 +543,7 @@ class Conference(models.Model):
             for target_affiliation in final_affiliation_list:
                 new_authorship.affiliations.add(target_affiliation)
 
-        return filepath
+        return new_work
 
 
 class ConferenceDocument(models.Model):
@@ -533,6 +618,43 @@ class SeriesMembership(models.Model):
         return f"{self.series.title} - {self.conference}"
 
 
+def remap_m2m(field, mapping):
+    """
+    Move the rows of a many-to-many field's through table from objects on its target side to their replacements, given as {source ID: replacement ID}, in a single statement.
+
+    Objects already linked to a replacement keep their one link. Returns {"removed": links removed from the sources, "added": links added to the replacements, "affected": distinct objects on the other side whose links changed}.
+    """
+    if len(mapping) == 0:
+        return {"removed": 0, "added": 0, "affected": 0}
+    through = field.remote_field.through._meta.db_table
+    owner_column = field.m2m_column_name()
+    target_column = field.m2m_reverse_name()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH mapping (source_id, replacement_id) AS (
+                SELECT * FROM unnest(%s::integer[], %s::integer[])
+            ), removed AS (
+                DELETE FROM {through} USING mapping
+                WHERE {through}.{target_column} = mapping.source_id
+                RETURNING {through}.{owner_column} AS owner_id, mapping.replacement_id
+            ), added AS (
+                INSERT INTO {through} ({owner_column}, {target_column})
+                SELECT DISTINCT owner_id, replacement_id FROM removed
+                ON CONFLICT DO NOTHING
+                RETURNING 1
+            )
+            SELECT
+                (SELECT COUNT(*) FROM removed),
+                (SELECT COUNT(*) FROM added),
+                (SELECT COUNT(DISTINCT owner_id) FROM removed)
+            """,
+            [list(mapping.keys()), list(mapping.values())],
+        )
+        removed, added, affected = cursor.fetchone()
+    return {"removed": removed, "added": added, "affected": affected}
+
+
 class Tag(models.Model):
     title = models.CharField(max_length=100, unique=True, db_index=True)
 
@@ -540,16 +662,24 @@ class Tag(models.Model):
         return self.title
 
     def merge(self, target):
-        results = {}
-        affected_works = self.works.all()
-        for w in affected_works:
-            target.works.add(w)
-        results["update_results"] = affected_works.count()
+        return type(self).multi_merge([self], target)
 
-        # Add the target tag to all the works with the origin tag
-        # remove the origin tag
-        delete_results = self.delete()
-        return results
+    @classmethod
+    def multi_merge(cls, sources, target):
+        """
+        Give the target tag to every work with any of the source tags, then delete the sources.
+
+        Returns {"update_results": works that had a source tag, "added_results": works that newly have the target tag, "delete_results": source tags deleted}.
+        """
+        source_ids = [s.pk for s in sources if s.pk != target.pk]
+        with transaction.atomic():
+            moved = remap_m2m(cls.works.field, {pk: target.pk for pk in source_ids})
+            _, deleted = cls.objects.filter(pk__in=source_ids).delete()
+        return {
+            "update_results": moved["affected"],
+            "added_results": moved["added"],
+            "delete_results": deleted.get(cls._meta.label, 0),
+        }
 
     class Meta:
         abstract = True
@@ -624,6 +754,33 @@ class License(models.Model):
         return self.title
 
 
+class WorkQuerySet(models.QuerySet):
+    list_deferred_fields = ("full_text", "full_text_html", "search_text")
+
+    def with_full_text_flags(self):
+        """
+        Annotate has_full_text and full_text_length, so that templates can describe a full text without it being loaded
+        """
+        return self.annotate(
+            has_full_text=ExpressionWrapper(
+                ~Q(full_text=""), output_field=models.BooleanField()
+            ),
+            full_text_length=Length("full_text"),
+        )
+
+    def for_list(self):
+        """
+        Leave out the full text, its rendition and the search vector, which list pages never display, and annotate the full text flags.
+
+        The same columns of a parent session, and the long columns of a conference, are left out too whenever they are loaded with select_related().
+        """
+        return self.defer(
+            *self.list_deferred_fields,
+            *(f"parent_session__{f}" for f in self.list_deferred_fields),
+            *(f"conference__{f}" for f in ConferenceQuerySet.list_deferred_fields),
+        ).with_full_text_flags()
+
+
 class Work(TextIndexedModel, ChangeTrackedModel):
     model_description = (
         "A record for a single work such as a paper, keynote, or session."
@@ -659,6 +816,23 @@ class Work(TextIndexedModel, ChangeTrackedModel):
         default="",
         help_text="Format of the full text (currently either plain text, or XML)",
     )
+    full_text_hash = models.CharField(
+        max_length=64,
+        editable=False,
+        default="",
+        help_text="SHA-256 of the full text, used to match re-imported works without comparing entire texts",
+    )
+    full_text_html = models.TextField(
+        null=True,
+        editable=False,
+        help_text="The full text as HTML paragraphs for the work page, or null if it has not been rendered yet",
+    )
+    full_text_summary = models.TextField(
+        blank=True,
+        editable=False,
+        default="",
+        help_text="The start of the full text as plain text, for link previews",
+    )
     keywords = models.ManyToManyField(
         Keyword,
         related_name="works",
@@ -699,6 +873,8 @@ class Work(TextIndexedModel, ChangeTrackedModel):
         help_text="If this work was part of a multi-paper organized session, this is the entry for the parent session",
     )
 
+    objects = WorkQuerySet.as_manager()
+
     def get_absolute_url(self):
         return reverse("work_detail", kwargs={"work_id": self.id})
 
@@ -712,7 +888,80 @@ class Work(TextIndexedModel, ChangeTrackedModel):
     def __str__(self):
         return self.display_title
 
+    @staticmethod
+    def import_key(title, full_text_hash):
+        """
+        Works imported into the same conference are the same work when they have the same full text and the same title, give or take case, spacing and punctuation
+        """
+        from .matching import normalize_name
+
+        return (normalize_name(title), full_text_hash)
+
+    @staticmethod
+    def full_text_rendition(full_text, full_text_type):
+        """
+        Return the full_text_html and full_text_summary field values for a full text of the given type
+        """
+        if full_text_type == "xml":
+            text = reduce_lines(strip_tags(full_text))
+        else:
+            text = full_text
+        if full_text_type in ("txt", "xml") and text.strip() != "":
+            html = linebreaks(text, autoescape=True)
+        else:
+            html = ""
+        # As with the truncatechars:197 that link previews used to apply
+        summary = " ".join(text.split())
+        if len(summary) > 197:
+            summary = summary[:196] + "…"
+        return {"full_text_html": html, "full_text_summary": summary}
+
+    def render_full_text(self):
+        for f, v in Work.full_text_rendition(
+            self.full_text, self.full_text_type
+        ).items():
+            setattr(self, f, v)
+
+    @classmethod
+    def render_full_texts(cls, rerender=False, batch_size=500, progress=None):
+        """
+        Store the rendition of every work that hasn't been rendered yet, or of every work with rerender, loading one batch of full texts at a time.
+
+        progress, if given, is called with (works processed, total works) after each batch. Returns the number of works rendered.
+        """
+        works = cls.objects.all()
+        if not rerender:
+            works = works.filter(full_text_html__isnull=True)
+        work_ids = list(works.order_by("pk").values_list("pk", flat=True))
+        for i in range(0, len(work_ids), batch_size):
+            batch = list(
+                cls.objects.filter(pk__in=work_ids[i : i + batch_size]).only(
+                    "full_text", "full_text_type"
+                )
+            )
+            for work in batch:
+                work.render_full_text()
+            cls.objects.bulk_update(batch, ["full_text_html", "full_text_summary"])
+            if progress is not None:
+                progress(i + len(batch), len(work_ids))
+        return len(work_ids)
+
     def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        # Saves that leave the full text alone don't need to hash or render it
+        # again, nor to load it if it was deferred
+        if update_fields is None or not {"full_text", "full_text_type"}.isdisjoint(
+            update_fields
+        ):
+            self.full_text_hash = content_hash(self.full_text.encode("utf-8"))
+            self.render_full_text()
+            if update_fields is not None:
+                kwargs["update_fields"] = [
+                    *update_fields,
+                    "full_text_hash",
+                    "full_text_html",
+                    "full_text_summary",
+                ]
         res = super().save(*args, **kwargs)
         # Update the search index
         Work.objects.filter(id=self.id).update(
@@ -721,8 +970,109 @@ class Work(TextIndexedModel, ChangeTrackedModel):
         )
         return res
 
+    def set_authorships(self, entries, deleted_authors=(), user=None):
+        """
+        Bring this work's authorships in line with an edited list, in a fixed number of statements.
+
+        Each entry is a dict with an "author" (None for a new author), "authorship_order", "first_name", "last_name" and "affiliations". Entries upsert the authorship of their author; the authorships of `deleted_authors` are removed and any others are left alone. Only the authors whose names on this work changed are queued for appellation reindexing.
+        """
+        from .bulk_load import Lookup, LoadReport, add_m2m
+
+        now = timezone.now()
+        current = {
+            a.author_id: a for a in self.authorships.prefetch_related("affiliations")
+        }
+        appellations = Lookup(Appellation, ("first_name", "last_name"))
+        appellations.resolve(
+            [(e["first_name"], e["last_name"]) for e in entries], LoadReport()
+        )
+        new_authors = [Author() for e in entries if e["author"] is None]
+        Author.objects.bulk_create(new_authors)
+        new_author_ids = iter(a.pk for a in new_authors)
+
+        # A later entry for the same author replaces an earlier one
+        wanted = {}
+        for e in entries:
+            author_id = next(new_author_ids) if e["author"] is None else e["author"].pk
+            wanted[author_id] = e
+
+        deleted_ids = {a.pk for a in deleted_authors if a is not None} - set(wanted)
+        Authorship.objects.filter(work=self, author__in=deleted_ids).delete()
+
+        renamed = set(deleted_ids)
+        touched = set(deleted_ids)
+        to_create = []
+        to_update = []
+        for author_id, e in wanted.items():
+            appellation = appellations.get((e["first_name"], e["last_name"]))
+            authorship = current.get(author_id)
+            if authorship is None:
+                authorship = Authorship(
+                    work=self,
+                    author_id=author_id,
+                    authorship_order=e["authorship_order"],
+                    appellation=appellation,
+                    user_last_updated=user,
+                )
+                to_create.append(authorship)
+                renamed.add(author_id)
+            elif (authorship.authorship_order, authorship.appellation_id) != (
+                e["authorship_order"],
+                appellation.pk,
+            ):
+                if authorship.appellation_id != appellation.pk:
+                    renamed.add(author_id)
+                authorship.authorship_order = e["authorship_order"]
+                authorship.appellation = appellation
+                authorship.user_last_updated = user
+                authorship.last_updated = now
+                to_update.append(authorship)
+            current[author_id] = authorship
+        Authorship.objects.bulk_create(to_create)
+        Authorship.objects.bulk_update(
+            to_update,
+            ["authorship_order", "appellation", "user_last_updated", "last_updated"],
+        )
+        created_ids = {a.author_id for a in to_create}
+        touched |= created_ids | {a.author_id for a in to_update}
+
+        # Diff each authorship's affiliations against the submitted ones
+        to_add = []
+        to_remove = Q()
+        for author_id, e in wanted.items():
+            authorship = current[author_id]
+            old = (
+                set()
+                if author_id in created_ids
+                else {a.pk for a in authorship.affiliations.all()}
+            )
+            new = {a.pk for a in e["affiliations"] or []}
+            to_add.extend((authorship.pk, pk) for pk in new - old)
+            if len(old - new) > 0:
+                to_remove |= Q(authorship=authorship, affiliation__in=old - new)
+            if old != new:
+                touched.add(author_id)
+        if len(to_remove) > 0:
+            Authorship.affiliations.through.objects.filter(to_remove).delete()
+        add_m2m(Authorship.affiliations, to_add)
+
+        Author.objects.filter(pk__in=touched).update(
+            user_last_updated=user, last_updated=now
+        )
+        Author.queue_appellation_reindex(renamed)
+        return {
+            "created": len(to_create),
+            "updated": len(to_update),
+            "deleted": len(deleted_ids),
+            "touched_authors": touched,
+            "renamed_authors": renamed,
+        }
+
     class Meta(TextIndexedModel.Meta):
         ordering = ["title"]
+        indexes = TextIndexedModel.Meta.indexes + [
+            models.Index(fields=["conference", "full_text_hash"])
+        ]
 
 
 class Attribute(models.Model):
@@ -786,21 +1136,46 @@ class Country(models.Model):
         return self.pref_name
 
     def merge(self, target):
-        affected_institutions = Institution.objects.filter(country=self)
-
-        # If changing one of those affected countries to the new one would create an Institution that already exists, then merge that institution into the existing one
+        return type(self).multi_merge([self], target)
 
-        merges = []
-        for inst in affected_institutions:
-            if Institution.objects.filter(name=inst.name, country=target).exists():
-                merges.append(inst.merge(target))
-            # Otherwise just reassign the country
-            else:
-                inst.country = target
-                inst.save()
+    @classmethod
+    def multi_merge(cls, sources, target):
+        """
+        Move the institutions, conferences and labels of the source countries to the target country, then delete the sources.
 
-        merges.append(self.delete())
-        return merges
+        An institution whose name the target country already has (or that several source countries share) is merged into that one institution instead of being moved.
+        """
+        source_ids = [s.pk for s in sources if s.pk != target.pk]
+        with transaction.atomic():
+            # For each institution name, keep the target country's institution, or else the oldest one
+            institutions = sorted(
+                Institution.objects.filter(
+                    country__in=source_ids + [target.pk]
+                ).values_list("pk", "name", "country_id"),
+                key=lambda i: (i[2] != target.pk, i[0]),
+            )
+            survivors = {}
+            duplicates = {}
+            for pk, name, _ in institutions:
+                if name in survivors:
+                    duplicates[pk] = survivors[name]
+                else:
+                    survivors[name] = pk
+            institution_results = Institution.remap(duplicates)
+            moved = Institution.objects.filter(
+                pk__in=list(survivors.values()), country__in=source_ids
+            ).update(country=target)
+            updated_conferences = Conference.objects.filter(
+                country__in=source_ids
+            ).update(country=target)
+            CountryLabel.objects.filter(country__in=source_ids).update(country=target)
+            _, deleted = cls.objects.filter(pk__in=source_ids).delete()
+        return {
+            "update_results": moved,
+            "merged_institutions": institution_results["delete_results"],
+            "updated_conferences": updated_conferences,
+            "delete_results": deleted.get(cls._meta.label, 0),
+        }
 
     class Meta:
         ordering = ["pref_name"]
@@ -849,34 +1224,56 @@ class Institution(ChangeTrackedModel):
         return self.name
 
     def merge(self, target):
-        affected_affiliations = Affiliation.objects.filter(institution=self)
-        affected_conferences = Conference.objects.filter(hosting_institutions=self)
-
-        # If changing one of those affect afiliations to the new institution would create an affiliation that already exists, then reassign those authorships to the already-existing affiliation
-        results = {"update_results": affected_affiliations.count()}
-        for aff in affected_affiliations:
-            if Affiliation.objects.filter(
-                department=aff.department, institution=target
-            ).exists():
-                replacement_aff = Affiliation.objects.get(
-                    department=aff.department, institution=target
-                )
+        return type(self).multi_merge([self], target)
 
-                for affected_auth in Authorship.objects.filter(affiliations=aff).all():
-                    affected_auth.affiliations.remove(aff)
-                    affected_auth.affiliations.add(replacement_aff)
-                # Otherwise, we can just reassign the institution
-            else:
-                aff.institution = target
-                aff.save()
-        for conf in affected_conferences:
-            conf.hosting_institutions.remove(self)
-            conf.hosting_institutions.add(target)
-            conf.save()
-
-        # Finally, delete the old institution
-        self.delete()
-        return results
+    @classmethod
+    def multi_merge(cls, sources, target):
+        return cls.remap({s.pk: target.pk for s in sources if s.pk != target.pk})
+
+    @classmethod
+    def remap(cls, mapping):
+        """
+        Merge institutions into their replacements, given as {source ID: replacement ID}, then delete the sources.
+
+        A source's affiliations move to its replacement, unless the replacement already has (or another source brings) an affiliation with the same department, in which case the authorships are re-pointed to that one affiliation. Conferences hosted by a source are hosted by its replacement instead. Everything happens in a fixed number of statements however many affiliations, authorships and conferences are involved.
+        """
+        with transaction.atomic():
+            # For each (final institution, department), keep the affiliation that is already there, or else the oldest one
+            affiliations = sorted(
+                Affiliation.objects.filter(
+                    institution__in=set(mapping) | set(mapping.values())
+                ).values_list("pk", "department", "institution_id"),
+                key=lambda a: (a[2] in mapping, a[0]),
+            )
+            survivors = {}
+            duplicates = {}
+            moved = []
+            for pk, department, institution_id in affiliations:
+                key = (mapping.get(institution_id, institution_id), department)
+                if key in survivors:
+                    duplicates[pk] = survivors[key]
+                else:
+                    survivors[key] = pk
+                    if institution_id in mapping:
+                        moved.append(Affiliation(pk=pk, institution_id=key[0]))
+            affiliation_results = Affiliation.remap(duplicates)
+            Affiliation.objects.bulk_update(moved, ["institution"])
+
+            affected_conferences = list(
+                Conference.objects.filter(hosting_institutions__in=list(mapping))
+                .values_list("pk", flat=True)
+                .distinct()
+            )
+            remap_m2m(Conference.hosting_institutions.field, mapping)
+            Conference.refresh_search_text(affected_conferences)
+
+            _, deleted = cls.objects.filter(pk__in=list(mapping)).delete()
+        return {
+            "update_results": len([a for a in affiliations if a[2] in mapping]),
+            "updated_authorships": affiliation_results["update_results"],
+            "updated_conferences": len(affected_conferences),
+            "delete_results": deleted.get(cls._meta.label, 0),
+        }
 
     @property
     def public_affiliated_authors(self):
@@ -929,20 +1326,26 @@ class Affiliation(Attribute):
         return Author.objects.filter(authorships__affiliations=self).distinct().count()
 
     def merge(self, target):
-        # Don't edit authorships where the target affiliaiton is already # present. It'll get deleted eventually.
-        affected_authorships = (
-            Authorship.objects.filter(affiliations=self)
-            .exclude(affiliations=target)
-            .all()
-        )
+        return type(self).multi_merge([self], target)
 
-        results = {"update_results": affected_authorships.count()}
-        for authorship in affected_authorships:
-            authorship.affiliations.add(target)
-            authorship.save()
+    @classmethod
+    def multi_merge(cls, sources, target):
+        return cls.remap({s.pk: target.pk for s in sources if s.pk != target.pk})
 
-        self.delete()
-        return results
+    @classmethod
+    def remap(cls, mapping):
+        """
+        Re-point authorships from affiliations to their replacements, given as {source ID: replacement ID}, then delete the sources.
+
+        Returns {"update_results": authorships that newly have a replacement affiliation, "delete_results": affiliations deleted}.
+        """
+        with transaction.atomic():
+            moved = remap_m2m(Authorship.affiliations.field, mapping)
+            _, deleted = cls.objects.filter(pk__in=list(mapping)).delete()
+        return {
+            "update_results": moved["added"],
+            "delete_results": deleted.get(cls._meta.label, 0),
+        }
 
 
 class Author(ChangeTrackedModel):
@@ -979,6 +1382,63 @@ class Author(ChangeTrackedModel):
         self.appellations_index = " ".join([f"{a[0]} {a[1]}" for a in all_appellations])
         super().save(*args, **kwargs)
 
+    @classmethod
+    def reindex_appellations(cls, author_ids=None, batch_size=5000, progress=None):
+        """
+        Recompute appellations_index for the given authors, or for every author, with one UPDATE per batch of authors.
+
+        progress, if given, is called with (authors processed, total authors) after each batch. Returns the number of authors whose index changed.
+        """
+        if author_ids is None:
+            author_ids = cls.objects.order_by("pk").values_list("pk", flat=True)
+        author_ids = sorted(set(author_ids))
+        n_changed = 0
+        with connection.cursor() as cursor:
+            for i in range(0, len(author_ids), batch_size):
+                batch = author_ids[i : i + batch_size]
+                cursor.execute(
+                    """
+                    UPDATE abstracts_author AS author
+                    SET appellations_index = COALESCE(names.appellations_index, '')
+                    FROM unnest(%s::integer[]) AS batch (author_id)
+                    LEFT JOIN (
+                        SELECT
+                            author_id,
+                            string_agg(
+                                first_name || ' ' || last_name,
+                                ' ' ORDER BY last_name, first_name
+                            ) AS appellations_index
+                        FROM (
+                            SELECT DISTINCT
+                                authorship.author_id,
+                                appellation.first_name,
+                                appellation.last_name
+                            FROM abstracts_authorship AS authorship
+                            JOIN abstracts_appellation AS appellation
+                                ON appellation.id = authorship.appellation_id
+                            WHERE authorship.author_id = ANY(%s)
+                        ) AS pairs
+                        GROUP BY author_id
+                    ) AS names ON names.author_id = batch.author_id
+                    WHERE author.id = batch.author_id
+                        AND author.appellations_index
+                            <> COALESCE(names.appellations_index, '')
+                    """,
+                    [batch, batch],
+                )
+                n_changed += cursor.rowcount
+                if progress is not None:
+                    progress(i + len(batch), len(author_ids))
+        return n_changed
+
+    @classmethod
+    def queue_appellation_reindex(cls, author_ids):
+        """
+        Reindex the appellations of these authors in one batch once the current transaction commits
+        """
+        author_ids = list(author_ids)
+        transaction.on_commit(lambda: cls.reindex_appellations(author_ids))
+
     class Meta:
         ordering = ["id"]
 
@@ -1071,8 +1531,8 @@ class Author(ChangeTrackedModel):
             new_path=target.get_absolute_url(),
         )
 
-        # Force-save the target so that its appellation index gets updated
-        target.save()
+        # The target's appellation index now has to include the names it gained
+        Author.queue_appellation_reindex([target.pk])
 
         # Delete self
         deletion_results = self.delete()[1]
@@ -1143,6 +1603,23 @@ class FileImportTries(models.Model):
     started = models.DateTimeField(auto_now_add=True)
     file_name = models.ForeignKey(FileImport, on_delete=models.CASCADE)
     conference = models.ForeignKey(Conference, on_delete=models.CASCADE)
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        help_text="SHA-256 of the imported file",
+    )
+    work = models.ForeignKey(
+        "Work",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="import_attempts",
+        help_text="Work created or matched by this import",
+    )
+
+    class Meta:
+        indexes = [models.Index(fields=["conference", "content_hash"])]
 
     def __str__(self):
         return f"{self.file_name} - {self.started}"
@@ -1160,17 +1637,23 @@ class FileImportTries(models.Model):
 
     def add_get_or_create_response(self, get_or_create_response):
         actual = get_or_create_response[0]
+        self.build_message(type(actual), actual, get_or_create_response[1]).save()
 
-        if get_or_create_response[1]:
-            self.add_message(
-                message=f"Created new {type(actual)} {actual}",
+    def build_message(self, model, label, created):
+        """
+        Return an unsaved "Created new" or "Matched with" message about an object of `model`, so that messages can be bulk created
+        """
+        if created:
+            return FileImportMessgaes(
+                attempt=self,
+                message=f"Created new {model} {label}",
                 addition_type="new",
             )
-        else:
-            self.add_message(
-                message=f"Matched with {type(actual)} {actual}",
-                addition_type="mat",
-            )
+        return FileImportMessgaes(
+            attempt=self,
+            message=f"Matched with {model} {label}",
+            addition_type="mat",
+        )
 
 
 class FileImportMessgaes(models.Model):
@@ -1185,3 +1668,160 @@ class FileImportMessgaes(models.Model):
 
     def __str__(self):
         return self.message
+
+
+class ImportJob(models.Model):
+    """
+    A zip of TEI files uploaded for a conference, imported in the background by the run_import_jobs command
+    """
+
+    STATUS = (
+        ("q", "Queued"),
+        ("v", "Validating files"),
+        ("w", "Writing to the database"),
+        ("s", "Imported"),
+        ("f", "Failed"),
+    )
+    FINISHED_STATUSES = ("s", "f")
+    # Minimum seconds between progress updates written to the database
+    PROGRESS_INTERVAL = 1
+
+    conference = models.ForeignKey(
+        Conference, on_delete=models.CASCADE, related_name="import_jobs"
+    )
+    user = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
+    upload_path = models.CharField(
+        max_length=500,
+        help_text="Uploaded zip file, removed once the job has finished",
+    )
+    status = models.CharField(max_length=1, choices=STATUS, default="q", db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    heartbeat = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Last time the job's runner reported progress",
+    )
+    finished = models.DateTimeField(null=True, blank=True)
+    n_files = models.PositiveIntegerField(default=0)
+    n_processed = models.PositiveIntegerField(default=0)
+    successful_files = models.JSONField(default=list)
+    skipped_files = models.JSONField(
+        default=list,
+        help_text="Files already imported into the conference with the same contents",
+    )
+    failed_files = models.JSONField(
+        default=list, help_text="List of {filepath, error} for each file that failed"
+    )
+    error = models.TextField(
+        blank=True, default="", help_text="Error that stopped the whole job, if any"
+    )
+
+    class Meta:
+        ordering = ["-created"]
+
+    def __str__(self):
+        return f"{self.conference} import {self.pk} ({self.get_status_display()})"
+
+    def get_absolute_url(self):
+        return reverse("import_job_detail", kwargs={"pk": self.pk})
+
+    @property
+    def is_finished(self):
+        return self.status in self.FINISHED_STATUSES
+
+    @classmethod
+    def fail_stale(cls):
+        """
+        Mark unfinished jobs that haven't reported progress for settings.IMPORT_JOB_TIMEOUT seconds as failed, since their runner must have died, and delete their uploads. Returns the number of jobs failed.
+        """
+        cutoff = timezone.now() - datetime.timedelta(
+            seconds=settings.IMPORT_JOB_TIMEOUT
+        )
+        stale_jobs = list(
+            cls.objects.filter(status__in=("v", "w"), heartbeat__lt=cutoff).values_list(
+                "pk", "upload_path"
+            )
+        )
+        if len(stale_jobs) == 0:
+            return 0
+        n_failed = cls.objects.filter(
+            pk__in=[pk for pk, _ in stale_jobs],
+            status__in=("v", "w"),
+            heartbeat__lt=cutoff,
+        ).update(
+            status="f",
+            finished=timezone.now(),
+            error="The import worker stopped before finishing this job",
+        )
+        for _, upload_path in stale_jobs:
+            if exists(upload_path):
+                os.remove(upload_path)
+        return n_failed
+
+    @classmethod
+    def claim_next(cls):
+        """
+        Mark the oldest queued job as started and return it, or None if there are none. Several runners may call this at once without claiming the same job.
+
+        Jobs whose runner died are failed first, so they don't appear to be running forever.
+        """
+        cls.fail_stale()
+        with transaction.atomic():
+            job = (
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(status="q")
+                .order_by("created")
+                .first()
+            )
+            if job is None:
+                return None
+            job.status = "v"
+            job.started = job.heartbeat = timezone.now()
+            job.save(update_fields=["status", "started", "heartbeat"])
+        return job
+
+    def report_progress(self, status, n_processed, n_files):
+        # Skip most intermediate updates so large imports don't write a row per file
+        now = time.monotonic()
+        if (
+            status == self.status
+            and n_processed < n_files
+            and now - getattr(self, "_last_report", 0) < self.PROGRESS_INTERVAL
+        ):
+            return
+        self._last_report = now
+        self.status = status
+        self.n_processed = n_processed
+        self.n_files = n_files
+        self.heartbeat = timezone.now()
+        ImportJob.objects.filter(pk=self.pk).update(
+            status=status,
+            n_processed=n_processed,
+            n_files=n_files,
+            heartbeat=self.heartbeat,
+        )
+
+    def run(self):
+        """
+        Import the uploaded zip into the conference, recording the result on this job
+        """
+        try:
+            import_results = self.conference.import_xml_zip(
+                self.upload_path, progress=self.report_progress
+            )
+            self.successful_files = import_results["successful_files"]
+            self.skipped_files = import_results["skipped_files"]
+            self.failed_files = import_results["failed_files"]
+            self.status = "f" if len(self.failed_files) > 0 else "s"
+        except TEIZipError as e:
+            self.status = "f"
+            self.error = str(e)
+        except Exception as e:
+            self.status = "f"
+            self.error = repr(e)
+        finally:
+            self.finished = timezone.now()
+            self.save()
+            if exists(self.upload_path):
+                os.remove(self.upload_path)
@@ -0,0 +1,125 @@
+"""
+Finding and deleting hanging records that no work refers to any more.
+
+Merges, splits and authorship edits leave behind authors without authorships,
+affiliations and appellations that nobody asserts, institutions with neither
+asserted affiliations nor hosted conferences, and unused keywords and topics.
+OrphanSweeper identifies each kind with a NOT EXISTS anti-join, counts them all
+in one query, and deletes them in bounded batches with plain DELETE statements
+that re-check the anti-join, so nothing is loaded into Python and records that
+gain a reference mid-sweep are left alone.
+"""
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from abstracts.models import (
+    Affiliation,
+    Appellation,
+    Author,
+    Authorship,
+    Conference,
+    Institution,
+    Keyword,
+    Topic,
+    Work,
+)
+
+
+class OrphanSweeper:
+    """
+    Count and delete hanging records, kind by kind in an order where deleting one kind never needs another kind's rows deleted first
+    """
+
+    batch_size = 5000
+    sample_size = 10
+
+    def __init__(self, batch_size=None):
+        if batch_size is not None:
+            self.batch_size = batch_size
+        asserted_affiliations = Authorship.affiliations.through.objects
+        self.querysets = {
+            "Author": Author.objects.filter(
+                ~Exists(Authorship.objects.filter(author=OuterRef("pk")))
+            ),
+            "Affiliation": Affiliation.objects.filter(
+                ~Exists(asserted_affiliations.filter(affiliation=OuterRef("pk")))
+            ),
+            "Institution": Institution.objects.filter(
+                ~Exists(
+                    asserted_affiliations.filter(
+                        affiliation__institution=OuterRef("pk")
+                    )
+                ),
+                ~Exists(
+                    Conference.hosting_institutions.through.objects.filter(
+                        institution=OuterRef("pk")
+                    )
+                ),
+            ),
+            "Keyword": Keyword.objects.filter(
+                ~Exists(Work.keywords.through.objects.filter(keyword=OuterRef("pk")))
+            ),
+            "Topic": Topic.objects.filter(
+                ~Exists(Work.topics.through.objects.filter(topic=OuterRef("pk")))
+            ),
+            "Appellation": Appellation.objects.filter(
+                ~Exists(Authorship.objects.filter(appellation=OuterRef("pk")))
+            ),
+        }
+        # Rows that refer to an orphan and go with it. A hanging institution's affiliations are all unasserted, so they are orphans too.
+        self.cascades = {"Institution": [Affiliation._meta.get_field("institution")]}
+
+    def counts(self):
+        """
+        Return {kind: number of hanging records}, counted in a single query
+        """
+        selects = []
+        params = []
+        for label, qs in self.querysets.items():
+            sql, qs_params = qs.order_by().values("pk").query.sql_with_params()
+            selects.append(f"(SELECT COUNT(*) FROM ({sql}) AS orphans)")
+            params.extend(qs_params)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT {', '.join(selects)}", params)
+            return dict(zip(self.querysets.keys(), cursor.fetchone()))
+
+    def sample(self, label):
+        """
+        A few of the hanging records of one kind, for display
+        """
+        return list(self.querysets[label][: self.sample_size])
+
+    def delete_statement(self, label):
+        qs = self.querysets[label]
+        sql, params = (
+            qs.order_by().values("pk")[: self.batch_size].query.sql_with_params()
+        )
+        table = qs.model._meta.db_table
+        cascades = "".join(
+            f", cascade_{i} AS (DELETE FROM {field.model._meta.db_table} WHERE {field.column} IN (SELECT id FROM batch))"
+            for i, field in enumerate(self.cascades.get(label, []))
+        )
+        return (
+            f"WITH batch AS ({sql}){cascades} DELETE FROM {table} WHERE id IN (SELECT id FROM batch)",
+            params,
+        )
+
+    def delete(self, label):
+        """
+        Delete the hanging records of one kind, one batch per transaction, and return how many were deleted
+        """
+        statement, params = self.delete_statement(label)
+        n_deleted = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(statement, params)
+                n_batch = cursor.rowcount
+            n_deleted += n_batch
+            if n_batch < self.batch_size:
+                return n_deleted
+
+    def sweep(self):
+        """
+        Delete every kind of hanging record and return {kind: number deleted}
+        """
+        return {label: self.delete(label) for label in self.querysets}
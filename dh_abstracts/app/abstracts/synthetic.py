@@ -0,0 +1,596 @@
+"""
+Generation of a synthetic corpus for benchmarking at scale.
+
+CorpusGenerator fills the database with conferences, works, authors and
+everything they refer to, at a multiple of roughly the size of the current
+corpus. The counts of authors per work, affiliations per authorship, keywords
+and topics per work, and the sizes of full texts are drawn from the weighted
+distributions below. Authors are picked by preferential attachment, so a few
+are very prolific while most only ever write one or two works, and
+institutions, keywords and topics are picked with Zipf-like weights, so that
+lists, filters and merges see the same long tails as they do in production.
+
+Everything is written with bulk_create, one batch of works at a time in its own
+transaction, with the search indexes, full text renditions and appellation
+indexes that Work.save and Author.save would have maintained. The same seed and
+scale always produce the same corpus on an empty database.
+"""
+
+from django.contrib.postgres.search import SearchVector
+from django.db import transaction
+from abstracts import models
+from abstracts.bulk_load import add_m2m, Lookup, LoadReport
+from abstracts.tei import content_hash
+from itertools import accumulate
+import random
+
+# Object counts at a scale factor of 1
+BASE_COUNTS = {
+    "works": 9000,
+    "keywords": 8000,
+    "institutions": 2500,
+}
+
+# These don't grow with the number of works: there are only so many conferences
+FIXED_COUNTS = {
+    "conferences": 120,
+    "series": 8,
+    "organizers": 12,
+    "topics": 400,
+}
+
+# {value: weight} distributions, drawn independently for each work or authorship
+AUTHORS_PER_WORK = {1: 38, 2: 25, 3: 15, 4: 9, 5: 5, 6: 3, 7: 2, 8: 1, 10: 1, 15: 0.5}
+AFFILIATIONS_PER_AUTHORSHIP = {0: 10, 1: 76, 2: 11, 3: 3}
+KEYWORDS_PER_WORK = {0: 30, 1: 4, 2: 8, 3: 17, 4: 17, 5: 13, 6: 7, 8: 4}
+TOPICS_PER_WORK = {0: 55, 1: 20, 2: 15, 3: 10}
+FULL_TEXT_TYPES = {"": 25, "txt": 35, "xml": 40}
+WORK_TYPES = {
+    "paper": 45,
+    "long paper": 15,
+    "short paper": 12,
+    "poster": 15,
+    "panel": 6,
+    "workshop": 4,
+    "keynote": 3,
+}
+# Work types whose works are sessions that other works in the same conference belong to
+PARENT_WORK_TYPES = {"panel"}
+PAPERS_PER_SESSION = {2: 1, 3: 4, 4: 3, 5: 1}
+LANGUAGES = {"English": 85, "German": 4, "French": 4, "Spanish": 3, "Italian": 2}
+# ISO 639-1 codes, which TEI imports look languages up by
+LANGUAGE_CODES = {
+    "English": "en",
+    "German": "de",
+    "French": "fr",
+    "Spanish": "es",
+    "Italian": "it",
+}
+
+# Full text lengths in characters follow a log-normal distribution
+FULL_TEXT_MEDIAN = 9000
+FULL_TEXT_SIGMA = 0.8
+FULL_TEXT_MAX = 200000
+
+# Chance that a new authorship goes to an author who doesn't exist yet. The rest go to an existing author in proportion to the number of authorships they already have.
+NEW_AUTHOR_RATE = 0.45
+# Chance that an existing author gives a different name or affiliations than on their first work
+CHANGED_ATTRIBUTES_RATE = 0.1
+# Exponent of the rank-based weights for institutions, keywords and topics
+ZIPF_EXPONENT = 1.0
+
+WORDS = """
+text digital humanities corpus archive edition encoding markup analysis
+network visualization reading distant close literary history historical
+map spatial geographic temporal data model metadata ontology linked open
+scholarly publishing library museum collection manuscript print book
+newspaper periodical letter correspondence poetry novel drama theatre
+music sound image film media game code software tool infrastructure
+interface platform repository annotation transcription translation
+language linguistic semantic syntactic lexical stylometry authorship
+attribution topic modeling machine learning classification computational
+quantitative qualitative method methodology theory critique pedagogy
+teaching curriculum student community public participation crowdsourcing
+sustainability preservation access accessibility copyright ethics gender
+race colonial postcolonial global local indigenous medieval early modern
+nineteenth century twentieth contemporary religion philosophy art
+architecture heritage cultural social political economic network graph
+database search retrieval information design prototype experiment
+evaluation workflow standard interoperability TEI XML RDF IIIF
+""".split()
+
+FIRST_NAMES = """
+Anna Maria Elena Sofia Laura Julia Clara Eva Marta Ines Hanna Lea Nora
+Emma Olivia Amelia Isabel Paula Rosa Alice Beatrice Chiara Giulia Ingrid
+Astrid Freya Aiko Yuki Mei Lin Priya Ananya Fatima Amira Leila Zainab
+John James Michael David Thomas Peter Paul Mark Daniel Matthew Andrew
+Martin Stefan Lukas Jonas Felix Hugo Louis Pierre Jean Marco Luca Pablo
+Diego Carlos Miguel Juan Jorge Andrei Ivan Piotr Tomasz Kenji Hiroshi
+Wei Jun Hao Arjun Rahul Omar Ahmed Yusuf Kwame Kofi Tendai Samuel Noah
+""".split()
+
+LAST_NAMES = """
+Smith Johnson Williams Brown Jones Miller Davis Wilson Anderson Taylor
+Moore Martin Thompson White Harris Clark Lewis Walker Hall Young King
+Wright Scott Green Baker Adams Nelson Hill Campbell Mitchell Roberts
+Carter Phillips Evans Turner Parker Collins Edwards Stewart Morris Rossi
+Russo Ferrari Esposito Bianchi Romano Colombo Ricci Marino Greco Bruno
+Muller Schmidt Schneider Fischer Weber Meyer Wagner Becker Schulz Hoffmann
+Dubois Durand Lefebvre Moreau Laurent Simon Michel Garcia Martinez Lopez
+Gonzalez Rodriguez Fernandez Sanchez Perez Gomez Diaz Silva Santos Costa
+Oliveira Pereira Nowak Kowalski Wisniewski Novak Horvat Ivanov Petrov
+Sato Suzuki Takahashi Tanaka Watanabe Wang Li Zhang Liu Chen Yang Huang
+Kim Lee Park Choi Nguyen Tran Singh Kumar Sharma Patel Khan Ali Hassan
+Okafor Mensah Mwangi Dlamini Jensen Hansen Nielsen Andersen Larsen Berg
+Lindqvist Johansson Virtanen Korhonen Murphy Kelly OBrien Byrne Walsh
+""".split()
+
+CITIES = """
+London Paris Berlin Rome Madrid Lisbon Vienna Prague Warsaw Krakow
+Budapest Amsterdam Utrecht Leiden Brussels Ghent Leuven Copenhagen Oslo
+Stockholm Uppsala Helsinki Dublin Edinburgh Glasgow Oxford Cambridge
+Toronto Montreal Vancouver Boston Chicago Austin Lincoln Pittsburgh
+Urbana Stanford Berkeley Seattle Atlanta Charlottesville Tokyo Kyoto
+Osaka Beijing Shanghai Taipei Seoul Sydney Melbourne Canberra Auckland
+Mexico Bogota Lima Santiago Cordoba Delhi Mumbai Bangalore Cairo Nairobi
+Johannesburg Lausanne Geneva Zurich Bern Graz Munich Hamburg Cologne
+Leipzig Gottingen Trier Bologna Florence Pisa Venice Lyon Grenoble
+""".split()
+
+INSTITUTION_PATTERNS = [
+    "University of {city}",
+    "{city} University",
+    "{city} Institute of Technology",
+    "{city} State University",
+    "{name} College",
+    "{name} University",
+    "National Library of {city}",
+    "{city} Centre for Digital Research",
+]
+
+DEPARTMENTS = {
+    "": 30,
+    "Department of English": 10,
+    "Department of History": 10,
+    "Department of Computer Science": 8,
+    "Library": 8,
+    "Digital Humanities Lab": 6,
+    "Department of Linguistics": 5,
+    "Department of Modern Languages": 4,
+    "School of Information": 4,
+    "Department of Art History": 3,
+    "Department of Philosophy": 2,
+    "Department of Musicology": 2,
+    "Department of Geography": 2,
+}
+
+
+def scaled_counts(scale):
+    """
+    Return the number of each kind of object to generate at a scale factor, never less than one
+    """
+    counts = {k: max(1, round(n * scale)) for k, n in BASE_COUNTS.items()}
+    counts.update(FIXED_COUNTS)
+    return counts
+
+
+class Distribution:
+    """
+    Draw values from a {value: weight} dict, or from a list with Zipf-like weights by position
+    """
+
+    def __init__(self, rng, weights, exponent=ZIPF_EXPONENT):
+        self.rng = rng
+        if isinstance(weights, dict):
+            self.values = list(weights.keys())
+            self.cum_weights = list(accumulate(weights.values()))
+        else:
+            self.values = list(weights)
+            self.cum_weights = list(
+                accumulate(
+                    1 / (rank**exponent) for rank in range(1, len(weights) + 1)
+                )
+            )
+
+    def draw(self, k=1):
+        return self.rng.choices(self.values, cum_weights=self.cum_weights, k=k)
+
+    def draw_one(self):
+        return self.draw()[0]
+
+    def draw_distinct(self, k):
+        """
+        Draw k different values, or as many as there are
+        """
+        k = min(k, len(self.values))
+        drawn = {}
+        while len(drawn) < k:
+            drawn.update(dict.fromkeys(self.draw(k - len(drawn))))
+        return list(drawn)
+
+
+class CorpusGenerator:
+    """
+    Generate works, with all their authorships and attributes, into new conferences.
+
+    progress, if given, is called with (works generated, total works) after each batch of works. generate() returns a LoadReport of the objects created.
+    """
+
+    batch_size = 1000
+
+    def __init__(self, scale=1, seed=0, batch_size=None, progress=None):
+        self.counts = scaled_counts(scale)
+        self.rng = random.Random(seed)
+        if batch_size is not None:
+            self.batch_size = batch_size
+        self.progress = progress
+        self.report = LoadReport()
+
+    def distribution(self, weights):
+        return Distribution(self.rng, weights)
+
+    def unique_strings(self, n, make):
+        """
+        Return n different strings from calling make(), numbering repeats
+        """
+        generated = {}
+        while len(generated) < n:
+            value = make()
+            if value in generated:
+                value = f"{value} {len(generated)}"
+            generated[value] = None
+        return list(generated)
+
+    def phrase(self, min_words, max_words):
+        n = self.rng.randint(min_words, max_words)
+        return " ".join(self.rng.choices(WORDS, k=n))
+
+    def generate(self):
+        self.generate_vocabularies()
+        with transaction.atomic():
+            self.generate_conferences()
+        self.author_ids = []
+        # Every authorship so far, by author ID, to draw existing authors in proportion to their number of works
+        self.authorship_authors = []
+        self.author_attributes = {}
+        n_works = self.counts["works"]
+        for i in range(0, n_works, self.batch_size):
+            with transaction.atomic():
+                self.generate_works(min(self.batch_size, n_works - i))
+            if self.progress is not None:
+                self.progress(min(i + self.batch_size, n_works), n_works)
+        models.Author.reindex_appellations(self.author_ids)
+        return self.report
+
+    def generate_vocabularies(self):
+        """
+        Prepare the reference data that works draw on. Keywords, topics, institutions and affiliations are only created once a work uses them.
+        """
+        countries = list(models.Country.objects.order_by("pk"))
+        if len(countries) == 0:
+            countries = models.Country.objects.bulk_create(
+                [
+                    models.Country(
+                        tgn_id=f"http://vocab.getty.edu/page/tgn/synthetic-{i}",
+                        pref_name=f"Country {i}",
+                    )
+                    for i in range(1, 41)
+                ]
+            )
+            self.report.created["Country"] += len(countries)
+        self.countries = self.distribution([c.pk for c in countries])
+
+        self.keywords = Lookup(models.Keyword)
+        self.keyword_titles = self.distribution(
+            self.unique_strings(
+                self.counts["keywords"], lambda: self.phrase(1, 3).lower()
+            )
+        )
+        self.topics = Lookup(models.Topic)
+        self.topic_titles = self.distribution(
+            self.unique_strings(
+                self.counts["topics"], lambda: self.phrase(1, 2).title()
+            )
+        )
+        self.languages = Lookup(
+            models.Language,
+            new=lambda title: models.Language(title=title, code=LANGUAGE_CODES[title]),
+        )
+        self.language_titles = self.distribution(LANGUAGES)
+        self.work_types = Lookup(
+            models.WorkType,
+            new=lambda title: models.WorkType(
+                title=title, is_parent=title in PARENT_WORK_TYPES
+            ),
+        )
+        self.work_types.resolve(WORK_TYPES, self.report)
+        self.work_type_titles = self.distribution(WORK_TYPES)
+
+        institution_cities = {}
+
+        def institution_name():
+            city = self.rng.choice(CITIES)
+            name = self.rng.choice(INSTITUTION_PATTERNS).format(
+                city=city, name=self.rng.choice(LAST_NAMES)
+            )
+            institution_cities.setdefault(name, city)
+            return name
+
+        institution_names = self.unique_strings(
+            self.counts["institutions"], institution_name
+        )
+        self.institutions = Lookup(
+            models.Institution,
+            ("name", "country_id"),
+            new=lambda key: models.Institution(
+                name=key[0],
+                city=institution_cities.get(key[0], ""),
+                country_id=key[1],
+            ),
+        )
+        self.institution_keys = self.distribution(
+            [(name, self.countries.draw_one()) for name in institution_names]
+        )
+        self.affiliations = Lookup(models.Affiliation, ("department", "institution_id"))
+        self.departments = self.distribution(DEPARTMENTS)
+        self.appellations = Lookup(models.Appellation, ("first_name", "last_name"))
+
+        self.authors_per_work = self.distribution(AUTHORS_PER_WORK)
+        self.affiliations_per_authorship = self.distribution(
+            AFFILIATIONS_PER_AUTHORSHIP
+        )
+        self.keywords_per_work = self.distribution(KEYWORDS_PER_WORK)
+        self.topics_per_work = self.distribution(TOPICS_PER_WORK)
+        self.papers_per_session = self.distribution(PAPERS_PER_SESSION)
+        self.full_text_types = self.distribution(FULL_TEXT_TYPES)
+
+    def generate_conferences(self):
+        series = models.ConferenceSeries.objects.bulk_create(
+            [
+                models.ConferenceSeries(
+                    title=f"Synthetic {self.phrase(2, 3).title()} Conference {i}",
+                    abbreviation=f"SYN{i}",
+                )
+                for i in range(1, self.counts["series"] + 1)
+            ]
+        )
+        organizers = models.Organizer.objects.bulk_create(
+            [
+                models.Organizer(
+                    name=f"Synthetic {self.phrase(1, 2).title()} Association {i}",
+                    abbreviation=f"SYNA{i}",
+                )
+                for i in range(1, self.counts["organizers"] + 1)
+            ]
+        )
+        conferences = []
+        for i in range(self.counts["conferences"]):
+            city = self.rng.choice(CITIES)
+            conferences.append(
+                models.Conference(
+                    year=self.rng.randint(1990, 2024),
+                    short_title=city,
+                    city=city,
+                    country_id=self.countries.draw_one(),
+                    theme_title=self.phrase(2, 5).title(),
+                    entry_status="c",
+                    program_available=True,
+                    abstracts_available=True,
+                )
+            )
+        models.Conference.objects.bulk_create(conferences)
+        self.report.created["ConferenceSeries"] += len(series)
+        self.report.created["Organizer"] += len(organizers)
+        self.report.created["Conference"] += len(conferences)
+
+        memberships = []
+        for conference in conferences:
+            if self.rng.random() < 0.8:
+                memberships.append(
+                    models.SeriesMembership(
+                        series=self.rng.choice(series), conference=conference
+                    )
+                )
+        models.SeriesMembership.objects.bulk_create(memberships)
+        add_m2m(
+            models.Conference.organizers,
+            [
+                (c.pk, o.pk)
+                for c in conferences
+                for o in self.rng.sample(organizers, self.rng.randint(1, 2))
+            ],
+        )
+        hosts = {c.pk: self.institution_keys.draw_one() for c in conferences}
+        self.institutions.resolve(hosts.values(), self.report)
+        add_m2m(
+            models.Conference.hosting_institutions,
+            [(c_id, self.institutions.get(key).pk) for c_id, key in hosts.items()],
+        )
+        models.Conference.refresh_search_text([c.pk for c in conferences])
+
+        # Later conferences are bigger
+        self.conferences = self.distribution({c.pk: c.year - 1985 for c in conferences})
+
+    def full_text(self):
+        full_text_type = self.full_text_types.draw_one()
+        if full_text_type == "":
+            return "", ""
+        length = min(
+            FULL_TEXT_MAX,
+            int(self.rng.lognormvariate(0, FULL_TEXT_SIGMA) * FULL_TEXT_MEDIAN),
+        )
+        paragraphs = []
+        size = 0
+        while size < length:
+            paragraph = " ".join(self.rng.choices(WORDS, k=self.rng.randint(40, 160)))
+            paragraphs.append(paragraph.capitalize() + ".")
+            size += len(paragraph) + 2
+        if full_text_type == "xml":
+            body = "".join(f"<p>{p}</p>" for p in paragraphs)
+            return f"<text><body>{body}</body></text>", full_text_type
+        return "\n\n".join(paragraphs), full_text_type
+
+    def new_author_attributes(self):
+        first_name = self.rng.choice(FIRST_NAMES)
+        if self.rng.random() < 0.3:
+            first_name += f" {self.rng.choice(LAST_NAMES)[0]}."
+        return (
+            (first_name, self.rng.choice(LAST_NAMES)),
+            [
+                (self.departments.draw_one(), self.institution_keys.draw_one())
+                for i in range(self.affiliations_per_authorship.draw_one())
+            ],
+        )
+
+    def draw_authors(self, n):
+        """
+        Return n different author IDs for one work, where None stands for a new author
+        """
+        drawn = []
+        for i in range(n):
+            if len(self.authorship_authors) == 0 or self.rng.random() < NEW_AUTHOR_RATE:
+                drawn.append(None)
+            else:
+                author_id = self.rng.choice(self.authorship_authors)
+                drawn.append(None if author_id in drawn else author_id)
+        return drawn
+
+    def generate_works(self, n_works):
+        works = []
+        entries = []
+        for i in range(n_works):
+            full_text, full_text_type = self.full_text()
+            work = models.Work(
+                conference_id=self.conferences.draw_one(),
+                title=self.phrase(4, 14).capitalize(),
+                full_text=full_text,
+                full_text_type=full_text_type,
+                full_text_hash=content_hash(full_text.encode("utf-8")),
+                **models.Work.full_text_rendition(full_text, full_text_type),
+            )
+            works.append(work)
+            entries.append(
+                {
+                    "work_type": self.work_type_titles.draw_one(),
+                    "keywords": self.keyword_titles.draw_distinct(
+                        self.keywords_per_work.draw_one()
+                    ),
+                    "topics": self.topic_titles.draw_distinct(
+                        self.topics_per_work.draw_one()
+                    ),
+                    "language": self.language_titles.draw_one(),
+                    "authors": self.draw_authors(self.authors_per_work.draw_one()),
+                }
+            )
+
+        # Everything the batch refers to, with a query per model
+        self.keywords.resolve([k for e in entries for k in e["keywords"]], self.report)
+        self.topics.resolve([t for e in entries for t in e["topics"]], self.report)
+        self.languages.resolve([e["language"] for e in entries], self.report)
+        for work, e in zip(works, entries):
+            work.work_type = self.work_types.get(e["work_type"])
+        models.Work.objects.bulk_create(works)
+        self.report.created["Work"] += len(works)
+        # Work.save maintains the search index, which bulk_create bypasses
+        models.Work.objects.filter(pk__in=[w.pk for w in works]).update(
+            search_text=SearchVector("title", weight="A")
+            + SearchVector("full_text", weight="B")
+        )
+        add_m2m(
+            models.Work.keywords,
+            [
+                (w.pk, self.keywords.get(k).pk)
+                for w, e in zip(works, entries)
+                for k in e["keywords"]
+            ],
+        )
+        add_m2m(
+            models.Work.topics,
+            [
+                (w.pk, self.topics.get(t).pk)
+                for w, e in zip(works, entries)
+                for t in e["topics"]
+            ],
+        )
+        add_m2m(
+            models.Work.languages,
+            [
+                (w.pk, self.languages.get(e["language"]).pk)
+                for w, e in zip(works, entries)
+            ],
+        )
+        self.generate_sessions(works)
+        self.generate_authorships(works, [e["authors"] for e in entries])
+
+    def generate_sessions(self, works):
+        """
+        Make a few works of the same conference in the batch into the papers of each session
+        """
+        papers = {}
+        for work in works:
+            if work.work_type.title not in PARENT_WORK_TYPES:
+                papers.setdefault(work.conference_id, []).append(work)
+        children = []
+        for work in works:
+            if work.work_type.title in PARENT_WORK_TYPES:
+                candidates = papers.get(work.conference_id, [])
+                for i in range(
+                    min(len(candidates), self.papers_per_session.draw_one())
+                ):
+                    child = candidates.pop()
+                    child.parent_session = work
+                    children.append(child)
+        models.Work.objects.bulk_update(children, ["parent_session"])
+
+    def generate_authorships(self, works, work_authors):
+        new_authors = [
+            models.Author() for authors in work_authors for a in authors if a is None
+        ]
+        models.Author.objects.bulk_create(new_authors)
+        self.report.created["Author"] += len(new_authors)
+        new_author_ids = iter(a.pk for a in new_authors)
+
+        authorships = []
+        for work, authors in zip(works, work_authors):
+            for order, author_id in enumerate(authors, start=1):
+                if author_id is None:
+                    author_id = next(new_author_ids)
+                    self.author_ids.append(author_id)
+                    self.author_attributes[author_id] = self.new_author_attributes()
+                elif self.rng.random() < CHANGED_ATTRIBUTES_RATE:
+                    self.author_attributes[author_id] = self.new_author_attributes()
+                self.authorship_authors.append(author_id)
+                authorships.append((work, author_id, order))
+
+        attributes = [self.author_attributes[a] for w, a, o in authorships]
+        self.appellations.resolve([name for name, affs in attributes], self.report)
+        self.institutions.resolve(
+            [key for name, affs in attributes for d, key in affs], self.report
+        )
+        affiliation_keys = [
+            [(d, self.institutions.get(key).pk) for d, key in affs]
+            for name, affs in attributes
+        ]
+        self.affiliations.resolve(
+            [k for keys in affiliation_keys for k in keys], self.report
+        )
+
+        new_authorships = [
+            models.Authorship(
+                work=work,
+                author_id=author_id,
+                authorship_order=order,
+                appellation=self.appellations.get(name),
+            )
+            for (work, author_id, order), (name, affs) in zip(authorships, attributes)
+        ]
+        models.Authorship.objects.bulk_create(new_authorships)
+        self.report.created["Authorship"] += len(new_authorships)
+        add_m2m(
+            models.Authorship.affiliations,
+            [
+                (authorship.pk, self.affiliations.get(key).pk)
+                for authorship, keys in zip(new_authorships, affiliation_keys)
+                for key in keys
+            ],
+        )
@@ -0,0 +1,250 @@
+"""
+Parse DH conference TEI files into plain records, without touching the database.
+
+The XSD schema is built once per process, and every XPath expression is
+compiled once at import time. Per-author and per-affiliation expressions are
+evaluated relative to their own node rather than re-walking the document from
+its root. Batches of files can be parsed in a pool of worker processes, either
+from disk or straight from the members of an uploaded zip file.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+from lxml import etree
+import hashlib
+import html
+import io
+import os
+import re
+import zipfile
+
+TEI_NS = {"tei": "http://www.tei-c.org/ns/1.0"}
+
+TEI_SCHEMA_PATH = os.path.join(
+    os.path.dirname(__file__), "static", "tei", "schema", "dh_tei.xsd"
+)
+
+
+def tei_xpath(expression):
+    return etree.XPath(expression, namespaces=TEI_NS)
+
+
+# Document-level expressions
+WORK_TYPE = tei_xpath("//tei:keywords[@n='category']/tei:term/text()")
+TITLES = tei_xpath("//tei:titleStmt//tei:title/text()")
+TEXT = tei_xpath("/tei:TEI/tei:text")
+KEYWORDS = tei_xpath("//tei:keywords[@n='keywords']/tei:term/text()")
+TOPICS = tei_xpath("//tei:keywords[@n='topics']/tei:term/text()")
+LANGUAGE_CODE = tei_xpath("/tei:TEI/tei:text/@xml:lang")
+AUTHORS = tei_xpath("/tei:TEI/tei:teiHeader/tei:fileDesc/tei:titleStmt/tei:author")
+
+# Relative to an <author>
+FORENAME = tei_xpath("tei:persName/tei:forename/text()")
+SURNAME = tei_xpath("tei:persName/tei:surname/text()")
+AFFILIATIONS = tei_xpath("tei:affiliation")
+
+# Relative to an <affiliation>
+DEPARTMENT = tei_xpath("tei:orgName/tei:name[@type='sub']/text()")
+INSTITUTION = tei_xpath("tei:orgName/tei:name[@type='main']/text()")
+CITY = tei_xpath("tei:district/text()")
+COUNTRY = tei_xpath("tei:country/text()")
+
+
+@lru_cache(maxsize=None)
+def tei_schema():
+    """
+    The DH TEI schema, parsed the first time it is needed in this process
+    """
+    return etree.XMLSchema(etree.parse(TEI_SCHEMA_PATH))
+
+
+def first_text(xpath, node):
+    # Return the first matching text value, or an empty string when nothing matches
+    values = xpath(node)
+    if len(values) == 0:
+        return ""
+    return values[0]
+
+
+def split_terms(terms):
+    # Keyword and topic terms may hold several values separated by commas or semicolons
+    return [term for t in terms for term in re.split("[;,]", t)]
+
+
+def parse_affiliation(affiliation):
+    return {
+        "department": first_text(DEPARTMENT, affiliation),
+        "institution": first_text(INSTITUTION, affiliation),
+        "city": first_text(CITY, affiliation),
+        "country": first_text(COUNTRY, affiliation),
+    }
+
+
+def parse_author(author):
+    return {
+        "first_name": first_text(FORENAME, author),
+        "last_name": first_text(SURNAME, author),
+        "affiliations": [parse_affiliation(aff) for aff in AFFILIATIONS(author)],
+    }
+
+
+def parse_tei(xml, filepath=None):
+    """
+    Validate a parsed TEI document and return its contents as a plain dict.
+
+    Raises lxml's DocumentInvalid if the document does not match the DH TEI schema.
+    """
+    tei_schema().assertValid(xml)
+
+    work_type = WORK_TYPE(xml)
+    if len(work_type) == 0:
+        raise Exception("Worktype not given as <keyword type='category'>")
+    language_code = LANGUAGE_CODE(xml)
+    if len(language_code) == 0:
+        raise Exception("<text> element does not have a 'lang' attribute")
+
+    full_text = html.unescape(
+        etree.tostring(TEXT(xml)[0], pretty_print=True).decode("utf-8")
+    )
+    return {
+        "filepath": filepath,
+        "work_type": work_type[0].lower(),
+        # titles + subtitles will result in multiple possible title nodes. We just concatenate them here.
+        "title": " ".join(TITLES(xml)).strip(),
+        "full_text": full_text,
+        "full_text_hash": content_hash(full_text.encode("utf-8")),
+        "language_code": language_code[0],
+        "keywords": [kw.strip().lower() for kw in split_terms(KEYWORDS(xml))],
+        "topics": [tp.lower() for tp in split_terms(TOPICS(xml))],
+        "authors": [parse_author(author) for author in AUTHORS(xml)],
+    }
+
+
+def content_hash(data):
+    """
+    SHA-256 hex digest of some bytes, used to recognize files and full texts that have already been imported
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def parse_tei_bytes(data, filepath=None):
+    """
+    Parse and validate the contents of one TEI file, adding the hash of those contents to the record as "content_hash"
+    """
+    record = parse_tei(etree.parse(io.BytesIO(data)), filepath=filepath)
+    record["content_hash"] = content_hash(data)
+    return record
+
+
+def parse_tei_file(filepath):
+    """
+    Parse and validate one TEI file. Raises lxml's XMLSyntaxError for malformed XML.
+    """
+    with open(filepath, "rb") as f:
+        return parse_tei_bytes(f.read(), filepath)
+
+
+def parse_tei_file_result(filepath, data=None):
+    """
+    Parse one file, or its contents as bytes if given, returning any error as a string so the result can always be sent back from a worker process
+    """
+    try:
+        if data is None:
+            record = parse_tei_file(filepath)
+        else:
+            record = parse_tei_bytes(data, filepath)
+        return {"filepath": filepath, "record": record, "error": None}
+    except Exception as e:
+        return {"filepath": filepath, "record": None, "error": repr(e)}
+
+
+def parse_tei_files(filepaths, workers=1, contents=None):
+    """
+    Parse and validate many TEI files, in input order, using up to `workers` processes.
+
+    `contents` may give the bytes of each file, to be parsed instead of reading `filepaths` from disk.
+
+    Yields a {"filepath", "record", "error"} dict per file as soon as it is ready, so that every malformed file is reported in a single pass and callers can report progress.
+    """
+    filepaths = list(filepaths)
+    if contents is None:
+        contents = repeat(None)
+    workers = min(workers, len(filepaths))
+    if workers <= 1:
+        for f, data in zip(filepaths, contents):
+            yield parse_tei_file_result(f, data)
+        return
+    # Only a couple of files per worker are submitted ahead of the one being yielded, so that contents, such as the members of a large zip file, are read as they are needed rather than all at once
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for f, data in zip(filepaths, contents):
+            pending.append(executor.submit(parse_tei_file_result, f, data))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class TEIZipError(Exception):
+    """
+    An uploaded zip file cannot be imported as a whole, e.g. because it is too large
+    """
+
+
+def zip_tei_members(zf, max_members, max_member_size, max_total_size):
+    """
+    Return the ZipInfo of each XML file in an open ZipFile, skipping directories and hidden files the same way a glob of the extracted archive would.
+
+    Only the archive's central directory is read. Raises TEIZipError if there are too many XML files, or if they would be too large once uncompressed.
+    """
+    members = [
+        info
+        for info in zf.infolist()
+        if not info.is_dir()
+        and info.filename.endswith(".xml")
+        and not any(part.startswith(".") for part in info.filename.split("/"))
+    ]
+    if len(members) > max_members:
+        raise TEIZipError(
+            f"The zip file contains {len(members)} XML files, but at most {max_members} can be imported at once."
+        )
+    for info in members:
+        if info.file_size > max_member_size:
+            raise TEIZipError(
+                f"{info.filename} is {info.file_size} bytes uncompressed, over the {max_member_size} byte limit for a single file."
+            )
+    total_size = sum(info.file_size for info in members)
+    if total_size > max_total_size:
+        raise TEIZipError(
+            f"The XML files are {total_size} bytes uncompressed, over the {max_total_size} byte limit for one import."
+        )
+    return members
+
+
+def read_zip_member(zf, info):
+    """
+    Read one member of an open ZipFile, refusing to decompress more than its header declared or to return corrupt data
+    """
+    try:
+        with zf.open(info) as member:
+            data = member.read(info.file_size + 1)
+    except zipfile.BadZipFile as e:
+        raise TEIZipError(f"{info.filename} could not be read from the zip file: {e}")
+    if len(data) > info.file_size:
+        raise TEIZipError(f"{info.filename} is larger than the zip file says.")
+    return data
+
+
+def parse_tei_zip_members(zf, members, workers=1):
+    """
+    Parse and validate members of an open ZipFile listed by zip_tei_members, without extracting them to disk.
+
+    Yields the same dicts as parse_tei_files, using each member's name within the archive as its filepath.
+    """
+    yield from parse_tei_files(
+        [info.filename for info in members],
+        workers=workers,
+        contents=(read_zip_member(zf, info) for info in members),
+    )
@@ -0,0 +1,369 @@
+"""
+Batched database writer for parsed TEI records.
+
+Instead of a get_or_create per keyword, appellation, institution, etc. in every
+file, each kind of entity referenced anywhere in the batch is resolved against
+the database with a few IN queries, and whatever is missing is created with
+bulk_create. Works, authorships, M2M through rows, and import log messages are
+bulk created as well, so the number of queries no longer grows with the number
+of files.
+"""
+
+from django.contrib.postgres.search import SearchVector
+from django.db.models import Min
+from abstracts import models
+from abstracts.bulk_load import add_m2m
+from abstracts.matching import InstitutionIndex, normalize_name
+
+
+class TEIRecordWriter:
+    """
+    Write records returned by abstracts.tei.parse_tei_file into a conference, in bulk.
+
+    The result matches importing each record in turn with Conference.import_tei_record. This writer stops at the first database error without saying which file caused it, so callers should run it inside a savepoint and fall back to the per-file import to report errors.
+    """
+
+    def __init__(self, conference, records):
+        self.conference = conference
+        self.records = records
+        # (model, key) of newly created objects that already have a "Created new" message
+        self.announced = set()
+
+    def write(self):
+        if len(self.records) == 0:
+            return []
+        self.resolve_languages()
+        self.resolve_works()
+        self.start_attempts()
+        self.keywords, self.new_keywords = self.resolve_tags(models.Keyword, "keywords")
+        self.topics, self.new_topics = self.resolve_tags(models.Topic, "topics")
+        self.resolve_appellations()
+        self.resolve_authors()
+        self.resolve_institutions()
+        self.resolve_affiliations()
+        self.resolve_authorships()
+        self.write_relations()
+        self.write_messages()
+        return [r["filepath"] for r in self.records]
+
+    def start_attempts(self):
+        paths = [r["filepath"] for r in self.records]
+        file_imports = dict(
+            models.FileImport.objects.filter(path__in=paths).values_list("path", "id")
+        )
+        for fi in models.FileImport.objects.bulk_create(
+            [
+                models.FileImport(path=p)
+                for p in dict.fromkeys(paths)
+                if p not in file_imports
+            ]
+        ):
+            file_imports[fi.path] = fi.pk
+        self.attempts = models.FileImportTries.objects.bulk_create(
+            [
+                models.FileImportTries(
+                    file_name_id=file_imports[r["filepath"]],
+                    conference=self.conference,
+                    content_hash=r["content_hash"],
+                    work=work,
+                )
+                for r, work in zip(self.records, self.works)
+            ]
+        )
+
+    def resolve_languages(self):
+        codes = {r["language_code"] for r in self.records}
+        self.languages = {
+            lang.code: lang for lang in models.Language.objects.filter(code__in=codes)
+        }
+        for r in self.records:
+            if r["language_code"] not in self.languages:
+                raise models.Language.DoesNotExist(
+                    f"No language with code '{r['language_code']}' ({r['filepath']})"
+                )
+
+    def resolve_works(self):
+        titles = list(dict.fromkeys(r["work_type"] for r in self.records))
+        work_types = {
+            wt.title: wt for wt in models.WorkType.objects.filter(title__in=titles)
+        }
+        for wt in models.WorkType.objects.bulk_create(
+            [models.WorkType(title=t) for t in titles if t not in work_types]
+        ):
+            work_types[wt.title] = wt
+
+        # Works are reused when they have the same text and title, as with Conference.import_tei_record
+        existing = {}
+        for w in models.Work.objects.filter(
+            conference=self.conference,
+            full_text_type="xml",
+            full_text_hash__in={r["full_text_hash"] for r in self.records},
+        ).order_by("pk"):
+            existing.setdefault(models.Work.import_key(w.title, w.full_text_hash), w)
+        self.existing_work_ids = {w.pk for w in existing.values()}
+
+        new_works = {}
+        self.works = []
+        for r in self.records:
+            key = models.Work.import_key(r["title"], r["full_text_hash"])
+            if key in existing:
+                self.works.append(existing[key])
+                continue
+            if key not in new_works:
+                new_works[key] = models.Work(
+                    conference=self.conference,
+                    title=r["title"],
+                    work_type=work_types[r["work_type"]],
+                    full_text=r["full_text"],
+                    full_text_hash=r["full_text_hash"],
+                    full_text_type="xml",
+                    **models.Work.full_text_rendition(r["full_text"], "xml"),
+                )
+            self.works.append(new_works[key])
+        models.Work.objects.bulk_create(new_works.values())
+        # Work.save maintains the search index, which bulk_create bypasses
+        models.Work.objects.filter(pk__in=[w.pk for w in new_works.values()]).update(
+            search_text=SearchVector("title", weight="A")
+            + SearchVector("full_text", weight="B")
+        )
+
+    def resolve_tags(self, model, field):
+        titles = list(dict.fromkeys(t for r in self.records for t in r[field]))
+        tags = {t.title: t for t in model.objects.filter(title__in=titles)}
+        created = model.objects.bulk_create(
+            [model(title=t) for t in titles if t not in tags]
+        )
+        tags.update({t.title: t for t in created})
+        return tags, {t.title for t in created}
+
+    def resolve_appellations(self):
+        names = dict.fromkeys(
+            (a["first_name"], a["last_name"])
+            for r in self.records
+            for a in r["authors"]
+        )
+        # Matching first and last names separately returns a superset, so keep only exact pairs
+        self.appellations = {
+            (a.first_name, a.last_name): a
+            for a in models.Appellation.objects.filter(
+                first_name__in={n[0] for n in names},
+                last_name__in={n[1] for n in names},
+            )
+            if (a.first_name, a.last_name) in names
+        }
+        created = models.Appellation.objects.bulk_create(
+            [
+                models.Appellation(first_name=n[0], last_name=n[1])
+                for n in names
+                if n not in self.appellations
+            ]
+        )
+        self.appellations.update({(a.first_name, a.last_name): a for a in created})
+        self.new_appellations = {(a.first_name, a.last_name) for a in created}
+
+    def resolve_authors(self):
+        # An appellation belongs to the lowest-numbered author who has asserted it, otherwise to a new author
+        author_ids = dict(
+            models.Authorship.objects.filter(
+                appellation__in=[a.pk for a in self.appellations.values()]
+            )
+            .values("appellation_id")
+            .annotate(author_id=Min("author_id"))
+            .values_list("appellation_id", "author_id")
+        )
+        new_authors = {
+            name: models.Author(appellations_index=str(appellation))
+            for name, appellation in self.appellations.items()
+            if appellation.pk not in author_ids
+        }
+        models.Author.objects.bulk_create(new_authors.values())
+        self.author_ids = {
+            name: author_ids.get(appellation.pk) or new_authors[name].pk
+            for name, appellation in self.appellations.items()
+        }
+        self.new_authors = set(new_authors.keys())
+
+    def affiliation_occurrences(self):
+        for r_idx, r in enumerate(self.records):
+            for a_idx, author in enumerate(r["authors"]):
+                for f_idx, affiliation in enumerate(author["affiliations"]):
+                    yield (r_idx, a_idx, f_idx), affiliation
+
+    def resolve_institutions(self):
+        index = InstitutionIndex()
+        # Walk affiliations in file order, so that institutions created earlier in the batch are matched by later files just as in a file-by-file import
+        # New institutions by (normalized name, country), the unique key they are created under
+        created = {}
+        self.institutions = {}
+        self.new_institution_occurrences = set()
+        for key, aff in self.affiliation_occurrences():
+            country_id = index.country(aff["country"])
+            institution = index.match(aff["institution"], country_id)
+            if institution is None:
+                unique_key = (normalize_name(aff["institution"]), country_id)
+                institution = created.get(unique_key)
+                if institution is None:
+                    institution = models.Institution(
+                        name=aff["institution"], city=aff["city"], country_id=country_id
+                    )
+                    index.add(institution)
+                    created[unique_key] = institution
+                    self.new_institution_occurrences.add(key)
+            self.institutions[key] = institution
+        models.Institution.objects.bulk_create(created.values())
+        self.new_institution_ids = {i.pk for i in created.values()}
+
+    def resolve_affiliations(self):
+        existing = {
+            (a.department, a.institution_id): a
+            for a in models.Affiliation.objects.filter(
+                institution_id__in={
+                    i.pk
+                    for i in self.institutions.values()
+                    if i.pk not in self.new_institution_ids
+                }
+            ).select_related("institution")
+        }
+        new_affiliations = {}
+        self.affiliations = {}
+        for key, aff in self.affiliation_occurrences():
+            institution = self.institutions[key]
+            aff_key = (aff["department"], institution.pk)
+            if aff_key not in existing and aff_key not in new_affiliations:
+                new_affiliations[aff_key] = models.Affiliation(
+                    department=aff["department"], institution=institution
+                )
+            self.affiliations[key] = existing.get(aff_key) or new_affiliations[aff_key]
+        models.Affiliation.objects.bulk_create(new_affiliations.values())
+        self.new_affiliations = set(new_affiliations.keys())
+
+    def resolve_authorships(self):
+        existing = {
+            (a.work_id, a.author_id, a.appellation_id, a.authorship_order): a
+            for a in models.Authorship.objects.filter(
+                work_id__in=self.existing_work_ids
+            )
+        }
+        new_authorships = {}
+        self.authorships = {}
+        for r_idx, r in enumerate(self.records):
+            work = self.works[r_idx]
+            for a_idx, author in enumerate(r["authors"]):
+                name = (author["first_name"], author["last_name"])
+                appellation = self.appellations[name]
+                key = (work.pk, self.author_ids[name], appellation.pk, a_idx + 1)
+                if key not in existing and key not in new_authorships:
+                    new_authorships[key] = models.Authorship(
+                        work=work,
+                        author_id=self.author_ids[name],
+                        appellation=appellation,
+                        authorship_order=a_idx + 1,
+                    )
+                self.authorships[(r_idx, a_idx)] = (
+                    existing.get(key) or new_authorships[key]
+                )
+        models.Authorship.objects.bulk_create(new_authorships.values())
+        self.new_authorships = set(new_authorships.keys())
+
+    def write_relations(self):
+        add_m2m(
+            models.Work.languages,
+            [
+                (work.pk, self.languages[r["language_code"]].pk)
+                for work, r in zip(self.works, self.records)
+            ],
+        )
+        add_m2m(
+            models.Work.keywords,
+            [
+                (work.pk, self.keywords[kw].pk)
+                for work, r in zip(self.works, self.records)
+                for kw in r["keywords"]
+            ],
+        )
+        add_m2m(
+            models.Work.topics,
+            [
+                (work.pk, self.topics[tp].pk)
+                for work, r in zip(self.works, self.records)
+                for tp in r["topics"]
+            ],
+        )
+        add_m2m(
+            models.Authorship.affiliations,
+            [
+                (self.authorships[key[:2]].pk, affiliation.pk)
+                for key, affiliation in self.affiliations.items()
+            ],
+        )
+
+    def message(self, attempt, model, key, label, new_keys):
+        # Only the first mention of a newly created object in the batch is reported as created, as it would be with get_or_create
+        created = key in new_keys and (model, key) not in self.announced
+        self.announced.add((model, key))
+        return attempt.build_message(model, label, created)
+
+    def write_messages(self):
+        messages = []
+        for r_idx, (attempt, r) in enumerate(zip(self.attempts, self.records)):
+            work = self.works[r_idx]
+            for kw in r["keywords"]:
+                messages.append(
+                    self.message(attempt, models.Keyword, kw, kw, self.new_keywords)
+                )
+            for tp in r["topics"]:
+                messages.append(
+                    self.message(attempt, models.Topic, tp, tp, self.new_topics)
+                )
+            for a_idx, author in enumerate(r["authors"]):
+                name = (author["first_name"], author["last_name"])
+                appellation = self.appellations[name]
+                author_label = f"{self.author_ids[name]} - {appellation}"
+                messages.append(
+                    self.message(
+                        attempt,
+                        models.Appellation,
+                        name,
+                        appellation,
+                        self.new_appellations,
+                    )
+                )
+                messages.append(
+                    self.message(
+                        attempt, models.Author, name, author_label, self.new_authors
+                    )
+                )
+                for f_idx in range(len(author["affiliations"])):
+                    key = (r_idx, a_idx, f_idx)
+                    if key in self.new_institution_occurrences:
+                        messages.append(
+                            attempt.build_message(
+                                models.Institution, self.institutions[key], True
+                            )
+                        )
+                    affiliation = self.affiliations[key]
+                    messages.append(
+                        self.message(
+                            attempt,
+                            models.Affiliation,
+                            (affiliation.department, affiliation.institution_id),
+                            affiliation,
+                            self.new_affiliations,
+                        )
+                    )
+                authorship = self.authorships[(r_idx, a_idx)]
+                messages.append(
+                    self.message(
+                        attempt,
+                        models.Authorship,
+                        (
+                            work.pk,
+                            authorship.author_id,
+                            appellation.pk,
+                            authorship.authorship_order,
+                        ),
+                        f"{author_label} - {work}",
+                        self.new_authorships,
+                    )
+                )
+        models.FileImportMessgaes.objects.bulk_create(messages)
@@ -3,6 +3,8 @@ import re
 
 register = template.Library()
 
+BLANK_LINE = re.compile(r"^\s+$", re.MULTILINE)
+
 
 @register.simple_tag
 def url_replace(request, field, value):
@@ -16,4 +18,4 @@ def url_replace(request, field, value):
 
 @register.filter
 def reduce_lines(value):
-    return re.compile(r"^\s+$", re.MULTILINE).sub("", value)
+    return BLANK_LINE.sub("", value)
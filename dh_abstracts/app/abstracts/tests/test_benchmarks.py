@@ -0,0 +1,47 @@
+from django.test import TestCase
+
+from abstracts.benchmarks import BENCHMARKS, compare, run_benchmark
+from abstracts.models import Work
+
+
+class RunBenchmarkTest(TestCase):
+    fixtures = ["test.json"]
+
+    def test_every_benchmark_runs(self):
+        for name in BENCHMARKS:
+            with self.subTest(name):
+                result = run_benchmark(name, repeat=1, warmup=0)
+                self.assertGreater(result["min_ms"], 0)
+                self.assertGreater(result["queries"], 0)
+
+    def test_writes_are_rolled_back(self):
+        n_works = Work.objects.count()
+        run_benchmark("Conference.import_xml_file", repeat=2, warmup=0)
+        self.assertEqual(Work.objects.count(), n_works)
+
+
+class CompareTest(TestCase):
+    def result(self, min_ms, queries):
+        return {"min_ms": min_ms, "queries": queries}
+
+    def test_regressions(self):
+        baseline = {
+            "slower": self.result(10, 5),
+            "more_queries": self.result(10, 5),
+            "faster": self.result(10, 5),
+        }
+        results = {
+            "slower": self.result(13, 5),
+            "more_queries": self.result(10, 6),
+            "faster": self.result(5, 1),
+            "new": self.result(1, 1),
+        }
+        rows, regressed = compare(results, baseline, tolerance=0.2)
+        self.assertEqual(regressed, ["slower", "more_queries"])
+        self.assertEqual(dict(rows)["new"], "no baseline")
+
+    def test_tolerance(self):
+        rows, regressed = compare(
+            {"a": self.result(11, 5)}, {"a": self.result(10, 5)}, tolerance=0.2
+        )
+        self.assertEqual(regressed, [])
@@ -0,0 +1,329 @@
+from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from tempfile import TemporaryDirectory
+from contextlib import redirect_stdout
+import csv
+import io
+
+from abstracts.models import (
+    Conference,
+    ConferenceSeries,
+    Country,
+    Institution,
+    Keyword,
+    Organizer,
+    Topic,
+    Work,
+    Appellation,
+)
+from abstracts.bulk_load import (
+    CSVLoader,
+    InstitutionLookup,
+    Lookup,
+    LoadReport,
+    split_values,
+)
+from abstracts.management.commands.import_2020 import WorkLoader
+
+
+def csv_rows(rows):
+    columns = list(rows[0].keys())
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    writer.writerows(rows)
+    buffer.seek(0)
+    return buffer.getvalue()
+
+
+class CSVFileTestCase(TestCase):
+    def setUp(self):
+        tdir = TemporaryDirectory()
+        self.addCleanup(tdir.cleanup)
+        self.filepath = f"{tdir.name}/load.csv"
+
+    def write_csv(self, rows):
+        with open(self.filepath, "w", newline="") as f:
+            f.write(csv_rows(rows))
+
+    def call(self, command, **options):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            call_command(command, self.filepath, **options)
+        return out.getvalue()
+
+
+class SplitValuesTest(TestCase):
+    def test_split(self):
+        self.assertEqual(split_values(" a; b;;c "), ["a", "b", "c"])
+        self.assertEqual(split_values("a, b; c", sep=r"[,;]"), ["a", "b", "c"])
+        self.assertEqual(split_values(""), [])
+
+
+class LookupTest(TestCase):
+    def test_resolve_is_memoized(self):
+        Keyword.objects.create(title="old")
+        lookup = Lookup(Keyword)
+        report = LoadReport()
+        with self.assertNumQueries(2):
+            lookup.resolve(["old", "new", "new"], report)
+        self.assertEqual(report.created["Keyword"], 1)
+        self.assertEqual(lookup.get("new"), Keyword.objects.get(title="new"))
+        with self.assertNumQueries(0):
+            lookup.resolve(["old", "new"], report)
+
+    def test_composite_keys(self):
+        Appellation.objects.create(first_name="Ada", last_name="Byron")
+        Appellation.objects.create(first_name="Charles", last_name="Babbage")
+        lookup = Lookup(Appellation, ("first_name", "last_name"))
+        report = LoadReport()
+        lookup.resolve([("Ada", "Babbage"), ("Ada", "Byron")], report)
+        self.assertEqual(report.created["Appellation"], 1)
+        self.assertEqual(
+            Appellation.objects.filter(first_name="Ada", last_name="Babbage").count(), 1
+        )
+
+    def test_no_create(self):
+        lookup = Lookup(Keyword, create=False)
+        lookup.resolve(["missing"], LoadReport())
+        self.assertIsNone(lookup.get("missing"))
+        self.assertFalse(Keyword.objects.exists())
+
+    def test_institution_empty_name(self):
+        lookup = InstitutionLookup()
+        lookup.resolve([("", "", None), (" - ", "", None)], LoadReport())
+        self.assertIsNone(lookup.get(("", "", None)))
+        self.assertIsNone(lookup.get((" - ", "", None)))
+        self.assertFalse(Institution.objects.exists())
+
+
+class KeywordLoader(CSVLoader):
+    model = Keyword
+    match_fields = ("title",)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.fields = {"title": "title"}
+
+
+class CSVLoaderTest(TestCase):
+    def test_rows_with_same_match_key(self):
+        Keyword.objects.create(title="old")
+        report = KeywordLoader().load(
+            [{"title": "new"}, {"title": "old"}, {"title": "new"}, {"title": "old"}]
+        )
+        self.assertEqual(report.created["Keyword"], 1)
+        self.assertEqual(report.updated["Keyword"], 1)
+        self.assertEqual(
+            sorted(Keyword.objects.values_list("title", flat=True)), ["new", "old"]
+        )
+
+
+CONFERENCE_ROW = {
+    "Year": "2019",
+    "Theme Title": "Complexities",
+    "Hosting Institution(s) Location": "Utrecht University",
+    "Start Date": "07/09/2019",
+    "End Date": "07/12/2019",
+    "City": "Utrecht",
+    "State/Province/Region": "",
+    "Country": "Netherlands",
+    "URL": "https://dh2019.adho.org",
+    "Reference": "",
+    "Notes": "",
+    "Contributors of Details": "Someone,",
+    "Attendance": "",
+    "Primary Contact": "",
+    "Professional/Regional Organization (if applicable)": "ADHO;EADH",
+    "Recurring Title": "DH - 31",
+}
+
+
+class ImportConferencesTest(CSVFileTestCase):
+    def setUp(self):
+        super().setUp()
+        self.netherlands = Country.objects.create(
+            pref_name="Netherlands", tgn_id="http://vocab.getty.edu/tgn/test-nl"
+        )
+        self.eadh = Organizer.objects.create(
+            name="European Association for Digital Humanities", abbreviation="EADH"
+        )
+        self.write_csv(
+            [
+                CONFERENCE_ROW,
+                {
+                    **CONFERENCE_ROW,
+                    "Year": "2020",
+                    "Hosting Institution(s) Location": "Univ. of Ottawa",
+                    "City": "Ottawa",
+                    "Country": "",
+                    "Recurring Title": "DH - 32",
+                },
+                {**CONFERENCE_ROW, "Year": "unknown"},
+            ]
+        )
+
+    def test_load(self):
+        output = self.call("import_conferences")
+        self.assertIn("2 Conference created", output)
+        self.assertIn("row 3: ValueError", output)
+
+        dh2019 = Conference.objects.get(year=2019)
+        self.assertEqual(dh2019.country, self.netherlands)
+        self.assertEqual(dh2019.contributors, "Someone")
+        self.assertEqual(
+            sorted(o.abbreviation for o in dh2019.organizers.all()), ["ADHO", "EADH"]
+        )
+        # Existing organizers are matched, and each new one is created once
+        self.assertEqual(Organizer.objects.count(), 2)
+        utrecht = dh2019.hosting_institutions.get()
+        self.assertEqual(
+            (utrecht.name, utrecht.city, utrecht.country),
+            ("Utrecht University", "Utrecht", self.netherlands),
+        )
+        series = ConferenceSeries.objects.get()
+        self.assertEqual(series.title, "DH")
+        self.assertEqual(
+            sorted(series.conference_memberships.values_list("number", flat=True)),
+            [31, 32],
+        )
+        self.assertIn("Utrecht University", dh2019.search_text)
+
+    def test_dry_run(self):
+        output = self.call("import_conferences", dry_run=True)
+        self.assertIn("2 Conference created", output)
+        self.assertIn("Dry run", output)
+        self.assertFalse(Conference.objects.exists())
+        self.assertFalse(Institution.objects.exists())
+
+
+def work_row(title, authors, organisations, keywords="archives; maps"):
+    return {
+        "title_plain": title,
+        "Abstract": f"Abstract of {title}",
+        "acceptance": "Paper",
+        "keywords": keywords,
+        "authors": authors,
+        "organisations": organisations,
+        "topics": "History, Europe",
+    }
+
+
+class ImportWorksTest(CSVFileTestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        super().setUp()
+        self.conference = Conference.objects.first()
+        self.write_csv(
+            [
+                work_row(
+                    "Mapping archives",
+                    "Lovelace, Ada (1); Babbage, Charles (1,2)",
+                    "1: Analytical Society; 2: Royal Society",
+                ),
+                work_row(
+                    "Counting archives",
+                    "Lovelace, Ada",
+                    "Analytical Society",
+                    keywords="archives",
+                ),
+                work_row("Malformed", "No comma here", "Nowhere"),
+            ]
+        )
+
+    def test_load(self):
+        output = self.call("import_2020", conference=self.conference.pk)
+        self.assertIn("2 Work created", output)
+        self.assertIn("row 3: IndexError", output)
+        works = Work.objects.filter(conference=self.conference).order_by("title")
+        self.assertEqual(
+            [w.title for w in works], ["Counting archives", "Mapping archives"]
+        )
+        mapping = works[1]
+        self.assertEqual(
+            sorted(k.title for k in mapping.keywords.all()), ["archives", "maps"]
+        )
+        self.assertTrue(Work.objects.filter(search_text="mapping").exists())
+        authorships = list(mapping.authorships.order_by("authorship_order"))
+        self.assertEqual(
+            [str(a.appellation) for a in authorships],
+            ["Ada Lovelace", "Charles Babbage"],
+        )
+        self.assertEqual(
+            sorted(str(aff) for aff in authorships[1].affiliations.all()),
+            ["Analytical Society", "Royal Society"],
+        )
+        # The same name is the same author across works
+        self.assertEqual(works[0].authorships.get().author_id, authorships[0].author_id)
+
+    def test_repeated_author(self):
+        self.write_csv(
+            [
+                work_row(
+                    "Twice signed",
+                    "Lovelace, Ada (1); Babbage, Charles (1); Lovelace, Ada (2)",
+                    "1: Analytical Society; 2: Royal Society",
+                )
+            ]
+        )
+        self.call("import_2020", conference=self.conference.pk)
+        work = Work.objects.get(conference=self.conference, title="Twice signed")
+        authorships = list(work.authorships.order_by("authorship_order"))
+        self.assertEqual(
+            [(a.authorship_order, str(a.appellation)) for a in authorships],
+            [(1, "Ada Lovelace"), (2, "Charles Babbage")],
+        )
+        self.assertEqual(
+            sorted(str(aff) for aff in authorships[0].affiliations.all()),
+            ["Analytical Society", "Royal Society"],
+        )
+
+    def test_empty_organisations(self):
+        self.write_csv([work_row("Unaffiliated", "Lovelace, Ada", "")])
+        self.call("import_2020", conference=self.conference.pk)
+        work = Work.objects.get(conference=self.conference, title="Unaffiliated")
+        self.assertFalse(work.authorships.get().affiliations.exists())
+        self.assertFalse(Institution.objects.filter(name="").exists())
+
+    def test_topics(self):
+        self.call("import_2020", conference=self.conference.pk)
+        with open(self.filepath, "a", newline="") as f:
+            csv.writer(f).writerow(["Counting archives", "", "", "", "", "", "None"])
+        output = self.call("import_2020_topics", conference=self.conference.pk)
+        # The malformed row was never loaded as a work
+        self.assertIn("row 3: No existing Work matches", output)
+        self.assertIn("row 4: ValueError", output)
+        work = Work.objects.get(conference=self.conference, title="Mapping archives")
+        self.assertEqual(
+            sorted(t.title for t in work.topics.all()), ["Europe", "History"]
+        )
+        self.assertTrue(Topic.objects.filter(title="Statistics").exists())
+
+    def count_load_queries(self, rows):
+        # Roll back afterwards, so that each count starts from the same database state
+        sid = transaction.savepoint()
+        with CaptureQueriesContext(connection) as queries:
+            WorkLoader(self.conference.pk).load(csv.DictReader(io.StringIO(rows)))
+        transaction.savepoint_rollback(sid)
+        return len(queries)
+
+    def test_constant_queries(self):
+        def rows(n):
+            return csv_rows(
+                [
+                    work_row(
+                        f"Work {i}",
+                        f"Author{i}, Some (1); Author{i + 1}, Other (2)",
+                        f"1: Institute {i}; 2: Institute {i + 1}",
+                        keywords=f"kw{i}; kw{i + 1}",
+                    )
+                    for i in range(n)
+                ]
+            )
+
+        self.assertEqual(
+            self.count_load_queries(rows(20)), self.count_load_queries(rows(2))
+        )
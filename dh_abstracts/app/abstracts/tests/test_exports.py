@@ -0,0 +1,155 @@
+from django.test import TestCase, override_settings
+from django.conf import settings
+from django.core.management import call_command
+from tempfile import TemporaryDirectory
+from os import listdir
+import csv
+import io
+import zipfile
+
+from abstracts.models import Work
+from abstracts.exports import (
+    denormalized_work_rows,
+    atomic_zip,
+    zip_csv_writer,
+    file_sha256,
+    read_checksum,
+    load_manifest,
+    write_manifest,
+    build_manifest,
+    CHECKSUM_SUFFIX,
+)
+
+
+class DenormalizedWorkRowsTest(TestCase):
+    fixtures = ["test.json"]
+
+    def test_row_layout(self):
+        rows = list(denormalized_work_rows())
+        self.assertEqual(len(rows), Work.objects.count())
+        for row in rows:
+            self.assertEqual(len(row), len(settings.DENORMALIZED_HEADERS))
+
+    def test_id_order(self):
+        ids = [row[0] for row in denormalized_work_rows()]
+        self.assertEqual(ids, sorted(ids))
+
+    def test_matches_model_labels(self):
+        for row in denormalized_work_rows():
+            work = Work.objects.get(pk=row[0])
+            self.assertEqual(row[1], str(work.conference))
+            self.assertEqual(
+                row[14],
+                ";".join([str(a.appellation) for a in work.authorships.all()]),
+            )
+            self.assertEqual(row[20], ";".join([str(k) for k in work.keywords.all()]))
+            if work.full_text_license is None:
+                self.assertEqual(row[16], "")
+            else:
+                self.assertEqual(row[16], work.full_text)
+
+    def test_constant_queries(self):
+        with self.assertNumQueries(9):
+            list(denormalized_work_rows())
+
+
+class AtomicZipTest(TestCase):
+    def test_write(self):
+        with TemporaryDirectory() as tdir:
+            target = f"{tdir}/out.zip"
+            with atomic_zip(target, compresslevel=1) as dat_zip:
+                with zip_csv_writer(dat_zip, "rows.csv") as writer:
+                    writer.writerow(["a", 1])
+                # Nothing is visible at the destination until the archive is complete
+                self.assertFalse("out.zip" in listdir(tdir))
+            self.assertEqual(sorted(listdir(tdir)), ["out.zip", "out.zip.sha256"])
+            with zipfile.ZipFile(target) as dat_zip:
+                self.assertEqual(dat_zip.read("rows.csv").decode("utf-8"), '"a","1"\n')
+            self.assertEqual(read_checksum(target), file_sha256(target))
+
+    def test_failure_leaves_no_file(self):
+        with TemporaryDirectory() as tdir:
+            with self.assertRaises(ValueError):
+                with atomic_zip(f"{tdir}/out.zip") as dat_zip:
+                    raise ValueError
+            self.assertEqual(listdir(tdir), [])
+
+
+class ExportTablesCommandTest(TestCase):
+    fixtures = ["test.json"]
+
+    def test_export(self):
+        with TemporaryDirectory() as tdir:
+            with override_settings(DATA_OUTPUT_PATH=tdir):
+                call_command("export_tables", compresslevel=1, stdout=io.StringIO())
+            zip_names = [
+                settings.PUBLIC_DATA_TABLE_CONFIG["DATA_ZIP_NAME"],
+                settings.PRIVATE_DATA_TABLE_CONFIG["DATA_ZIP_NAME"],
+                f"{settings.DENORMALIZED_WORKS_NAME}.zip",
+            ]
+            self.assertEqual(
+                sorted(listdir(tdir)),
+                sorted(
+                    zip_names
+                    + [f"{z}{CHECKSUM_SUFFIX}" for z in zip_names]
+                    + [settings.DATA_MANIFEST_NAME]
+                ),
+            )
+            with zipfile.ZipFile(
+                f"{tdir}/{settings.DENORMALIZED_WORKS_NAME}.zip"
+            ) as dat_zip:
+                rows = list(
+                    csv.reader(
+                        io.TextIOWrapper(
+                            dat_zip.open(f"{settings.DENORMALIZED_WORKS_NAME}.csv"),
+                            encoding="utf-8",
+                        )
+                    )
+                )
+            self.assertEqual(
+                rows[0], [h["name"] for h in settings.DENORMALIZED_HEADERS]
+            )
+            self.assertEqual(len(rows) - 1, Work.objects.count())
+
+    def test_manifest(self):
+        with TemporaryDirectory() as tdir:
+            with override_settings(DATA_OUTPUT_PATH=tdir):
+                call_command("export_tables", compresslevel=1, stdout=io.StringIO())
+                manifest = load_manifest()
+            denormalized = manifest["artifacts"]["denormalized"]
+            denormalized_path = f"{tdir}/{denormalized['file_name']}"
+            self.assertEqual(denormalized["sha256"], file_sha256(denormalized_path))
+            self.assertEqual(
+                denormalized["tables"],
+                {settings.DENORMALIZED_WORKS_NAME: Work.objects.count()},
+            )
+            public_rows = {
+                m["csv_name"]: m["rows"]
+                for m in manifest["data_dictionaries"]["public"]
+            }
+            self.assertEqual(public_rows["works"], Work.objects.count())
+            self.assertEqual(manifest["artifacts"]["public"]["tables"], public_rows)
+
+
+class BuildManifestTest(TestCase):
+    def test_default_artifacts_not_shared(self):
+        build_manifest()["artifacts"]["public"] = {"size": 1}
+        self.assertEqual(build_manifest()["artifacts"], {})
+
+
+class LoadManifestTest(TestCase):
+    def test_missing(self):
+        with TemporaryDirectory() as tdir:
+            with override_settings(DATA_OUTPUT_PATH=tdir):
+                self.assertIsNone(load_manifest())
+
+    def test_reload_on_change(self):
+        with TemporaryDirectory() as tdir:
+            with override_settings(DATA_OUTPUT_PATH=tdir):
+                write_manifest(build_manifest())
+                first = load_manifest()
+                self.assertIs(load_manifest(), first)
+                write_manifest(build_manifest({"denormalized": {"size": 1}}))
+                self.assertEqual(
+                    load_manifest()["artifacts"], {"denormalized": {"size": 1}}
+                )
@@ -0,0 +1,80 @@
+from django.test import TestCase, override_settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+import json
+import re
+
+from abstracts.instrumentation import (
+    InstrumentedLocMemCache,
+    RequestMetrics,
+    current_metrics,
+    request_budget,
+)
+
+
+class RequestMetricsMiddlewareTest(TestCase):
+    fixtures = ["test.json"]
+
+    def get_work(self):
+        with self.assertLogs("abstracts.instrumentation", "INFO") as logs:
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.get(reverse("work_detail", kwargs={"work_id": 1}))
+        return res, len(queries), logs
+
+    @override_settings(SERVER_TIMING_HEADER=True)
+    def test_server_timing(self):
+        res, n_queries, _ = self.get_work()
+        timing = res["Server-Timing"]
+        self.assertIn(f'desc="{n_queries} queries"', timing)
+        template_ms = float(re.search(r"template;dur=([0-9.]+)", timing).group(1))
+        self.assertGreater(template_ms, 0)
+
+    def test_log_line(self):
+        _, n_queries, logs = self.get_work()
+        metrics = json.loads(logs.records[0].getMessage())
+        self.assertEqual(metrics["view"], "work_detail")
+        self.assertEqual(metrics["status"], 200)
+        self.assertEqual(metrics["queries"], n_queries)
+        self.assertEqual(len(logs.records), 1)
+
+    @override_settings(REQUEST_BUDGETS={"default": {"queries": 0}})
+    def test_budget_warning(self):
+        _, n_queries, logs = self.get_work()
+        self.assertEqual(logs.records[1].levelname, "WARNING")
+        self.assertIn(
+            f"exceeded its queries budget: {n_queries} > 0",
+            logs.records[1].getMessage(),
+        )
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_no_header(self):
+        res, _, _ = self.get_work()
+        self.assertFalse(res.has_header("Server-Timing"))
+
+
+class RequestBudgetTest(TestCase):
+    @override_settings(
+        REQUEST_BUDGETS={
+            "default": {"queries": 50, "db_ms": 500},
+            "work_detail": {"queries": 25},
+        }
+    )
+    def test_overrides(self):
+        self.assertEqual(request_budget("work_detail"), {"queries": 25, "db_ms": 500})
+        self.assertEqual(request_budget("work_list"), {"queries": 50, "db_ms": 500})
+
+
+class CacheMetricsTest(TestCase):
+    def test_hits_and_misses(self):
+        cache = InstrumentedLocMemCache("instrumentation-test", {})
+        cache.set("present", 0)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            self.assertEqual(cache.get("present", 1), 0)
+            self.assertEqual(cache.get("absent", 1), 1)
+            self.assertEqual(cache.get_many(["present", "absent"]), {"present": 0})
+        finally:
+            current_metrics.reset(token)
+        self.assertEqual((metrics.cache_hits, metrics.cache_misses), (2, 2))
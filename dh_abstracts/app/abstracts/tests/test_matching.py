@@ -0,0 +1,103 @@
+from django.test import TestCase
+
+from abstracts.models import Institution, Country, CountryLabel
+from abstracts.matching import InstitutionIndex, normalize_name
+
+
+class NormalizeNameTest(TestCase):
+    def test_normalize(self):
+        self.assertEqual(
+            normalize_name("  The Université  de Montréal! "), "universite de montreal"
+        )
+        self.assertEqual(
+            normalize_name("Library & Archives"), normalize_name("library and archives")
+        )
+        self.assertEqual(normalize_name(""), "")
+
+
+class InstitutionIndexTest(TestCase):
+    def setUp(self):
+        self.usa = Country.objects.create(
+            pref_name="United States", tgn_id="http://vocab.getty.edu/tgn/test-us"
+        )
+        CountryLabel.objects.create(name="USA", country=self.usa)
+        self.georgia = Country.objects.create(
+            pref_name="Georgia", tgn_id="http://vocab.getty.edu/tgn/test-ge"
+        )
+        self.georgia_state = Country.objects.create(
+            pref_name="Georgia (state)", tgn_id="http://vocab.getty.edu/tgn/test-ga"
+        )
+        CountryLabel.objects.create(name="Georgia", country=self.georgia_state)
+        self.harvard = Institution.objects.create(
+            name="Harvard University", country=self.usa
+        )
+        self.montreal = Institution.objects.create(name="Université de Montréal")
+        Institution.objects.create(
+            name="Tbilisi State University", country=self.georgia
+        )
+        self.index = InstitutionIndex()
+
+    def test_country_aliases(self):
+        self.assertEqual(self.index.country("USA"), self.usa.pk)
+        self.assertEqual(self.index.country("united states"), self.usa.pk)
+        self.assertIsNone(self.index.country("Atlantis"))
+
+    def test_ambiguous_country_label(self):
+        # "Georgia" names two countries; the one with more institutions wins
+        self.assertEqual(self.index.country("Georgia"), self.georgia.pk)
+
+    def test_exact_match(self):
+        self.assertEqual(self.index.match("harvard university"), self.harvard)
+        self.assertEqual(self.index.match("Universite de Montreal"), self.montreal)
+
+    def test_fuzzy_match(self):
+        self.assertEqual(self.index.match("Harvard Universty"), self.harvard)
+        self.assertIsNone(self.index.match("Harvard"))
+
+    def test_fuzzy_match_respects_country(self):
+        self.assertIsNone(
+            self.index.match("Harvard Universty", country_id=self.georgia.pk)
+        )
+        self.assertEqual(
+            self.index.match("Harvard Universty", country_id=self.usa.pk),
+            self.harvard,
+        )
+
+    def test_empty_name(self):
+        self.assertIsNone(self.index.match(""))
+        unnamed = Institution.objects.create(name="", country=self.usa)
+        self.index.add(unnamed)
+        self.assertEqual(self.index.match("", country_id=self.usa.pk), unnamed)
+        self.assertEqual(self.index.match("--", country_id=self.usa.pk), unnamed)
+
+    def test_add(self):
+        self.assertIsNone(self.index.match("Ohio State University"))
+        osu = Institution.objects.create(name="Ohio State University")
+        self.index.add(osu)
+        self.assertEqual(self.index.match("ohio state university"), osu)
+
+    def test_add_updates_fuzzy_matches(self):
+        self.assertIsNone(self.index.match("Ohio State Universty"))
+        self.assertIsNone(self.index.match("Harvard"))
+        osu = Institution.objects.create(name="Ohio State University")
+        self.index.add(osu)
+        self.assertEqual(self.index.match("Ohio State Universty"), osu)
+        # Misses the new name is unlike stay cached
+        self.assertEqual(self.index.fuzzy_matches[normalize_name("Harvard")], [])
+
+    def test_discard_added(self):
+        self.index.add(Institution.objects.create(name="Ohio State University"))
+        n_added = len(self.index.added)
+        self.index.add(Institution.objects.create(name="Ohio State Universities"))
+        self.assertIsNotNone(self.index.match("Ohio State Universitie"))
+        self.index.discard_added(n_added)
+        self.assertEqual(
+            self.index.match("Ohio State Universitie").name, "Ohio State University"
+        )
+        self.assertNotIn("ohio state universities", self.index.institutions)
+
+    def test_no_queries_when_matching(self):
+        with self.assertNumQueries(0):
+            self.index.match("Harvard University")
+            self.index.match("Somewhere Else")
+            self.index.country("USA")
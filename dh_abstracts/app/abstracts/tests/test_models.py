@@ -1,4 +1,7 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 
 from abstracts.models import (
     Organizer,
@@ -22,7 +25,15 @@ from abstracts.models import (
     FileImportTries,
     License,
 )
+from abstracts.tei import TEIZipError
 from lxml.etree import XMLSyntaxError, DocumentInvalid
+from tempfile import TemporaryDirectory
+from glob import glob
+from contextlib import redirect_stdout
+from os.path import relpath
+import hashlib
+import io
+import zipfile
 
 
 class ConferenceXMLImportTest(TestCase):
@@ -110,4 +121,617 @@ class ConferenceXMLDirectoryImportTest(TestCase):
             ).exists()
         )
         self.assertGreater(len(import_response["failed_files"]), 0)
-        self.assertGreater(len(import_response["successful_files"]), 0)
\ No newline at end of file
+        self.assertGreater(len(import_response["successful_files"]), 0)
+
+    @override_settings(TEI_IMPORT_WORKERS=2)
+    def test_load_directory_parallel(self):
+        conference = Conference.objects.first()
+
+        import_response = conference.import_xml_directory(
+            "abstracts/static/tei/valid_tei"
+        )
+        self.assertEqual(len(import_response["successful_files"]), 2)
+        self.assertEqual(len(import_response["failed_files"]), 0)
+        self.assertEqual(
+            Work.objects.filter(conference=conference, full_text_type="xml").count(), 2
+        )
+
+    @override_settings(TEI_IMPORT_WORKERS=2)
+    def test_invalid_files_skip_writes(self):
+        conference = Conference.objects.first()
+        n_attempts = FileImportTries.objects.count()
+
+        import_response = conference.import_xml_directory(
+            "abstracts/static/tei/invalid_tei"
+        )
+        # Every malformed file is reported, and nothing is written for the valid ones
+        self.assertEqual(len(import_response["failed_files"]), 2)
+        self.assertEqual(FileImportTries.objects.count(), n_attempts)
+
+
+class WorkFullTextHashTest(TestCase):
+    fixtures = ["test.json"]
+
+    def test_hash_follows_text(self):
+        work = Work.objects.first()
+        work.full_text = "Some text"
+        work.save()
+        self.assertEqual(
+            Work.objects.get(pk=work.pk).full_text_hash,
+            hashlib.sha256(b"Some text").hexdigest(),
+        )
+        work.full_text = "Other text"
+        work.save(update_fields=["full_text"])
+        self.assertEqual(
+            Work.objects.get(pk=work.pk).full_text_hash,
+            hashlib.sha256(b"Other text").hexdigest(),
+        )
+
+
+class WorkFullTextRenditionTest(TestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.work = Work.objects.get(pk=1)
+
+    def test_txt(self):
+        self.work.full_text = "First <b>para</b>\ngraph\n\nSecond"
+        self.work.save()
+        work = Work.objects.get(pk=self.work.pk)
+        self.assertEqual(
+            work.full_text_html,
+            "<p>First &lt;b&gt;para&lt;/b&gt;<br>graph</p>\n\n<p>Second</p>",
+        )
+        self.assertEqual(work.full_text_summary, "First <b>para</b> graph Second")
+
+    def test_xml(self):
+        self.work.full_text = "<text><p>First</p>\n   \n<p>Second & last</p></text>"
+        self.work.full_text_type = "xml"
+        self.work.save(update_fields=["full_text", "full_text_type"])
+        work = Work.objects.get(pk=self.work.pk)
+        self.assertEqual(
+            work.full_text_html, "<p>First</p>\n\n<p>Second &amp; last</p>"
+        )
+        self.assertEqual(work.full_text_summary, "First Second & last")
+
+    def test_summary_length(self):
+        self.work.save()
+        self.assertEqual(len(self.work.full_text_summary), 197)
+        self.assertTrue(self.work.full_text_summary.startswith("Lorem Ipsum Dolor"))
+
+    def test_empty(self):
+        self.work.full_text = "  "
+        self.work.save()
+        self.assertEqual(self.work.full_text_html, "")
+        self.assertEqual(self.work.full_text_summary, "")
+
+    def test_save_other_fields(self):
+        self.work.save()
+        work = Work.objects.defer("full_text").get(pk=self.work.pk)
+        work.title = "Renamed"
+        work.full_text_html = "<p>Kept</p>"
+        with self.assertNumQueries(2):
+            work.save(update_fields=["title", "full_text_html"])
+        self.assertIn("full_text", work.get_deferred_fields())
+        work = Work.objects.get(pk=self.work.pk)
+        self.assertEqual(work.title, "Renamed")
+        self.assertEqual(work.full_text_html, "<p>Kept</p>")
+
+    def test_render_full_texts(self):
+        # Fixtures are loaded without Work.save
+        n_works = Work.objects.count()
+        self.assertEqual(
+            Work.objects.filter(full_text_html__isnull=True).count(), n_works
+        )
+        self.work.save()
+        with self.assertNumQueries(3):
+            self.assertEqual(Work.render_full_texts(batch_size=100), n_works - 1)
+        self.assertFalse(Work.objects.filter(full_text_html__isnull=True).exists())
+        self.assertTrue(
+            Work.objects.get(pk=3).full_text_html.startswith("<p>Lorem Ipsum")
+        )
+        self.assertEqual(Work.render_full_texts(), 0)
+        self.assertEqual(Work.render_full_texts(rerender=True), n_works)
+
+    def test_command(self):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            call_command("render_full_texts", batch_size=2)
+        n_works = Work.objects.count()
+        self.assertIn(f"{n_works}/{n_works} works rendered", out.getvalue())
+        self.assertFalse(Work.objects.filter(full_text_html__isnull=True).exists())
+
+
+class ListQuerySetTest(TestCase):
+    fixtures = ["test.json"]
+
+    def test_work_for_list(self):
+        work = Work.objects.first()
+        work.full_text = "Some text"
+        work.save()
+        empty = Work.objects.exclude(pk=work.pk).first()
+        empty.full_text = ""
+        empty.save()
+        works = Work.objects.for_list().in_bulk([work.pk, empty.pk])
+        self.assertEqual(
+            works[work.pk].get_deferred_fields(),
+            {"full_text", "full_text_html", "search_text"},
+        )
+        with self.assertNumQueries(0):
+            self.assertTrue(works[work.pk].has_full_text)
+            self.assertEqual(works[work.pk].full_text_length, len("Some text"))
+            self.assertFalse(works[empty.pk].has_full_text)
+            self.assertEqual(works[empty.pk].full_text_length, 0)
+
+    def test_conference_for_list(self):
+        conference = Conference.objects.for_list().first()
+        self.assertEqual(
+            conference.get_deferred_fields(),
+            {"notes", "references", "attendance", "search_text"},
+        )
+
+
+class ConferenceXMLZipImportTest(TestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        tdir = TemporaryDirectory()
+        self.addCleanup(tdir.cleanup)
+        self.zip_path = f"{tdir.name}/tei.zip"
+
+    def write_zip(self, filepaths):
+        with zipfile.ZipFile(self.zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+            for f in filepaths:
+                zf.write(f, relpath(f, "abstracts/static"))
+            # Hidden files and non-XML files are skipped, as with a glob of the extracted archive
+            zf.writestr("__MACOSX/tei/._abstract_tei.xml", "not xml")
+            zf.writestr("tei/notes.txt", "not xml")
+
+    def test_load_zip(self):
+        conference = Conference.objects.first()
+        self.write_zip(sorted(glob("abstracts/static/tei/valid_tei/*.xml")))
+
+        import_response = conference.import_xml_zip(self.zip_path)
+        self.assertEqual(
+            import_response["successful_files"],
+            ["tei/valid_tei/abstract_tei.xml", "tei/valid_tei/abstract_tei2.xml"],
+        )
+        self.assertEqual(len(import_response["failed_files"]), 0)
+        self.assertEqual(
+            Work.objects.filter(conference=conference, full_text_type="xml").count(),
+            2,
+        )
+
+    def test_load_bad_zip(self):
+        conference = Conference.objects.first()
+        self.write_zip(sorted(glob("abstracts/static/tei/invalid_tei/*.xml")))
+
+        import_response = conference.import_xml_zip(self.zip_path)
+        self.assertEqual(
+            [f["filepath"] for f in import_response["failed_files"]],
+            ["tei/invalid_tei/abstract_tei2.xml", "tei/invalid_tei/bad_tei.xml"],
+        )
+        self.assertFalse(
+            Work.objects.filter(conference=conference, full_text_type="xml").exists()
+        )
+
+    def test_reimport_skips_unchanged_files(self):
+        conference = Conference.objects.first()
+        self.write_zip(sorted(glob("abstracts/static/tei/valid_tei/*.xml")))
+        conference.import_xml_zip(self.zip_path)
+        n_attempts = FileImportTries.objects.count()
+
+        import_response = conference.import_xml_zip(self.zip_path)
+        self.assertEqual(import_response["successful_files"], [])
+        self.assertEqual(len(import_response["skipped_files"]), 2)
+        self.assertEqual(FileImportTries.objects.count(), n_attempts)
+
+        # Unchanged files are only skipped for the conference they were imported into
+        other_conference = Conference.objects.exclude(pk=conference.pk).first()
+        import_response = other_conference.import_xml_zip(self.zip_path)
+        self.assertEqual(len(import_response["successful_files"]), 2)
+
+    def test_reimport_changed_file(self):
+        conference = Conference.objects.first()
+        self.write_zip(sorted(glob("abstracts/static/tei/valid_tei/*.xml")))
+        conference.import_xml_zip(self.zip_path)
+        work = Work.objects.get(
+            conference=conference, title__startswith="Archivos digitales"
+        )
+
+        # A corrected keyword changes the file but not the work's text or title
+        with open("abstracts/static/tei/valid_tei/abstract_tei.xml") as f:
+            tei = f.read()
+        with zipfile.ZipFile(self.zip_path, "w") as zf:
+            zf.writestr(
+                "tei/abstract_tei.xml",
+                tei.replace(
+                    "<term>crowdsourcing</term>", "<term>crowd-sourcing</term>"
+                ),
+            )
+            zf.write(
+                "abstracts/static/tei/valid_tei/abstract_tei2.xml",
+                "tei/abstract_tei2.xml",
+            )
+        import_response = conference.import_xml_zip(self.zip_path)
+        self.assertEqual(import_response["successful_files"], ["tei/abstract_tei.xml"])
+        self.assertEqual(import_response["skipped_files"], ["tei/abstract_tei2.xml"])
+        self.assertEqual(
+            Work.objects.filter(conference=conference, full_text_type="xml").count(),
+            2,
+        )
+        self.assertTrue(work.keywords.filter(title="crowd-sourcing").exists())
+
+    def test_reimport_deleted_work(self):
+        conference = Conference.objects.first()
+        self.write_zip(sorted(glob("abstracts/static/tei/valid_tei/*.xml")))
+        conference.import_xml_zip(self.zip_path)
+        Work.objects.filter(conference=conference, full_text_type="xml").delete()
+
+        import_response = conference.import_xml_zip(self.zip_path)
+        self.assertEqual(len(import_response["successful_files"]), 2)
+        self.assertEqual(import_response["skipped_files"], [])
+
+    @override_settings(TEI_ZIP_MAX_MEMBERS=1)
+    def test_too_many_members(self):
+        conference = Conference.objects.first()
+        self.write_zip(sorted(glob("abstracts/static/tei/valid_tei/*.xml")))
+
+        with self.assertRaises(TEIZipError):
+            conference.import_xml_zip(self.zip_path)
+        self.assertFalse(FileImportTries.objects.exists())
+
+    @override_settings(TEI_ZIP_MAX_MEMBER_SIZE=1000)
+    def test_member_too_large(self):
+        conference = Conference.objects.first()
+        self.write_zip(sorted(glob("abstracts/static/tei/valid_tei/*.xml")))
+
+        with self.assertRaisesRegex(TEIZipError, "abstract_tei"):
+            conference.import_xml_zip(self.zip_path)
+
+    @override_settings(TEI_ZIP_MAX_TOTAL_SIZE=1000)
+    def test_total_too_large(self):
+        conference = Conference.objects.first()
+        self.write_zip(sorted(glob("abstracts/static/tei/valid_tei/*.xml")))
+
+        with self.assertRaisesRegex(TEIZipError, "one import"):
+            conference.import_xml_zip(self.zip_path)
+
+
+class TagMultiMergeTest(TestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.target = Keyword.objects.create(title="digital humanities")
+        self.sources = [
+            Keyword.objects.create(title="Digital Humanities"),
+            Keyword.objects.create(title="digital-humanities"),
+        ]
+        works = list(Work.objects.order_by("pk")[:4])
+        self.both_sources, self.one_source, self.already_target, self.untouched = works
+        self.both_sources.keywords.add(*self.sources)
+        self.one_source.keywords.add(self.sources[1])
+        self.already_target.keywords.add(self.sources[0], self.target)
+
+    def test_multi_merge(self):
+        # The same handful of statements however many works are tagged
+        with self.assertNumQueries(6):
+            results = Keyword.multi_merge(self.sources, self.target)
+        self.assertEqual(
+            results, {"update_results": 3, "added_results": 2, "delete_results": 2}
+        )
+        self.assertFalse(
+            Keyword.objects.filter(pk__in=[s.pk for s in self.sources]).exists()
+        )
+        self.assertEqual(
+            set(self.target.works.values_list("pk", flat=True)),
+            {self.both_sources.pk, self.one_source.pk, self.already_target.pk},
+        )
+        self.assertFalse(self.untouched.keywords.filter(pk=self.target.pk).exists())
+
+    def test_merge_keeps_other_tags(self):
+        other_keywords = set(
+            self.both_sources.keywords.exclude(
+                pk__in=[s.pk for s in self.sources]
+            ).values_list("pk", flat=True)
+        )
+        results = self.sources[0].merge(self.target)
+        self.assertEqual(results["update_results"], 2)
+        self.assertEqual(results["added_results"], 1)
+        self.assertEqual(
+            set(self.both_sources.keywords.values_list("pk", flat=True)),
+            other_keywords | {self.target.pk, self.sources[1].pk},
+        )
+
+    def test_target_among_sources(self):
+        results = Keyword.multi_merge([self.target, self.sources[0]], self.target)
+        self.assertEqual(results["delete_results"], 1)
+        self.assertTrue(Keyword.objects.filter(pk=self.target.pk).exists())
+
+
+class InstitutionMultiMergeTest(TestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.target = Institution.objects.create(name="University of Somewhere")
+        self.sources = [
+            Institution.objects.create(name="Univ. of Somewhere"),
+            Institution.objects.create(name="Somewhere University"),
+        ]
+        self.target_root = Affiliation.objects.create(institution=self.target)
+        # Collides with the target's own affiliation
+        self.source_root = Affiliation.objects.create(institution=self.sources[0])
+        # Both sources have an English department, and neither does the target
+        self.english = Affiliation.objects.create(
+            institution=self.sources[0], department="English"
+        )
+        self.other_english = Affiliation.objects.create(
+            institution=self.sources[1], department="English"
+        )
+        self.authorships = list(Authorship.objects.order_by("pk")[:3])
+        for authorship in self.authorships:
+            authorship.affiliations.clear()
+        self.authorships[0].affiliations.add(self.source_root, self.english)
+        self.authorships[1].affiliations.add(self.other_english)
+        self.authorships[2].affiliations.add(self.target_root, self.source_root)
+        self.conference = Conference.objects.first()
+        self.conference.hosting_institutions.set([self.target, self.sources[0]])
+        self.conference.save()
+
+    def test_multi_merge(self):
+        results = Institution.multi_merge(self.sources, self.target)
+        self.assertEqual(
+            results,
+            {
+                "update_results": 3,
+                "updated_authorships": 2,
+                "updated_conferences": 1,
+                "delete_results": 2,
+            },
+        )
+        self.assertFalse(
+            Institution.objects.filter(pk__in=[s.pk for s in self.sources]).exists()
+        )
+        self.assertEqual(
+            set(self.target.affiliations.values_list("pk", flat=True)),
+            {self.target_root.pk, self.english.pk},
+        )
+        self.assertEqual(
+            set(self.authorships[0].affiliations.all()),
+            {self.target_root, self.english},
+        )
+        self.assertEqual(list(self.authorships[1].affiliations.all()), [self.english])
+        self.assertEqual(
+            list(self.authorships[2].affiliations.all()), [self.target_root]
+        )
+        conference = Conference.objects.get(pk=self.conference.pk)
+        self.assertEqual(list(conference.hosting_institutions.all()), [self.target])
+        self.assertIn("University of Somewhere", conference.search_text)
+        self.assertNotIn("Univ. of Somewhere", conference.search_text)
+
+    def test_affiliation_multi_merge(self):
+        results = Affiliation.multi_merge(
+            [self.source_root, self.english], self.target_root
+        )
+        self.assertEqual(results, {"update_results": 1, "delete_results": 2})
+        self.assertEqual(
+            list(self.authorships[0].affiliations.all()), [self.target_root]
+        )
+        self.assertEqual(
+            list(self.authorships[2].affiliations.all()), [self.target_root]
+        )
+
+
+class CountryMultiMergeTest(TestCase):
+    def setUp(self):
+        self.target = Country.objects.create(
+            pref_name="United States", tgn_id="http://vocab.getty.edu/tgn/test-us"
+        )
+        self.source = Country.objects.create(
+            pref_name="USA", tgn_id="http://vocab.getty.edu/tgn/test-usa"
+        )
+        self.label = CountryLabel.objects.create(name="U.S.A.", country=self.source)
+        self.target_harvard = Institution.objects.create(
+            name="Harvard University", country=self.target
+        )
+        self.source_harvard = Institution.objects.create(
+            name="Harvard University", country=self.source
+        )
+        self.yale = Institution.objects.create(
+            name="Yale University", country=self.source
+        )
+        self.department = Affiliation.objects.create(
+            institution=self.source_harvard, department="History"
+        )
+        self.conference = Conference(year=2030, country=self.source)
+        self.conference.save()
+
+    def test_multi_merge(self):
+        results = Country.multi_merge([self.source], self.target)
+        self.assertEqual(
+            results,
+            {
+                "update_results": 1,
+                "merged_institutions": 1,
+                "updated_conferences": 1,
+                "delete_results": 1,
+            },
+        )
+        self.assertFalse(Country.objects.filter(pk=self.source.pk).exists())
+        self.assertFalse(Institution.objects.filter(pk=self.source_harvard.pk).exists())
+        self.assertEqual(Institution.objects.get(pk=self.yale.pk).country, self.target)
+        self.assertEqual(
+            Affiliation.objects.get(pk=self.department.pk).institution,
+            self.target_harvard,
+        )
+        self.assertEqual(
+            Conference.objects.get(pk=self.conference.pk).country, self.target
+        )
+        self.assertEqual(
+            CountryLabel.objects.get(pk=self.label.pk).country, self.target
+        )
+
+
+class AuthorReindexAppellationsTest(TestCase):
+    fixtures = ["test.json"]
+
+    def expected_index(self, author):
+        names = sorted(
+            set(
+                Appellation.objects.filter(asserted_by__author=author).values_list(
+                    "last_name", "first_name"
+                )
+            )
+        )
+        return " ".join(f"{first} {last}" for last, first in names)
+
+    def setUp(self):
+        self.orphan = Author.objects.create()
+        Author.objects.update(appellations_index="stale")
+
+    def test_reindex_all(self):
+        n_authors = Author.objects.count()
+        calls = []
+        with self.assertNumQueries(1 + (n_authors + 1) // 2):
+            n_changed = Author.reindex_appellations(
+                batch_size=2, progress=lambda *p: calls.append(p)
+            )
+        self.assertEqual(n_changed, n_authors)
+        self.assertEqual(calls[-1], (n_authors, n_authors))
+        self.assertEqual(len(calls), (n_authors + 1) // 2)
+        for author in Author.objects.all():
+            self.assertEqual(author.appellations_index, self.expected_index(author))
+        self.assertEqual(Author.objects.get(pk=self.orphan.pk).appellations_index, "")
+        # Nothing left to change
+        self.assertEqual(Author.reindex_appellations(), 0)
+
+    def test_reindex_some(self):
+        author = Authorship.objects.first().author
+        self.assertEqual(Author.reindex_appellations([author.pk, author.pk]), 1)
+        self.assertEqual(
+            Author.objects.get(pk=author.pk).appellations_index,
+            self.expected_index(author),
+        )
+        self.assertEqual(
+            Author.objects.exclude(pk=author.pk)
+            .exclude(appellations_index="stale")
+            .count(),
+            0,
+        )
+
+    def test_merge_queues_reindex(self):
+        source, target = Author.objects.filter(authorships__isnull=False).distinct()[:2]
+        with self.captureOnCommitCallbacks(execute=True):
+            source.merge(target)
+        self.assertEqual(
+            Author.objects.get(pk=target.pk).appellations_index,
+            self.expected_index(target),
+        )
+
+
+class WorkSetAuthorshipsTest(TestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.work = Work.objects.get(pk=1)
+        self.authors = {a.pk: a for a in Author.objects.all()}
+        self.affiliations = {a.pk: a for a in Affiliation.objects.all()}
+
+    def entry(self, author, order, first_name, last_name, affiliations):
+        return {
+            "author": author,
+            "authorship_order": order,
+            "first_name": first_name,
+            "last_name": last_name,
+            "affiliations": [self.affiliations[pk] for pk in affiliations],
+        }
+
+    def current_entries(self):
+        return [
+            self.entry(
+                a.author,
+                a.authorship_order,
+                a.appellation.first_name,
+                a.appellation.last_name,
+                [aff.pk for aff in a.affiliations.all()],
+            )
+            for a in self.work.authorships.all()
+        ]
+
+    def test_unchanged(self):
+        results = self.work.set_authorships(self.current_entries())
+        self.assertEqual(
+            results,
+            {
+                "created": 0,
+                "updated": 0,
+                "deleted": 0,
+                "touched_authors": set(),
+                "renamed_authors": set(),
+            },
+        )
+
+    def test_diff(self):
+        first = self.work.authorships.get(author=1).appellation
+        third = Authorship.objects.filter(author=3).first().appellation
+        with self.captureOnCommitCallbacks(execute=True):
+            results = self.work.set_authorships(
+                [
+                    self.entry(
+                        self.authors[1], 2, first.first_name, first.last_name, [1, 3]
+                    ),
+                    self.entry(None, 1, "Grace", "Hopper", [4]),
+                    self.entry(
+                        self.authors[3], 3, third.first_name, third.last_name, []
+                    ),
+                ],
+                deleted_authors=[self.authors[2]],
+            )
+        new_author = self.work.authorships.get(authorship_order=1).author
+        self.assertEqual(
+            results,
+            {
+                "created": 2,
+                "updated": 1,
+                "deleted": 1,
+                "touched_authors": {1, 2, 3, new_author.pk},
+                "renamed_authors": {2, 3, new_author.pk},
+            },
+        )
+        self.assertEqual(
+            [
+                (a.author_id, a.authorship_order, str(a.appellation))
+                for a in self.work.authorships.order_by("authorship_order")
+            ],
+            [
+                (new_author.pk, 1, "Grace Hopper"),
+                (1, 2, str(first)),
+                (3, 3, str(third)),
+            ],
+        )
+        self.assertEqual(
+            set(
+                self.work.authorships.get(author=1).affiliations.values_list(
+                    "pk", flat=True
+                )
+            ),
+            {1, 3},
+        )
+        self.assertEqual(
+            Author.objects.get(pk=new_author.pk).appellations_index, "Grace Hopper"
+        )
+
+    def count_queries(self, n):
+        entries = [
+            self.entry(None, i + 1, f"First{i}", f"Last{i}", [1, 2]) for i in range(n)
+        ]
+        sid = transaction.savepoint()
+        with CaptureQueriesContext(connection) as queries:
+            self.work.set_authorships(
+                entries, deleted_authors=list(self.work.authors.all())
+            )
+        transaction.savepoint_rollback(sid)
+        return len(queries)
+
+    def test_constant_queries(self):
+        self.assertEqual(self.count_queries(30), self.count_queries(2))
@@ -0,0 +1,82 @@
+from django.test import TestCase
+from django.core.management import call_command
+from django.db.models import Q
+from contextlib import redirect_stdout
+import io
+
+from abstracts.models import (
+    Affiliation,
+    Appellation,
+    Author,
+    Institution,
+    Keyword,
+    Topic,
+)
+from abstracts.orphans import OrphanSweeper
+
+
+class OrphanSweeperTest(TestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.institution = Institution.objects.create(name="Hanging Institute")
+        self.department = Affiliation.objects.create(
+            institution=self.institution, department="Hanging Department"
+        )
+        self.keywords = [Keyword.objects.create(title=f"unused {i}") for i in range(3)]
+        self.sweeper = OrphanSweeper()
+
+    def expected_counts(self):
+        # The querysets wipe_unused used to build
+        return {
+            "Author": Author.objects.exclude(authorships__isnull=False).count(),
+            "Affiliation": Affiliation.objects.exclude(
+                asserted_by__isnull=False
+            ).count(),
+            "Institution": Institution.objects.exclude(
+                Q(affiliations__asserted_by__isnull=False)
+                | Q(conferences__isnull=False)
+            ).count(),
+            "Keyword": Keyword.objects.exclude(works__isnull=False).count(),
+            "Topic": Topic.objects.exclude(works__isnull=False).count(),
+            "Appellation": Appellation.objects.exclude(
+                asserted_by__isnull=False
+            ).count(),
+        }
+
+    def test_counts(self):
+        with self.assertNumQueries(1):
+            counts = self.sweeper.counts()
+        self.assertEqual(counts, self.expected_counts())
+        self.assertGreaterEqual(counts["Keyword"], 3)
+
+    def test_sweep(self):
+        n_used_keywords = Keyword.objects.filter(works__isnull=False).distinct().count()
+        expected = self.expected_counts()
+        self.assertEqual(self.sweeper.sweep(), expected)
+        self.assertEqual(set(self.sweeper.counts().values()), {0})
+        self.assertEqual(Keyword.objects.count(), n_used_keywords)
+        self.assertFalse(Institution.objects.filter(pk=self.institution.pk).exists())
+
+    def test_batches(self):
+        n_keywords = self.sweeper.counts()["Keyword"]
+        sweeper = OrphanSweeper(batch_size=1)
+        # One statement per batch in its own savepoint, plus a final one that finds nothing
+        with self.assertNumQueries(3 * (n_keywords + 1)):
+            self.assertEqual(sweeper.delete("Keyword"), n_keywords)
+
+    def test_institution_takes_its_affiliations(self):
+        self.sweeper.delete("Institution")
+        self.assertFalse(Institution.objects.filter(pk=self.institution.pk).exists())
+        self.assertFalse(Affiliation.objects.filter(pk=self.department.pk).exists())
+
+    def test_command(self):
+        n_keywords = self.sweeper.counts()["Keyword"]
+        out = io.StringIO()
+        with redirect_stdout(out):
+            call_command("clean_hanging", dry_run=True)
+        self.assertIn(f"Keyword: {n_keywords} hanging", out.getvalue())
+        self.assertTrue(Keyword.objects.filter(pk=self.keywords[0].pk).exists())
+        with redirect_stdout(out):
+            call_command("clean_hanging", batch_size=2)
+        self.assertFalse(Keyword.objects.filter(pk=self.keywords[0].pk).exists())
@@ -0,0 +1,223 @@
+from django.test import TestCase, override_settings
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import URLPattern, reverse
+from collections import Counter
+from tempfile import TemporaryDirectory
+import re
+
+from abstracts import urls
+from abstracts.instrumentation import request_budget
+from abstracts.models import Conference, ImportJob
+
+# The most queries each URL may make when requested by a logged-in editor with the test fixture loaded, keyed by URL name. Lower a budget whenever a change makes a view cheaper. None may be looser than the production limit for the view in settings.REQUEST_BUDGETS.
+QUERY_BUDGETS = {
+    "home_view": 10,
+    "work_list": 13,
+    "works_export": 12,
+    "work_detail": 22,
+    "work_xml": 4,
+    "author_list": 6,
+    "author_detail": 27,
+    "author_merge": 23,
+    "author_split": 13,
+    "conference_list": 6,
+    "conference_series_detail": 15,
+    "standalone_conference_list": 11,
+    "conference_checkout": 6,
+    "conference_xml_load": 5,
+    "import_job_detail": 4,
+    "import_job_status": 3,
+    "download_data": 3,
+    "keyword-autocomplete": 4,
+    "language-autocomplete": 4,
+    "topic-autocomplete": 4,
+    "country-autocomplete": 4,
+    "appellation-autocomplete": 4,
+    "work-autocomplete": 4,
+    "institution-autocomplete": 4,
+    "affiliation-autocomplete": 4,
+    "author-autocomplete": 4,
+    "conference-autocomplete": 4,
+    "author-info-json": 14,
+    "affiliation-info-json": 4,
+    "work_create": 5,
+    "work_edit": 14,
+    "work_edit_authorship": 18,
+    "work_delete": 14,
+    "author_institution_list": 25,
+    "full_institution_list": 9,
+    "institution_edit": 5,
+    "institution_create": 4,
+    "institution_merge": 21,
+    "wipe_unused": 12,
+    "conference_create": 4,
+    "conference_delete": 5,
+    "conference_edit": 17,
+    "series_create": 3,
+    "series_edit": 4,
+    "series_delete": 4,
+    "full_organizer_list": 6,
+    "organizer_create": 4,
+    "organizer_edit": 6,
+    "organizer_delete": 4,
+    "affiliation_create": 3,
+    "ajax_affiliation_create": 7,
+    "affiliation_edit": 6,
+    "affiliation_merge": 19,
+    "affiliation_multi_merge": 5,
+    "institution_multi_merge": 5,
+    "full_keyword_list": 6,
+    "keyword_create": 3,
+    "keyword_delete": 4,
+    "keyword_edit": 4,
+    "keyword_merge": 25,
+    "keyword_multi_merge": 5,
+    "full_topic_list": 6,
+    "topic_create": 3,
+    "topic_delete": 4,
+    "topic_edit": 4,
+    "topic_merge": 25,
+    "topic_multi_merge": 5,
+    "full_language_list": 6,
+    "language_create": 3,
+    "language_delete": 4,
+    "language_edit": 4,
+    "language_merge": 25,
+    "language_multi_merge": 5,
+    "full_work_type_list": 6,
+    "work_type_create": 3,
+    "work_type_delete": 4,
+    "work_type_edit": 4,
+    "work_type_merge": 36,
+    "works_download": 0,
+    "public_all_tables_download": 0,
+    "private_all_tables_download": 2,
+}
+
+# Further requests for views whose cost depends on their query string: (URL name, GET data, budget)
+QUERY_BUDGET_VARIANTS = [
+    ("work_list", {"text": "lorem ipsum"}, 13),
+    ("work_list", {"ordering": "last_name", "full_text_available": True}, 13),
+    ("work_list", {"conference": 1}, 28),
+    ("author_list", {"name": "a", "ordering": "-n_works"}, 6),
+    ("author-autocomplete", {"q": "a"}, 4),
+    ("institution-autocomplete", {"q": "a"}, 4),
+    ("conference-autocomplete", {"q": "a"}, 4),
+]
+
+# Every URL argument refers to the first object of its kind in the fixture, except these
+URL_ARGUMENTS = {"export_format": "csv"}
+
+# Views that only accept POST, with the data to send them
+POST_DATA = {
+    "ajax_affiliation_create": {"department": "Budget Department", "institution": 1}
+}
+
+
+def url_patterns():
+    return [p for p in urls.urlpatterns if isinstance(p, URLPattern)]
+
+
+def normalize_sql(sql):
+    """
+    Replace the literals in a statement, so that statements repeated for different rows look the same
+    """
+    return re.sub(r"'[^']*'|\b\d+\b", "?", sql)
+
+
+def budget_report(label, budget, queries):
+    """
+    List the captured statements, marking the ones over budget with "+" and summarizing any that were repeated
+    """
+    lines = [f"{label} made {len(queries)} queries, {budget} allowed:"]
+    for i, query in enumerate(queries, start=1):
+        lines.append(f"{'+' if i > budget else ' '} {i}. {query['sql']}")
+    repeated = Counter(normalize_sql(q["sql"]) for q in queries)
+    repeated = [(sql, n) for sql, n in repeated.most_common() if n > 1]
+    if len(repeated) > 0:
+        lines.append("Repeated statements:")
+        lines.extend(f"  {n}x {sql}" for sql, n in repeated)
+    return "\n".join(lines)
+
+
+class QueryBudgetTest(TestCase):
+    fixtures = ["test.json"]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.import_job = ImportJob.objects.create(
+            conference=Conference.objects.get(pk=1), upload_path="budget.zip"
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.get(username="root"))
+        # The download views serve archives written by export_tables
+        data_dir = TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        for filename in [
+            f"{settings.DENORMALIZED_WORKS_NAME}.zip",
+            settings.PUBLIC_DATA_TABLE_CONFIG["DATA_ZIP_NAME"],
+            settings.PRIVATE_DATA_TABLE_CONFIG["DATA_ZIP_NAME"],
+        ]:
+            open(f"{data_dir.name}/{filename}", "wb").close()
+        data_settings = override_settings(DATA_OUTPUT_PATH=data_dir.name)
+        data_settings.enable()
+        self.addCleanup(data_settings.disable)
+
+    def url(self, pattern):
+        kwargs = {
+            name: URL_ARGUMENTS.get(name, 1)
+            for name in pattern.pattern.converters.keys()
+        }
+        if pattern.name in ("import_job_detail", "import_job_status"):
+            kwargs["pk"] = self.import_job.pk
+        return reverse(pattern.name, kwargs=kwargs)
+
+    def assertWithinBudget(self, label, url, budget, data=None, method="get"):
+        with CaptureQueriesContext(connection) as queries:
+            res = getattr(self.client, method)(url, data=data)
+            # Streamed bodies query the database as they are read
+            if res.streaming:
+                b"".join(res.streaming_content)
+        # An error page would make far fewer queries than the view itself
+        self.assertLess(res.status_code, 400, msg=label)
+        self.assertLessEqual(
+            len(queries),
+            budget,
+            msg=budget_report(label, budget, queries.captured_queries),
+        )
+
+    def test_every_url_has_a_budget(self):
+        self.assertEqual({p.name for p in url_patterns()} ^ set(QUERY_BUDGETS), set())
+
+    def test_budgets_within_request_budgets(self):
+        budgets = list(QUERY_BUDGETS.items())
+        budgets += [(name, budget) for name, _, budget in QUERY_BUDGET_VARIANTS]
+        for name, budget in budgets:
+            limit = request_budget(name).get("queries")
+            if limit is not None:
+                with self.subTest(name):
+                    self.assertLessEqual(budget, limit)
+
+    def test_urls(self):
+        for pattern in url_patterns():
+            with self.subTest(pattern.name):
+                self.assertWithinBudget(
+                    pattern.name,
+                    self.url(pattern),
+                    QUERY_BUDGETS[pattern.name],
+                    data=POST_DATA.get(pattern.name),
+                    method="post" if pattern.name in POST_DATA else "get",
+                )
+
+    def test_variants(self):
+        for name, data, budget in QUERY_BUDGET_VARIANTS:
+            with self.subTest(name, **data):
+                self.assertWithinBudget(
+                    f"{name} {data}", reverse(name), budget, data=data
+                )
@@ -0,0 +1,100 @@
+from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Count
+from tempfile import TemporaryDirectory
+from contextlib import redirect_stdout
+import io
+import json
+import random
+
+from abstracts.models import Author, Authorship, Conference, Keyword, Work
+from abstracts.synthetic import CorpusGenerator, Distribution, scaled_counts
+from abstracts.orphans import OrphanSweeper
+
+SCALE = 0.02
+
+
+class CorpusGeneratorTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.report = CorpusGenerator(scale=SCALE, batch_size=50).generate()
+
+    def test_counts(self):
+        n_works = scaled_counts(SCALE)["works"]
+        self.assertEqual(Work.objects.count(), n_works)
+        self.assertEqual(self.report.created["Work"], n_works)
+        self.assertEqual(self.report.created["Author"], Author.objects.count())
+        self.assertEqual(self.report.created["Authorship"], Authorship.objects.count())
+        # Several authors per work on average, some of them on more than one work
+        self.assertGreater(Authorship.objects.count(), 1.5 * n_works)
+        self.assertLess(Author.objects.count(), Authorship.objects.count())
+
+    def test_nothing_hanging(self):
+        counts = OrphanSweeper().counts()
+        for model_name in ("Author", "Appellation", "Affiliation", "Keyword"):
+            self.assertEqual(counts[model_name], 0, msg=model_name)
+
+    def test_authorship_order(self):
+        for work in Work.objects.annotate(n_authors=Count("authorships"))[:20]:
+            self.assertEqual(
+                sorted(work.authorships.values_list("authorship_order", flat=True)),
+                list(range(1, work.n_authors + 1)),
+            )
+
+    def test_derived_fields(self):
+        work = Work.objects.exclude(full_text="").first()
+        self.assertIsNotNone(work.search_text)
+        self.assertEqual(
+            (work.full_text_html, work.full_text_summary),
+            tuple(
+                Work.full_text_rendition(work.full_text, work.full_text_type).values()
+            ),
+        )
+        author = Author.objects.first()
+        self.assertIn(
+            author.most_recent_appellation.last_name, author.appellations_index
+        )
+        self.assertNotEqual(Conference.objects.first().search_text, "")
+
+    def test_sessions(self):
+        papers = Work.objects.filter(parent_session__isnull=False)
+        self.assertFalse(
+            papers.exclude(parent_session__work_type__is_parent=True).exists()
+        )
+        for paper in papers:
+            self.assertEqual(paper.conference_id, paper.parent_session.conference_id)
+
+
+class DistributionTest(TestCase):
+    def test_weights(self):
+        draws = Distribution(random.Random(0), {"a": 9, "b": 1}).draw(1000)
+        self.assertGreater(draws.count("a"), 800)
+
+    def test_zipf(self):
+        draws = Distribution(random.Random(0), list(range(100))).draw(1000)
+        self.assertGreater(draws.count(0), draws.count(99) * 10)
+
+    def test_distinct(self):
+        distribution = Distribution(random.Random(0), ["a", "b", "c"])
+        self.assertEqual(sorted(distribution.draw_distinct(5)), ["a", "b", "c"])
+
+
+class GenerateCorpusCommandTest(TestCase):
+    def test_ids(self):
+        with TemporaryDirectory() as tdir:
+            with redirect_stdout(io.StringIO()):
+                call_command(
+                    "generate_corpus", scale=0.005, ids_output=f"{tdir}/all_ids.json"
+                )
+            all_ids = json.load(open(f"{tdir}/all_ids.json"))
+        self.assertEqual(
+            sorted(all_ids["works"]), sorted(Work.objects.values_list("pk", flat=True))
+        )
+        self.assertEqual(len(all_ids["keywords"]), Keyword.objects.count())
+
+    def test_refuses_existing_works(self):
+        with redirect_stdout(io.StringIO()):
+            call_command("generate_corpus", scale=0.001, ids_output="/dev/null")
+        with self.assertRaises(CommandError):
+            call_command("generate_corpus", scale=0.001, ids_output="/dev/null")
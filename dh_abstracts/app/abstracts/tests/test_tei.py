@@ -0,0 +1,163 @@
+from django.test import SimpleTestCase
+from lxml.etree import XMLSyntaxError, DocumentInvalid
+
+from abstracts.tei import (
+    parse_tei_file,
+    parse_tei_files,
+    parse_tei_zip_members,
+    read_zip_member,
+    zip_tei_members,
+    tei_schema,
+    TEIZipError,
+)
+from glob import glob
+from hashlib import sha256
+import io
+import zipfile
+
+
+class ParseTEITest(SimpleTestCase):
+    def test_record(self):
+        record = parse_tei_file("abstracts/static/tei/valid_tei/abstract_tei.xml")
+        self.assertTrue(record["title"].startswith("Archivos digitales"))
+        self.assertEqual(record["work_type"], "short paper")
+        self.assertEqual(record["language_code"], "es")
+        self.assertIn("nuevos alfabetismos", record["keywords"])
+        self.assertIn("spanish", record["topics"])
+        self.assertTrue(record["full_text"].startswith("<text"))
+        self.assertEqual(
+            [(a["first_name"], a["last_name"]) for a in record["authors"]],
+            [("Maria Jose", "Afanador-Llach"), ("Andres", "Lombana")],
+        )
+
+    def test_hashes(self):
+        filepath = "abstracts/static/tei/valid_tei/abstract_tei.xml"
+        record = parse_tei_file(filepath)
+        with open(filepath, "rb") as f:
+            self.assertEqual(record["content_hash"], sha256(f.read()).hexdigest())
+        self.assertEqual(
+            record["full_text_hash"],
+            sha256(record["full_text"].encode("utf-8")).hexdigest(),
+        )
+
+    def test_affiliations_are_per_author(self):
+        record = parse_tei_file("abstracts/static/tei/valid_tei/abstract_tei.xml")
+        first_author, second_author = record["authors"]
+        self.assertEqual(
+            first_author["affiliations"],
+            [
+                {
+                    "department": "Departamento de Historia",
+                    "institution": "Universidad de los Andes",
+                    "city": "Bogotá",
+                    "country": "Colombia",
+                },
+                {
+                    "department": "",
+                    "institution": "Fundación Histórica Neogranadina",
+                    "city": "",
+                    "country": "Colombia",
+                },
+            ],
+        )
+        self.assertEqual(
+            [a["institution"] for a in second_author["affiliations"]],
+            ["Harvard University"],
+        )
+
+    def test_schema_built_once(self):
+        self.assertIs(tei_schema(), tei_schema())
+
+    def test_bad_file(self):
+        with self.assertRaises(XMLSyntaxError):
+            parse_tei_file("abstracts/static/tei/invalid_tei/bad_tei.xml")
+
+    def test_invalid_tei(self):
+        with self.assertRaises(DocumentInvalid):
+            parse_tei_file("abstracts/static/tei/invalid_tei/abstract_tei2.xml")
+
+
+class ParseTEIFilesTest(SimpleTestCase):
+    def test_parallel_matches_serial(self):
+        filepaths = sorted(glob("abstracts/static/tei/**/*.xml", recursive=True))
+        serial = list(parse_tei_files(filepaths))
+        parallel = list(parse_tei_files(filepaths, workers=2))
+        self.assertEqual(parallel, serial)
+        self.assertEqual([p["filepath"] for p in parallel], filepaths)
+
+    def test_bounded_reads(self):
+        filepaths = sorted(glob("abstracts/static/tei/**/*.xml", recursive=True))
+        read = []
+
+        def contents():
+            for f in filepaths:
+                read.append(f)
+                with open(f, "rb") as fp:
+                    yield fp.read()
+
+        results = parse_tei_files(filepaths, workers=2, contents=contents())
+        self.assertEqual(next(results)["filepath"], filepaths[0])
+        self.assertEqual(len(read), 4)
+        self.assertEqual(len(list(results)), len(filepaths) - 1)
+        self.assertEqual(read, filepaths)
+
+    def test_all_errors_reported(self):
+        results = list(
+            parse_tei_files(
+                sorted(glob("abstracts/static/tei/invalid_tei/*.xml")), workers=2
+            )
+        )
+        failed = [r["filepath"] for r in results if r["error"] is not None]
+        self.assertEqual(
+            failed,
+            [
+                "abstracts/static/tei/invalid_tei/abstract_tei2.xml",
+                "abstracts/static/tei/invalid_tei/bad_tei.xml",
+            ],
+        )
+        for r in results:
+            self.assertEqual(r["record"] is None, r["error"] is not None)
+
+
+class ParseTEIZipTest(SimpleTestCase):
+    def setUp(self):
+        self.filepaths = sorted(glob("abstracts/static/tei/valid_tei/*.xml"))
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+            for f in self.filepaths:
+                zf.write(f)
+        self.zf = zipfile.ZipFile(buffer)
+
+    def members(self, **limits):
+        return zip_tei_members(
+            self.zf,
+            **{
+                "max_members": 100,
+                "max_member_size": 10**6,
+                "max_total_size": 10**6,
+                **limits,
+            },
+        )
+
+    def test_matches_files_on_disk(self):
+        for workers in (1, 2):
+            results = list(
+                parse_tei_zip_members(self.zf, self.members(), workers=workers)
+            )
+            self.assertEqual(
+                results, list(parse_tei_files(self.filepaths, workers=workers))
+            )
+
+    def test_limits(self):
+        with self.assertRaises(TEIZipError):
+            self.members(max_members=1)
+        with self.assertRaises(TEIZipError):
+            self.members(max_member_size=100)
+        with self.assertRaises(TEIZipError):
+            self.members(max_total_size=100)
+
+    def test_member_larger_than_declared(self):
+        info = self.members()[0]
+        info.file_size = 100
+        with self.assertRaises(TEIZipError):
+            read_zip_member(self.zf, info)
@@ -0,0 +1,157 @@
+from django.test import TestCase
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from tempfile import TemporaryDirectory
+from glob import glob
+
+from abstracts.models import (
+    Conference,
+    Work,
+    FileImportMessgaes,
+    Language,
+    Institution,
+)
+from abstracts.tei import parse_tei_file
+from abstracts.tei_import import TEIRecordWriter
+
+VALID_FILES = sorted(glob("abstracts/static/tei/valid_tei/*.xml"))
+
+
+def work_summary(work):
+    return {
+        "title": work.title,
+        "work_type": work.work_type.title,
+        "keywords": sorted(k.title for k in work.keywords.all()),
+        "topics": sorted(t.title for t in work.topics.all()),
+        "languages": sorted(l.code for l in work.languages.all()),
+        "authorships": [
+            (
+                a.authorship_order,
+                a.author_id,
+                str(a.appellation),
+                sorted(str(aff) for aff in a.affiliations.all()),
+            )
+            for a in work.authorships.all()
+        ],
+    }
+
+
+class TEIRecordWriterTest(TestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.records = [parse_tei_file(f) for f in VALID_FILES]
+        self.batch_conference, self.serial_conference = Conference.objects.all()[:2]
+
+    def test_matches_file_by_file_import(self):
+        TEIRecordWriter(self.batch_conference, self.records).write()
+        for f in VALID_FILES:
+            self.serial_conference.import_xml_file(f)
+        batch_works = Work.objects.filter(
+            conference=self.batch_conference, full_text_type="xml"
+        ).order_by("title")
+        serial_works = Work.objects.filter(
+            conference=self.serial_conference, full_text_type="xml"
+        ).order_by("title")
+        self.assertEqual(len(batch_works), len(VALID_FILES))
+        self.assertEqual(
+            [work_summary(w) for w in batch_works],
+            [work_summary(w) for w in serial_works],
+        )
+
+    def test_search_index(self):
+        TEIRecordWriter(self.batch_conference, self.records).write()
+        self.assertTrue(
+            Work.objects.filter(
+                conference=self.batch_conference, search_text="digitales"
+            ).exists()
+        )
+
+    def test_reimport_reuses_rows(self):
+        TEIRecordWriter(self.batch_conference, self.records).write()
+        n_works = Work.objects.count()
+        TEIRecordWriter(self.batch_conference, self.records).write()
+        self.assertEqual(Work.objects.count(), n_works)
+        # Everything is matched the second time around
+        last_attempt_messages = FileImportMessgaes.objects.filter(
+            attempt__conference=self.batch_conference
+        ).order_by("-pk")[:10]
+        for m in last_attempt_messages:
+            self.assertEqual(m.addition_type, "mat")
+
+    def count_write_queries(self, records):
+        # Roll back afterwards, so that each count starts from the same database state
+        sid = transaction.savepoint()
+        with CaptureQueriesContext(connection) as queries:
+            TEIRecordWriter(self.batch_conference, records).write()
+        transaction.savepoint_rollback(sid)
+        return len(queries)
+
+    def test_constant_queries(self):
+        self.assertEqual(
+            self.count_write_queries(self.records * 10),
+            self.count_write_queries(self.records),
+        )
+
+    def test_unknown_language(self):
+        self.records[0]["language_code"] = "zz"
+        with self.assertRaises(Language.DoesNotExist):
+            TEIRecordWriter(self.batch_conference, self.records).write()
+
+
+class ImportDirectoryFallbackTest(TestCase):
+    fixtures = ["test.json"]
+
+    def test_database_error_reported_per_file(self):
+        conference = Conference.objects.first()
+        with TemporaryDirectory() as tdir:
+            for i, f in enumerate(VALID_FILES):
+                with open(f, encoding="utf-8") as source:
+                    tei = source.read()
+                if i == 0:
+                    tei = tei.replace('<text xml:lang="', '<text xml:lang="z')
+                with open(f"{tdir}/{i}.xml", "w", encoding="utf-8") as target:
+                    target.write(tei)
+            import_response = conference.import_xml_directory(tdir)
+        self.assertEqual(
+            [f["filepath"] for f in import_response["failed_files"]],
+            [f"{tdir}/0.xml"],
+        )
+        self.assertIn("DoesNotExist", import_response["failed_files"][0]["error"])
+        self.assertFalse(
+            Work.objects.filter(conference=conference, full_text_type="xml").exists()
+        )
+
+
+class EmptyInstitutionNameTest(TestCase):
+    fixtures = ["test.json"]
+
+    def write_files(self, tdir):
+        # Two affiliations with an empty institution name, in the same country but different cities
+        with open(VALID_FILES[0], encoding="utf-8") as source:
+            tei = source.read()
+        filepaths = []
+        for city in ["X", "Y"]:
+            filepath = f"{tdir}/{city}.xml"
+            with open(filepath, "w", encoding="utf-8") as target:
+                target.write(
+                    tei.replace("Universidad de los Andes", "").replace("Bogotá", city)
+                )
+            filepaths.append(filepath)
+        return filepaths
+
+    def test_batch_import(self):
+        conference = Conference.objects.first()
+        with TemporaryDirectory() as tdir:
+            filepaths = self.write_files(tdir)
+            import_response = conference.import_xml_directory(tdir)
+        self.assertEqual(import_response["failed_files"], [])
+        self.assertEqual(sorted(import_response["successful_files"]), filepaths)
+        self.assertEqual(Institution.objects.filter(name="").count(), 1)
+
+    def test_file_by_file_import(self):
+        conference = Conference.objects.first()
+        with TemporaryDirectory() as tdir:
+            for filepath in self.write_files(tdir):
+                conference.import_xml_file(filepath)
+        self.assertEqual(Institution.objects.filter(name="").count(), 1)
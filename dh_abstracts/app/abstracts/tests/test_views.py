@@ -1,8 +1,20 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Count
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
+from tempfile import TemporaryDirectory
+from datetime import timedelta
+from glob import glob
+from os.path import exists, relpath
+import csv
+import io
 import json
+import zipfile
 
 from abstracts.models import (
     Organizer,
@@ -25,9 +37,17 @@ from abstracts.models import (
     FileImportMessgaes,
     FileImportTries,
     License,
+    ImportJob,
 )
+from abstracts.views import cache_small_stream
 
 from abstracts.forms import WorkFilter
+from abstracts.exports import (
+    atomic_zip,
+    read_checksum,
+    write_manifest,
+    build_manifest,
+)
 
 
 class CachelessTestCase(TestCase):
@@ -91,6 +111,94 @@ class DownloadPageTest(CachelessTestCase):
     def test_render(self):
         publicly_available(self, "download_data")
 
+    def test_render_from_manifest(self):
+        with TemporaryDirectory() as tdir:
+            with override_settings(DATA_OUTPUT_PATH=tdir):
+                call_command("export_tables", compresslevel=1, stdout=io.StringIO())
+                self.client.get(reverse("download_data"))
+                cache.clear()
+                # The data dictionary comes from the manifest; only the base template's flatpage menu is queried
+                with self.assertNumQueries(1):
+                    res = self.client.get(reverse("download_data"))
+            self.assertContains(res, "SHA-256")
+            self.assertContains(res, f"{Work.objects.count()} rows")
+
+
+class DataArtifactDownloadTest(CachelessTestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        tdir = TemporaryDirectory()
+        self.addCleanup(tdir.cleanup)
+        self.data_dir = tdir.name
+        for zip_name in [
+            f"{settings.DENORMALIZED_WORKS_NAME}.zip",
+            settings.PUBLIC_DATA_TABLE_CONFIG["DATA_ZIP_NAME"],
+            settings.PRIVATE_DATA_TABLE_CONFIG["DATA_ZIP_NAME"],
+        ]:
+            with atomic_zip(f"{self.data_dir}/{zip_name}") as dat_zip:
+                dat_zip.writestr("data.csv", zip_name)
+        self.zip_path = f"{self.data_dir}/{settings.DENORMALIZED_WORKS_NAME}.zip"
+        self.etag = f'"{read_checksum(self.zip_path)}"'
+
+    def test_file_response(self):
+        with override_settings(
+            DATA_OUTPUT_PATH=self.data_dir, DATA_DOWNLOAD_ACCEL_PREFIX=""
+        ):
+            res = self.client.get(reverse("works_download"))
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res["ETag"], self.etag)
+            self.assertFalse(res.has_header("X-Accel-Redirect"))
+            with open(self.zip_path, "rb") as f:
+                self.assertEqual(b"".join(res.streaming_content), f.read())
+
+    def test_accel_redirect(self):
+        with override_settings(
+            DATA_OUTPUT_PATH=self.data_dir,
+            DATA_DOWNLOAD_ACCEL_PREFIX="/protected_data/",
+        ):
+            res = self.client.get(reverse("works_download"))
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(
+                res["X-Accel-Redirect"],
+                f"/protected_data/{settings.DENORMALIZED_WORKS_NAME}.zip",
+            )
+            self.assertEqual(res["ETag"], self.etag)
+            self.assertEqual(res.content, b"")
+
+    def test_not_modified(self):
+        with override_settings(
+            DATA_OUTPUT_PATH=self.data_dir,
+            DATA_DOWNLOAD_ACCEL_PREFIX="/protected_data/",
+        ):
+            res = self.client.get(
+                reverse("public_all_tables_download"),
+                HTTP_IF_NONE_MATCH=self.etag,
+            )
+            self.assertEqual(res.status_code, 200)
+            res = self.client.get(
+                reverse("works_download"), HTTP_IF_NONE_MATCH=self.etag
+            )
+            self.assertEqual(res.status_code, 304)
+            self.assertFalse(res.has_header("X-Accel-Redirect"))
+
+    def test_missing_artifact(self):
+        for accel_prefix in ["/protected_data/", ""]:
+            with self.subTest(accel_prefix=accel_prefix):
+                with override_settings(
+                    DATA_OUTPUT_PATH=f"{self.data_dir}/missing",
+                    DATA_DOWNLOAD_ACCEL_PREFIX=accel_prefix,
+                ):
+                    res = self.client.get(reverse("works_download"))
+                    self.assertEqual(res.status_code, 404)
+
+    def test_private_requires_login(self):
+        with override_settings(
+            DATA_OUTPUT_PATH=self.data_dir,
+            DATA_DOWNLOAD_ACCEL_PREFIX="/protected_data/",
+        ):
+            privately_available(self, "private_all_tables_download")
+
 
 class AuthorListViewTest(CachelessTestCase):
     """
@@ -330,6 +438,12 @@ class AuthorDetailViewTest(CachelessTestCase):
         res = self.client.get(reverse("author_detail", kwargs={"author_id": 1}))
         self.assertTrue(is_list_unique([d.id for d in res.context["affiliations"]]))
 
+    def test_full_text_deferred(self):
+        res = self.client.get(reverse("author_detail", kwargs={"author_id": 1}))
+        for w in res.context["works"]:
+            self.assertIn("full_text", w.get_deferred_fields())
+            self.assertIn("notes", w.conference.get_deferred_fields())
+
 
 class WorkListViewTest(CachelessTestCase):
     """
@@ -373,6 +487,13 @@ class WorkListViewTest(CachelessTestCase):
         for w in res.context["work_list"]:
             self.assertTrue(w.full_text != "")
 
+    def test_full_text_deferred(self):
+        res = self.client.get(reverse("work_list"))
+        for w in res.context["work_list"]:
+            self.assertIn("full_text", w.get_deferred_fields())
+            self.assertIn("notes", w.conference.get_deferred_fields())
+            self.assertIsInstance(w.has_full_text, bool)
+
     def test_work_type(self):
         res = self.client.get(reverse("work_list"), data={"work_type": 1})
         self.assertTrue(is_list_unique([d.id for d in res.context["work_list"]]))
@@ -469,6 +590,118 @@ class WorkListViewTest(CachelessTestCase):
         )
 
 
+class WorksExportViewTest(CachelessTestCase):
+    """
+    Test filtered works export
+    """
+
+    fixtures = ["test.json"]
+
+    def test_csv(self):
+        res = self.client.get(reverse("works_export", args=["csv"]))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res["Content-Type"], "text/csv")
+        rows = list(
+            csv.reader(io.StringIO(b"".join(res.streaming_content).decode("utf-8")))
+        )
+        self.assertEqual(rows[0], [h["name"] for h in settings.DENORMALIZED_HEADERS])
+        self.assertEqual(len(rows) - 1, Work.objects.count())
+
+    def test_jsonl_filtered(self):
+        res = self.client.get(
+            reverse("works_export", args=["jsonl"]), data={"keywords": 1}
+        )
+        self.assertEqual(res.status_code, 200)
+        records = [
+            json.loads(l)
+            for l in b"".join(res.streaming_content).decode("utf-8").splitlines()
+        ]
+        self.assertEqual(
+            sorted([r["work_id"] for r in records]),
+            list(
+                Work.objects.filter(keywords=1)
+                .order_by("id")
+                .values_list("id", flat=True)
+            ),
+        )
+
+    def test_unknown_format(self):
+        res = self.client.get(reverse("works_export", args=["xls"]))
+        self.assertEqual(res.status_code, 404)
+
+    def test_invalid_filter(self):
+        res = self.client.get(
+            reverse("works_export", args=["csv"]), data={"work_type": "x"}
+        )
+        self.assertEqual(res.status_code, 400)
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_cached(self):
+        url = reverse("works_export", args=["csv"])
+        first = b"".join(self.client.get(url, data={"conference": 1}).streaming_content)
+        # Only the filter is validated, by the form and by the Work model
+        with self.assertNumQueries(2):
+            res = self.client.get(url, data={"conference": 1})
+        self.assertEqual(res.content, first)
+        # Parameters that don't change the export share its cache entry
+        with self.assertNumQueries(2):
+            res = self.client.get(
+                url, data={"conference": 1, "ordering": "-title", "page": 2}
+            )
+        self.assertEqual(res.content, first)
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_cached_multiple_choice(self):
+        url = reverse("works_export", args=["jsonl"])
+        self.client.get(url, data={"keywords": [1, 2]}).getvalue()
+        self.assertFalse(self.client.get(url, data={"keywords": [2, 1]}).streaming)
+        self.assertTrue(self.client.get(url, data={"keywords": [1]}).streaming)
+
+    def test_unfiltered_redirects_to_archive(self):
+        with TemporaryDirectory() as tdir:
+            with override_settings(DATA_OUTPUT_PATH=tdir):
+                write_manifest(build_manifest({"denormalized": {"size": 1}}))
+                res = self.client.get(
+                    reverse("works_export", args=["csv"]), data={"ordering": "title"}
+                )
+                self.assertRedirects(
+                    res, reverse("works_download"), fetch_redirect_response=False
+                )
+                # There is no JSON Lines archive, and editors get a fresh export
+                self.assertTrue(
+                    self.client.get(reverse("works_export", args=["jsonl"])).streaming
+                )
+                self.client.force_login(User.objects.get(username="root"))
+                self.assertTrue(
+                    self.client.get(reverse("works_export", args=["csv"])).streaming
+                )
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_not_cached_for_editors(self):
+        url = reverse("works_export", args=["csv"])
+        self.client.get(url, data={"conference": 1}).getvalue()
+        self.client.force_login(User.objects.get(username="root"))
+        self.assertTrue(self.client.get(url, data={"conference": 1}).streaming)
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+        EXPORT_CACHE_MAX_BYTES=12,
+    )
+    def test_cache_limit_in_bytes(self):
+        list(cache_small_stream(["é" * 5, "\n"], "small"))
+        self.assertEqual(cache.get("small"), "ééééé\n")
+        list(cache_small_stream(["é" * 6, "\n"], "large"))
+        self.assertIsNone(cache.get("large"))
+
+
 class WorkDetailViewTest(CachelessTestCase):
     """
     Test Work detail view
@@ -499,6 +732,26 @@ class WorkDetailViewTest(CachelessTestCase):
         res = self.client.get(reverse("work_detail", kwargs={"work_id": 1}))
         self.assertContains(res, "Lorem Ipsum Dolor")
 
+    def test_unrendered_full_text(self):
+        # Works loaded without Work.save are rendered for the response, but
+        # not stored by a GET
+        res = self.client.get(reverse("work_detail", kwargs={"work_id": 1}))
+        self.assertContains(res, "<p>Lorem Ipsum Dolor")
+        self.assertIsNone(Work.objects.get(pk=1).full_text_html)
+
+    def test_stored_rendition(self):
+        Work.render_full_texts()
+        work = Work.objects.get(pk=1)
+        res = self.client.get(reverse("work_detail", kwargs={"work_id": 1}))
+        self.assertEqual(
+            res.context["work"].get_deferred_fields(), {"full_text", "search_text"}
+        )
+        self.assertContains(res, work.full_text_html)
+        self.assertContains(
+            res,
+            f'<meta name="twitter:description" content="{work.full_text_summary}" />',
+        )
+
 
 class ConferenceSeriesListViewTest(CachelessTestCase):
     """
@@ -531,6 +784,30 @@ class ConferenceSeriesDetailView(CachelessTestCase):
         self.assertTrue(is_list_unique(res.context["series_list"]))
 
 
+class AuthorSplitViewTest(CachelessTestCase):
+    fixtures = ["test.json"]
+
+    @as_auth
+    def test_post(self):
+        author = Author.objects.annotate(n=Count("authorships")).filter(n__gt=1)[0]
+        moved = author.authorships.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                reverse("author_split", kwargs={"pk": author.pk}),
+                data={"splitselect": [moved.pk]},
+                follow=True,
+            )
+        new_author = Authorship.objects.get(pk=moved.pk).author
+        self.assertNotEqual(new_author, author)
+        self.assertRedirects(
+            res, reverse("author_detail", kwargs={"author_id": new_author.pk})
+        )
+        self.assertEqual(
+            Author.objects.get(pk=new_author.pk).appellations_index,
+            f"{moved.appellation.first_name} {moved.appellation.last_name}",
+        )
+
+
 class AuthorMergeViewTest(CachelessTestCase):
     fixtures = ["test.json"]
 
@@ -769,6 +1046,142 @@ class DeleteConferenceViewTest(CachelessTestCase):
         self.assertFalse(Conference.objects.filter(pk=1).exists())
 
 
+class ConferenceXMLLoadViewTest(CachelessTestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        job_dir = TemporaryDirectory()
+        self.addCleanup(job_dir.cleanup)
+        settings_override = override_settings(IMPORT_JOB_PATH=job_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def tei_zip(self, filepaths):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as zf:
+            for f in filepaths:
+                zf.write(f, relpath(f, "abstracts/static"))
+        return SimpleUploadedFile("tei.zip", buffer.getvalue())
+
+    def upload(self, filepaths):
+        return self.client.post(
+            reverse("conference_xml_load", kwargs={"pk": 1}),
+            {"file": self.tei_zip(filepaths)},
+        )
+
+    def test_render(self):
+        privately_available(self, "conference_xml_load", kwargs={"pk": 1})
+
+    @as_auth
+    def test_post_queues_job(self):
+        res = self.upload(glob("abstracts/static/tei/valid_tei/*.xml"))
+        job = ImportJob.objects.get()
+        self.assertRedirects(res, job.get_absolute_url())
+        self.assertEqual(job.status, "q")
+        self.assertTrue(exists(job.upload_path))
+        # Nothing is imported until the worker runs
+        self.assertFalse(Work.objects.filter(full_text_type="xml").exists())
+
+    @as_auth
+    def test_not_a_zip(self):
+        res = self.client.post(
+            reverse("conference_xml_load", kwargs={"pk": 1}),
+            {"file": SimpleUploadedFile("tei.zip", b"not a zip")},
+        )
+        self.assertContains(res, "not a valid zipfile")
+        self.assertFalse(ImportJob.objects.exists())
+
+    @as_auth
+    @override_settings(TEI_ZIP_MAX_MEMBERS=1)
+    def test_zip_over_limits(self):
+        res = self.upload(glob("abstracts/static/tei/valid_tei/*.xml"))
+        self.assertContains(res, "at most 1 can be imported")
+        self.assertFalse(ImportJob.objects.exists())
+
+    @as_auth
+    def test_run_job(self):
+        filepaths = sorted(glob("abstracts/static/tei/valid_tei/*.xml"))
+        self.upload(filepaths)
+        call_command("run_import_jobs", once=True)
+        job = ImportJob.objects.get()
+        self.assertEqual(job.status, "s")
+        self.assertEqual(job.n_processed, len(filepaths))
+        self.assertEqual(
+            sorted(job.successful_files),
+            [relpath(f, "abstracts/static") for f in filepaths],
+        )
+        self.assertFalse(exists(job.upload_path))
+        self.assertEqual(
+            Work.objects.filter(conference_id=1, full_text_type="xml").count(),
+            len(filepaths),
+        )
+        res = self.client.get(job.get_absolute_url())
+        self.assertContains(res, "imported successfully")
+
+    @as_auth
+    def test_run_job_with_invalid_files(self):
+        self.upload(glob("abstracts/static/tei/**/*.xml", recursive=True))
+        call_command("run_import_jobs", once=True)
+        job = ImportJob.objects.get()
+        self.assertEqual(job.status, "f")
+        self.assertEqual(
+            sorted(f["filepath"] for f in job.failed_files),
+            ["tei/invalid_tei/abstract_tei2.xml", "tei/invalid_tei/bad_tei.xml"],
+        )
+        self.assertFalse(Work.objects.filter(full_text_type="xml").exists())
+        res = self.client.get(job.get_absolute_url())
+        self.assertContains(res, "bad_tei.xml")
+
+    @as_auth
+    @override_settings(IMPORT_JOB_TIMEOUT=60)
+    def test_stale_job_failed(self):
+        self.upload(glob("abstracts/static/tei/valid_tei/*.xml"))
+        self.upload(glob("abstracts/static/tei/valid_tei/*.xml"))
+        self.upload(glob("abstracts/static/tei/valid_tei/*.xml"))
+        stale, running, long_running = ImportJob.objects.order_by("created")
+        ImportJob.objects.filter(pk=stale.pk).update(
+            status="w",
+            started=timezone.now() - timedelta(minutes=2),
+            heartbeat=timezone.now() - timedelta(minutes=2),
+        )
+        ImportJob.objects.filter(pk=running.pk).update(
+            status="v", started=timezone.now(), heartbeat=timezone.now()
+        )
+        # Started long ago, but still reporting progress
+        long_running.status = "v"
+        long_running.started = timezone.now() - timedelta(minutes=2)
+        long_running.save()
+        long_running.report_progress("v", 1, 2)
+        self.assertIsNone(ImportJob.claim_next())
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(stale.status, "f")
+        self.assertTrue(stale.is_finished)
+        self.assertFalse(exists(stale.upload_path))
+        self.assertEqual(running.status, "v")
+        self.assertTrue(exists(running.upload_path))
+        long_running.refresh_from_db()
+        self.assertEqual(long_running.status, "v")
+
+    def test_status(self):
+        self.client.login(username="root", password="dh-abstracts")
+        self.upload(glob("abstracts/static/tei/valid_tei/*.xml"))
+        self.client.logout()
+        job = ImportJob.objects.get()
+        privately_available(self, "import_job_detail", kwargs={"pk": job.pk})
+        res = self.client.get(reverse("import_job_status", kwargs={"pk": job.pk}))
+        self.assertEqual(
+            res.json(),
+            {
+                "status": "q",
+                "status_display": "Queued",
+                "is_finished": False,
+                "n_files": 0,
+                "n_processed": 0,
+            },
+        )
+
+
 class CreateSeriesViewTest(CachelessTestCase):
     fixtures = ["test.json"]
 
@@ -873,6 +1286,48 @@ class DeleteOrganizerViewTest(CachelessTestCase):
         self.assertFalse(Organizer.objects.filter(pk=1).exists())
 
 
+class WorkEditAuthorshipViewTest(CachelessTestCase):
+    fixtures = ["test.json"]
+
+    def test_render(self):
+        privately_available(self, "work_edit_authorship", kwargs={"work_id": 1})
+
+    @as_auth
+    def test_post(self):
+        res = self.client.post(
+            reverse("work_edit_authorship", kwargs={"work_id": 1}),
+            data={
+                "form-TOTAL_FORMS": 3,
+                "form-INITIAL_FORMS": 2,
+                "form-0-author": 1,
+                "form-0-authorship_order": 2,
+                "form-0-first_name": "Ada",
+                "form-0-last_name": "Lovelace",
+                "form-0-affiliations": [1, 3],
+                "form-1-author": 2,
+                "form-1-authorship_order": 3,
+                "form-1-first_name": "Removed",
+                "form-1-last_name": "Author",
+                "form-1-DELETE": "on",
+                "form-2-authorship_order": 1,
+                "form-2-first_name": "Grace",
+                "form-2-last_name": "Hopper",
+                "form-2-affiliations": [4],
+            },
+            follow=True,
+        )
+        self.assertRedirects(res, reverse("work_detail", kwargs={"work_id": 1}))
+        self.assertContains(res, "authorships successfully updated")
+        authorships = Work.objects.get(pk=1).authorships.order_by("authorship_order")
+        self.assertEqual(
+            [str(a.appellation) for a in authorships], ["Grace Hopper", "Ada Lovelace"]
+        )
+        self.assertEqual(authorships[1].author_id, 1)
+        self.assertEqual(
+            set(authorships[1].affiliations.values_list("pk", flat=True)), {1, 3}
+        )
+
+
 class DeleteWorkViewTest(CachelessTestCase):
     fixtures = ["test.json"]
 
@@ -1149,6 +1604,29 @@ class TopicMultiMergeViewTest(CachelessTestCase):
         self.assertContains(res, "deleted")
 
 
+class LanguageMultiMergeViewTest(CachelessTestCase):
+    fixtures = ["test.json"]
+
+    def test_render(self):
+        privately_available(self, "language_multi_merge")
+
+    @as_auth
+    def test_post(self):
+        res = self.client.post(
+            reverse("language_multi_merge"),
+            data={"sources": [1, 3, 4], "into": 2},
+            follow=True,
+        )
+        expected_redirect = reverse("language_edit", kwargs={"pk": 2})
+        self.assertRedirects(res, expected_redirect)
+        self.assertFalse(Language.objects.filter(pk=1).exists())
+        self.assertTrue(Language.objects.filter(pk=2).exists())
+        self.assertFalse(Language.objects.filter(pk=3).exists())
+        self.assertFalse(Language.objects.filter(pk=4).exists())
+        self.assertContains(res, "updated")
+        self.assertContains(res, "deleted")
+
+
 class LanguageFullListViewTest(CachelessTestCase):
     """
     Test full Language list page
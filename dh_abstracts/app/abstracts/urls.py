@@ -8,6 +8,11 @@ urlpatterns = [
     path("__debug__/", include(debug_toolbar.urls)),
     path("", views.cache_for_anon(views.home_view), name="home_view"),
     path("works", views.cache_for_anon(views.FullWorkList.as_view()), name="work_list"),
+    path(
+        "works/export.<str:export_format>",
+        views.works_export,
+        name="works_export",
+    ),
     path(
         "works/<int:work_id>", views.cache_for_anon(views.work_view), name="work_detail"
     ),
@@ -51,6 +56,16 @@ urlpatterns = [
         views.ConferenceXMLLoad.as_view(),
         name="conference_xml_load",
     ),
+    path(
+        "conference/import_jobs/<int:pk>",
+        views.ImportJobDetail.as_view(),
+        name="import_job_detail",
+    ),
+    path(
+        "conference/import_jobs/<int:pk>/status",
+        views.import_job_status,
+        name="import_job_status",
+    ),
     path("downloads", views.cache_for_anon(views.download_data), name="download_data"),
     path(
         "keyword-autocomplete",
@@ -273,6 +288,11 @@ urlpatterns = [
         views.language_merge,
         name="language_merge",
     ),
+    path(
+        "editor/languages/multi_merge",
+        views.language_multi_merge,
+        name="language_multi_merge",
+    ),
     path("editor/work_types", views.WorkTypeList.as_view(), name="full_work_type_list"),
     path(
         "editor/work_types/create",
@@ -1,5 +1,12 @@
 from django.shortcuts import render
-from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse
+from django.http import (
+    HttpResponse,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+    FileResponse,
+    Http404,
+)
 from django.template import loader
 from django.shortcuts import get_object_or_404, render, redirect
 from django.views import View
@@ -16,6 +23,9 @@ from django.db.models import (
     ExpressionWrapper,
     FloatField,
     BooleanField,
+    Value,
+    Model,
+    QuerySet,
 )
 from django.db.models.functions import Concat, FirstValue, Cast
 from django.core import management
@@ -35,16 +45,29 @@ from django.forms.models import model_to_dict
 from django.forms import formset_factory, inlineformset_factory, modelformset_factory
 from django.conf import settings
 from django.utils.html import format_html
+from django.utils.http import parse_etags
 from django.views.decorators.cache import cache_page
+from django.core.cache import cache
 import glob
-from os.path import basename, getmtime
+from os import makedirs
+from os.path import exists
 from datetime import datetime
 import csv
 import sys
 from operator import attrgetter
-from tempfile import NamedTemporaryFile, TemporaryDirectory
+from tempfile import NamedTemporaryFile
 import zipfile
+from hashlib import sha1
+from urllib.parse import urlencode
 from . import models
+from .exports import (
+    filtered_denormalized_work_rows,
+    csv_lines,
+    jsonl_lines,
+    read_checksum,
+    load_manifest,
+    build_manifest,
+)
 
 from .models import (
     Work,
@@ -64,8 +87,11 @@ from .models import (
     CountryLabel,
     Authorship,
     License,
+    ImportJob,
 )
 
+from .tei import zip_tei_members, TEIZipError
+from .orphans import OrphanSweeper
 from .forms import (
     WorkFilter,
     AuthorFilter,
@@ -88,6 +114,7 @@ from .forms import (
     WorkTypeMergeForm,
     InstitutionMultiMergeForm,
     TopicMultiMergeForm,
+    LanguageMultiMergeForm,
     ConferenceXMLUploadForm,
 )
 
@@ -147,7 +174,7 @@ class WorkAutocomplete(ItemLabelAutocomplete):
 
     def get_queryset(self):
 
-        qs = Work.objects.all()
+        qs = Work.objects.only("title")
 
         parents_only = self.forwarded.get("parents_only", None)
         if parents_only:
@@ -311,13 +338,17 @@ class ConferenceAutocomplete(ItemLabelAutocomplete):
     raise_exception = True
 
     def get_queryset(self):
-        qs = Conference.objects.annotate(
-            main_series=StringAgg(
-                "series_memberships__series__abbreviation",
-                delimiter=" / ",
-                distinct=True,
+        qs = (
+            Conference.objects.for_list()
+            .annotate(
+                main_series=StringAgg(
+                    "series_memberships__series__abbreviation",
+                    delimiter=" / ",
+                    distinct=True,
+                )
             )
-        ).order_by("year", "main_series", "short_title", "theme_title")
+            .order_by("year", "main_series", "short_title", "theme_title")
+        )
 
         if self.q:
             qs = qs.filter(search_text__icontains=self.q).distinct()
@@ -341,6 +372,21 @@ class AuthorAutocomplete(ItemLabelAutocomplete):
             n_works=Count("authorships", distinct=True),
             main_last_name=Max("appellations__last_name"),
             main_first_name=Max("appellations__first_name"),
+            # The name from the author's latest conference, as Author.most_recent_appellation would give, without a query per result
+            recent_appellation=Subquery(
+                Authorship.objects.filter(author=OuterRef("pk"))
+                .order_by(
+                    "-work__conference__year",
+                    "appellation__last_name",
+                    "appellation__first_name",
+                )
+                .annotate(
+                    name=Concat(
+                        "appellation__first_name", Value(" "), "appellation__last_name"
+                    )
+                )
+                .values("name")[:1]
+            ),
         ).order_by("main_last_name", "main_first_name", "-n_works")
 
         if self.q:
@@ -350,7 +396,7 @@ class AuthorAutocomplete(ItemLabelAutocomplete):
 
     def get_result_label(self, item):
         return format_html(
-            f"{item.most_recent_appellation} ({item.n_works} works)<br><small text-class='muted'>(All names: {item.appellations_index})</small>"
+            f"{item.recent_appellation} ({item.n_works} works)<br><small text-class='muted'>(All names: {item.appellations_index})</small>"
         )
 
 
@@ -364,14 +410,17 @@ def work_view(request, work_id):
     ).prefetch_related("series", "organizers")
 
     work = get_object_or_404(
-        Work.objects.select_related("work_type", "full_text_license").prefetch_related(
+        Work.objects.defer("full_text", "search_text")
+        .with_full_text_flags()
+        .select_related("work_type", "full_text_license")
+        .prefetch_related(
             Prefetch("conference", queryset=related_conference),
             "keywords",
             "topics",
             "languages",
             Prefetch(
                 "session_papers",
-                queryset=Work.objects.prefetch_related(
+                queryset=Work.objects.for_list().prefetch_related(
                     Prefetch(
                         "authorships",
                         queryset=Authorship.objects.select_related("appellation"),
@@ -380,7 +429,7 @@ def work_view(request, work_id):
             ),
             Prefetch(
                 "parent_session",
-                queryset=Work.objects.prefetch_related(
+                queryset=Work.objects.for_list().prefetch_related(
                     Prefetch(
                         "authorships",
                         queryset=Authorship.objects.select_related(
@@ -392,6 +441,10 @@ def work_view(request, work_id):
         ),
         pk=work_id,
     )
+    if work.full_text_html is None:
+        # Not rendered yet: render for this response only, and leave storing
+        # renditions to render_full_texts
+        work.render_full_text()
 
     authorships = (
         Authorship.objects.filter(work_id=work_id)
@@ -418,7 +471,9 @@ def author_view(request, author_id):
         Authorship.objects.filter(author=author)
         .order_by("work__conference__year")
         .prefetch_related(
-            Prefetch("work", queryset=Work.objects.select_related("conference"))
+            Prefetch(
+                "work", queryset=Work.objects.for_list().select_related("conference")
+            )
         )
     )
 
@@ -444,7 +499,8 @@ def author_view(request, author_id):
     )
 
     works = (
-        Work.objects.filter(authorships__author=author)
+        Work.objects.for_list()
+        .filter(authorships__author=author)
         .order_by("conference__year")
         .distinct()
         .select_related("conference", "parent_session", "work_type")
@@ -453,7 +509,7 @@ def author_view(request, author_id):
                 "conference",
                 queryset=Conference.objects.prefetch_related("series", "organizers"),
             ),
-            "session_papers",
+            Prefetch("session_papers", queryset=Work.objects.for_list()),
             "keywords",
             "topics",
             "languages",
@@ -499,9 +555,7 @@ class AuthorSplit(DetailView, StaffRequiredMixin):
             Authorship.objects.filter(id__in=authorships_to_move).update(
                 author=new_author
             )
-            # Force-update appellations
-            self.get_object().save()
-            new_author.save()
+            Author.queue_appellation_reindex([self.get_object().pk, new_author.pk])
             messages.success(
                 request,
                 f"{len(authorships_to_move)} authorships moved to new author id {new_author.id}",
@@ -866,12 +920,29 @@ def home_view(request):
 def author_merge_view(request, author_id):
 
     author = get_object_or_404(Author, pk=author_id)
+    context = {
+        "merging": author,
+        "works": author.works.for_list()
+        .select_related("conference", "parent_session", "work_type")
+        .prefetch_related(
+            Prefetch("session_papers", queryset=Work.objects.for_list()),
+            "keywords",
+            "topics",
+            "languages",
+            Prefetch(
+                "authorships",
+                queryset=Authorship.objects.select_related(
+                    "appellation", "author"
+                ).prefetch_related("affiliations__institution"),
+            ),
+        ),
+        "author_merge_form": AuthorMergeForm,
+    }
 
     if request.method == "GET":
         """
         Initial load of the merge form displays all the authorships of the current author that will be affected
         """
-        context = {"merging": author, "author_merge_form": AuthorMergeForm}
         return render(request, "author_merge.html", context)
 
     elif request.method == "POST":
@@ -911,101 +982,175 @@ def author_merge_view(request, author_id):
             return render(request, "author_merge.html", context)
 
 
-def field_required(field):
-    if field.get_internal_type() in ("CharField", "TextField") and field.blank:
-        return False
-    if field.null:
-        return False
-    return True
+def artifact_context(artifact):
+    """
+    Template-friendly copy of a manifest artifact entry, with its timestamp parsed
+    """
+    if artifact is None:
+        return None
+    return {
+        **artifact,
+        "last_updated": datetime.fromisoformat(artifact["last_updated"]),
+        "rows": sum(artifact["tables"].values()),
+    }
 
 
 def download_data(request):
-    data_dictionary = []
+    # Built from the export manifest; only fall back to inspecting the models when nothing has been exported yet
+    manifest = load_manifest()
+    if manifest is None:
+        manifest = build_manifest()
     if request.user.is_authenticated:
-        dt_config = settings.PRIVATE_DATA_TABLE_CONFIG
+        dictionary_key = "private"
         zip_url = reverse("private_all_tables_download")
     else:
-        dt_config = settings.PUBLIC_DATA_TABLE_CONFIG
+        dictionary_key = "public"
         zip_url = reverse("public_all_tables_download")
-    denormalized_url = reverse("works_download")
-    denormalized_last_updated = datetime.fromtimestamp(
-        getmtime(f"{settings.DATA_OUTPUT_PATH}/{settings.DENORMALIZED_WORKS_NAME}.zip")
-    )
-
-    for m in dt_config["CONFIGURATION"]:
-        model = attrgetter(m["model"])(models)
-        if "manual_model_description" in m:
-            model_description = m["manual_model_description"]
-        else:
-            try:
-                model_description = model.model_description
-            except:
-                model_description = None
-        all_model_fields = [
-            {
-                "name": f.name,
-                "relation": f.is_relation,
-                "help_text": f.help_text,
-                "related_model": str(f.related_model)
-                .replace("<class 'abstracts.models.", "")
-                .replace("'>", ""),
-                "type": f.get_internal_type(),
-                "required": field_required(f),
-            }
-            for f in model._meta.fields
-            if not f.one_to_many and f.name not in m["exclude_fields"]
-        ]
-        if m.get("include_string", False):
-            all_model_fields.append(
-                {
-                    "name": "label",
-                    "relation": None,
-                    "help_text": "General label for this object",
-                    "related_model": None,
-                    "type": "CharField",
-                    "required": True,
-                }
-            )
-        data_dictionary.append(
-            {
-                "model": m["model"],
-                "model_description": model_description,
-                "csv_name": m["csv_name"],
-                "fields": all_model_fields,
-            }
-        )
-    normalized_last_updated = datetime.fromtimestamp(
-        getmtime(f"{settings.DATA_OUTPUT_PATH}/{dt_config['DATA_ZIP_NAME']}")
-    )
+    denormalized_artifact = artifact_context(manifest["artifacts"].get("denormalized"))
+    normalized_artifact = artifact_context(manifest["artifacts"].get(dictionary_key))
 
     context = {
         "zip_url": zip_url,
-        "denormalized_url": denormalized_url,
-        "denormalized_last_updated": denormalized_last_updated,
-        "normalized_last_updated": normalized_last_updated,
-        "data_dictionary": data_dictionary,
-        "denormalized_data_dictionary": settings.DENORMALIZED_HEADERS,
+        "denormalized_url": reverse("works_download"),
+        "denormalized_artifact": denormalized_artifact,
+        "normalized_artifact": normalized_artifact,
+        "data_dictionary": manifest["data_dictionaries"][dictionary_key],
+        "denormalized_data_dictionary": manifest["data_dictionaries"]["denormalized"],
     }
 
     return render(request, "downloads.html", context)
 
 
-def download_works_csv(request):
-    target_zip = f"{settings.DATA_OUTPUT_PATH}/{settings.DENORMALIZED_WORKS_NAME}.zip"
-    response = FileResponse(open(target_zip, "rb"))
+def serve_data_artifact(request, filename):
+    """
+    Respond with one of the export archives in DATA_OUTPUT_PATH.
+
+    Django only authorizes the request: if DATA_DOWNLOAD_ACCEL_PREFIX is configured, the file itself is sent by nginx via X-Accel-Redirect. The archive checksum written by export_tables is used as a strong ETag.
+    """
+    target_zip = f"{settings.DATA_OUTPUT_PATH}/{filename}"
+    if not exists(target_zip):
+        raise Http404(f"{filename} has not been exported yet")
+    checksum = read_checksum(target_zip)
+    etag = f'"{checksum}"' if checksum is not None else None
+    if etag is not None and etag in parse_etags(
+        request.headers.get("If-None-Match", "")
+    ):
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        return response
+
+    if settings.DATA_DOWNLOAD_ACCEL_PREFIX:
+        response = HttpResponse(content_type="application/zip")
+        response["Content-Disposition"] = f'inline; filename="{filename}"'
+        response[
+            "X-Accel-Redirect"
+        ] = f"{settings.DATA_DOWNLOAD_ACCEL_PREFIX.rstrip('/')}/{filename}"
+    else:
+        response = FileResponse(open(target_zip, "rb"))
+    if etag is not None:
+        response["ETag"] = etag
     return response
 
 
+def download_works_csv(request):
+    return serve_data_artifact(request, f"{settings.DENORMALIZED_WORKS_NAME}.zip")
+
+
 def public_download_all_tables(request):
-    target_zip = f"{settings.DATA_OUTPUT_PATH}/{settings.PUBLIC_DATA_TABLE_CONFIG['DATA_ZIP_NAME']}"
-    response = FileResponse(open(target_zip, "rb"))
-    return response
+    return serve_data_artifact(
+        request, settings.PUBLIC_DATA_TABLE_CONFIG["DATA_ZIP_NAME"]
+    )
 
 
 @login_required
 def private_download_all_tables(request):
-    target_zip = f"{settings.DATA_OUTPUT_PATH}/{settings.PRIVATE_DATA_TABLE_CONFIG['DATA_ZIP_NAME']}"
-    response = FileResponse(open(target_zip, "rb"))
+    return serve_data_artifact(
+        request, settings.PRIVATE_DATA_TABLE_CONFIG["DATA_ZIP_NAME"]
+    )
+
+
+EXPORT_FORMATS = {
+    "csv": {"content_type": "text/csv", "lines": csv_lines},
+    "jsonl": {"content_type": "application/x-ndjson", "lines": jsonl_lines},
+}
+
+
+def export_filter_value(value):
+    """
+    Stable representation of a cleaned WorkFilter value for export cache keys: objects by primary key, and sets of objects by their sorted primary keys
+    """
+    if isinstance(value, QuerySet):
+        # Already evaluated by the form's validation
+        return sorted(o.pk for o in value)
+    if isinstance(value, Model):
+        return value.pk
+    return value
+
+
+def cache_small_stream(lines, cache_key):
+    """
+    Pass lines through while collecting them, and cache the full output once it has been completely sent, provided its UTF-8 encoding stayed under settings.EXPORT_CACHE_MAX_BYTES
+    """
+    collected = []
+    collected_size = 0
+    for line in lines:
+        if collected is not None:
+            collected.append(line)
+            collected_size += len(line.encode("utf-8"))
+            if collected_size > settings.EXPORT_CACHE_MAX_BYTES:
+                collected = None
+        yield line
+    if collected is not None:
+        cache.set(cache_key, "".join(collected))
+
+
+def works_export(request, export_format):
+    """
+    Stream the works matching any WorkFilter query as CSV or JSON Lines, using the same columns as the denormalized works download
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise Http404(f"Unknown export format '{export_format}'")
+    export_config = EXPORT_FORMATS[export_format]
+
+    raw_filter_form = WorkFilter(request.GET)
+    if not raw_filter_form.is_valid():
+        return JsonResponse({"errors": raw_filter_form.errors}, status=400)
+    filters = {
+        name: value
+        for name, value in raw_filter_form.cleaned_data.items()
+        if name != "ordering"
+    }
+    use_cache = not request.user.is_authenticated
+    # Anonymous visitors asking for every work get the nightly CSV archive, which nginx can serve, rather than a fresh query over the whole database
+    if use_cache and export_format == "csv" and not any(filters.values()):
+        manifest = load_manifest()
+        if manifest is not None and "denormalized" in manifest["artifacts"]:
+            return redirect("works_download")
+
+    # Identical filters produce identical exports, whatever their order and whatever other parameters, such as ordering or page, come with them. Only complete exports are ever cached.
+    # Like the pages behind cache_for_anon, anonymous visitors may get an export up to the cache timeout old, while logged-in editors always get a fresh one.
+    filter_key = urlencode(
+        sorted((name, export_filter_value(value)) for name, value in filters.items()),
+        doseq=True,
+    )
+    cache_key = (
+        f"works_export:{export_format}:{sha1(filter_key.encode('utf-8')).hexdigest()}"
+    )
+    cached_export = cache.get(cache_key) if use_cache else None
+    if cached_export is not None:
+        response = HttpResponse(
+            cached_export, content_type=export_config["content_type"]
+        )
+    else:
+        works = filter_works(Work.objects.all(), raw_filter_form.cleaned_data)
+        lines = export_config["lines"](filtered_denormalized_work_rows(works))
+        response = StreamingHttpResponse(
+            cache_small_stream(lines, cache_key) if use_cache else lines,
+            content_type=export_config["content_type"],
+        )
+    response[
+        "Content-Disposition"
+    ] = f"attachment; filename={settings.DENORMALIZED_WORKS_NAME}.{export_format}"
     return response
 
 
@@ -1058,7 +1203,9 @@ def WorkEdit(request, work_id):
 @transaction.atomic
 def WorkEditAuthorship(request, work_id):
     work = get_object_or_404(Work, pk=work_id)
-    authorships = work.authorships.all()
+    authorships = work.authorships.select_related(
+        "author", "appellation"
+    ).prefetch_related("affiliations")
     AuthorshipWorkFormset = formset_factory(
         WorkAuthorshipForm, can_delete=True, extra=0
     )
@@ -1082,51 +1229,25 @@ def WorkEditAuthorship(request, work_id):
     elif request.method == "POST":
         authorships_forms = AuthorshipWorkFormset(request.POST)
         if authorships_forms.is_valid():
-            for d_form in authorships_forms.deleted_forms:
-                d_form_data = d_form.cleaned_data
-                attached_author = d_form_data["author"]
-                Authorship.objects.filter(
-                    work=work, author=d_form_data["author"]
-                ).delete()
-                # Refresh the author in DB to update appellations index
-                attached_author.save()
-            for aform in authorships_forms:
-                if aform not in authorships_forms.deleted_forms:
-                    aform_data = aform.cleaned_data
-                    appellation = Appellation.objects.get_or_create(
-                        first_name=aform_data["first_name"],
-                        last_name=aform_data["last_name"],
-                    )[0]
-
-                    affiliations = aform_data["affiliations"]
-                    authorship_order = aform_data["authorship_order"]
-
-                    try:
-                        if aform_data["author"] is None:
-                            author_id = Author.objects.create()
-                        else:
-                            author_id = aform_data["author"]
-                        auth = Authorship.objects.update_or_create(
-                            work=work,
-                            author=author_id,
-                            defaults={
-                                "authorship_order": authorship_order,
-                                "appellation": appellation,
-                                "user_last_updated": request.user,
-                            },
-                        )[0]
-                        author_id.user_last_updated = request.user
-                        author_id.save()
-                    except IntegrityError as e:
-                        messages.error(
-                            request, f"{e}: Ensure authorship order numbers are unique"
-                        )
-                        return redirect("work_edit_authorship", work.pk)
-
-                    auth.affiliations.clear()
-                    if affiliations is not None:
-                        auth.affiliations.set(affiliations)
-
+            deleted_forms = authorships_forms.deleted_forms
+            try:
+                with transaction.atomic():
+                    work.set_authorships(
+                        [
+                            f.cleaned_data
+                            for f in authorships_forms
+                            if f not in deleted_forms
+                        ],
+                        deleted_authors=[
+                            f.cleaned_data["author"] for f in deleted_forms
+                        ],
+                        user=request.user,
+                    )
+            except IntegrityError as e:
+                messages.error(
+                    request, f"{e}: Ensure authorship order numbers are unique"
+                )
+                return redirect("work_edit_authorship", work.pk)
             messages.success(
                 request, f'"{work.title}" authorships successfully updated.'
             )
@@ -1192,82 +1313,88 @@ class WorkDelete(LoginRequiredMixin, SuccessMessageMixin, DeleteView):
         return super().delete(request, *args, **kwargs)
 
 
-class FullWorkList(ListView):
-    context_object_name = "work_list"
-    template_name = "work_list.html"
-    paginate_by = 10
+def filter_works(result_set, filter_form):
+    """
+    Apply the cleaned data of a WorkFilter form to a Work queryset. Ordering is left to the caller, except for text searches, which are ordered by rank.
+    """
+    work_type_res = filter_form["work_type"]
+    if work_type_res is not None:
+        result_set = result_set.filter(work_type=work_type_res)
+
+    conference_res = filter_form["conference"]
+    if conference_res is not None:
+        result_set = result_set.filter(conference=conference_res)
+
+    affiliation_res = filter_form["affiliation"]
+    if len(affiliation_res) > 0:
+        result_set = result_set.filter(
+            authorships__affiliations__in=affiliation_res
+        ).distinct()
 
-    def get_queryset(self):
-        base_result_set = Work.objects.all()
-        raw_filter_form = WorkFilter(self.request.GET)
+    institution_res = filter_form["institution"]
+    if len(institution_res) > 0:
+        result_set = result_set.filter(
+            authorships__affiliations__institution__in=institution_res
+        ).distinct()
 
-        if raw_filter_form.is_valid():
-            result_set = base_result_set
-            filter_form = raw_filter_form.cleaned_data
+    author_res = filter_form["author"]
+    if len(author_res) > 0:
+        result_set = result_set.filter(authorships__author__in=author_res)
 
-            work_type_res = filter_form["work_type"]
-            if work_type_res is not None:
-                result_set = result_set.filter(work_type=work_type_res)
+    keyword_res = filter_form["keywords"]
+    if len(keyword_res) > 0:
+        result_set = result_set.filter(keywords__in=keyword_res)
 
-            conference_res = filter_form["conference"]
-            if conference_res is not None:
-                result_set = result_set.filter(conference=conference_res)
+    topic_res = filter_form["topics"]
+    if len(topic_res) > 0:
+        result_set = result_set.filter(topics__in=topic_res)
 
-            affiliation_res = filter_form["affiliation"]
-            if len(affiliation_res) > 0:
-                result_set = result_set.filter(
-                    authorships__affiliations__in=affiliation_res
-                ).distinct()
+    language_res = filter_form["languages"]
+    if len(language_res) > 0:
+        result_set = result_set.filter(languages__in=language_res)
 
-            institution_res = filter_form["institution"]
-            if len(institution_res) > 0:
-                result_set = result_set.filter(
-                    authorships__affiliations__institution__in=institution_res
-                ).distinct()
+    if filter_form["full_text_available"]:
+        result_set = result_set.exclude(full_text="")
 
-            author_res = filter_form["author"]
-            if len(author_res) > 0:
-                result_set = result_set.filter(authorships__author__in=author_res)
+    if filter_form["full_text_viewable"]:
+        result_set = result_set.exclude(full_text="").filter(
+            full_text_license__isnull=False
+        )
 
-            keyword_res = filter_form["keywords"]
-            if len(keyword_res) > 0:
-                result_set = result_set.filter(keywords__in=keyword_res)
+    text_res = filter_form["text"]
+    if text_res != "":
+        text_query = SearchQuery(text_res, search_type="websearch")
+        result_set = (
+            result_set.filter(search_text=text_query)
+            .annotate(
+                rank=SearchRank(
+                    F("search_text"),
+                    text_query,
+                ),
+                # Does the search text show up only in the full text?
+                search_in_ft_only=ExpressionWrapper(
+                    ~Q(title__icontains=text_res), output_field=BooleanField()
+                ),
+            )
+            .filter(rank__gt=0.1)
+            .order_by("-rank")
+        )
 
-            topic_res = filter_form["topics"]
-            if len(topic_res) > 0:
-                result_set = result_set.filter(topics__in=topic_res)
+    return result_set
 
-            language_res = filter_form["languages"]
-            if len(language_res) > 0:
-                result_set = result_set.filter(languages__in=language_res)
 
-            if filter_form["full_text_available"]:
-                result_set = result_set.exclude(full_text="")
+class FullWorkList(ListView):
+    context_object_name = "work_list"
+    template_name = "work_list.html"
+    paginate_by = 10
 
-            if filter_form["full_text_viewable"]:
-                result_set = result_set.exclude(full_text="").filter(
-                    full_text_license__isnull=False
-                )
+    def get_queryset(self):
+        base_result_set = Work.objects.for_list()
+        raw_filter_form = WorkFilter(self.request.GET)
 
-            text_res = filter_form["text"]
-            if text_res != "":
-                text_query = SearchQuery(text_res, search_type="websearch")
-                result_set = (
-                    result_set.filter(search_text=text_query)
-                    .annotate(
-                        rank=SearchRank(
-                            F("search_text"),
-                            text_query,
-                        ),
-                        # Does the search text show up only in the full text?
-                        search_in_ft_only=ExpressionWrapper(
-                            ~Q(title__icontains=text_res), output_field=BooleanField()
-                        ),
-                    )
-                    .filter(rank__gt=0.1)
-                    .order_by("-rank")
-                )
-                order_res = "rank"
+        if raw_filter_form.is_valid():
+            filter_form = raw_filter_form.cleaned_data
+            result_set = filter_works(base_result_set, filter_form)
 
             # To find the last name of the first author, we develop a subquery that will pull the first authorship for a given work. We can then call the appellation__last_name
             first_author_subquery = Authorship.objects.filter(
@@ -1327,7 +1454,7 @@ class FullWorkList(ListView):
                             "organizers",
                         ),
                     ),
-                    "session_papers",
+                    Prefetch("session_papers", queryset=Work.objects.for_list()),
                     Prefetch(
                         "authorships",
                         queryset=Authorship.objects.select_related(
@@ -1628,23 +1755,23 @@ def institution_multi_merge(request):
         raw_form = InstitutionMultiMergeForm(request.POST)
         if raw_form.is_valid():
             target_institution = raw_form.cleaned_data["into"]
-            source_institutions = raw_form.cleaned_data["sources"].exclude(
-                pk=target_institution.pk
+            source_institutions = list(
+                raw_form.cleaned_data["sources"].exclude(pk=target_institution.pk)
             )
+            merge_results = Institution.multi_merge(
+                source_institutions, target_institution
+            )
+            target_institution.user_last_updated = request.user
+            target_institution.save()
 
-            for institution in source_institutions:
-                old_institution_id = str(institution)
-                merge_results = institution.merge(target_institution)
-                target_institution.user_last_updated = request.user
-                target_institution.save()
-
-                messages.success(
-                    request,
-                    f"Institution {old_institution_id} has been merged into {target_institution}, and the old institution entry has been deleted.",
-                )
-                messages.success(
-                    request, f"{merge_results['update_results']} institutions updated"
-                )
+            messages.success(
+                request,
+                f"Institutions {', '.join(str(i) for i in source_institutions)} have been merged into {target_institution}, and the old institution entries have been deleted.",
+            )
+            messages.success(
+                request,
+                f"{merge_results['update_results']} affiliations, {merge_results['updated_authorships']} authorships and {merge_results['updated_conferences']} conferences updated",
+            )
             return redirect("institution_edit", pk=target_institution.pk)
         else:
             for error in raw_form.errors:
@@ -1752,21 +1879,22 @@ def affiliation_multi_merge(request):
         raw_form = AffiliationMultiMergeForm(request.POST)
         if raw_form.is_valid():
             target_affiliation = raw_form.cleaned_data["into"]
-            source_affiliations = raw_form.cleaned_data["sources"].exclude(
-                pk=target_affiliation.pk
+            source_affiliations = list(
+                raw_form.cleaned_data["sources"]
+                .exclude(pk=target_affiliation.pk)
+                .select_related("institution")
+            )
+            merge_results = Affiliation.multi_merge(
+                source_affiliations, target_affiliation
             )
 
-            for affiliation in source_affiliations:
-                old_affiliation_id = str(affiliation)
-                merge_results = affiliation.merge(target_affiliation)
-
-                messages.success(
-                    request,
-                    f"Affiliation {old_affiliation_id} has been merged into {target_affiliation}, and the old affiliation entry has been deleted.",
-                )
-                messages.success(
-                    request, f"{merge_results['update_results']} affiliations updated"
-                )
+            messages.success(
+                request,
+                f"Affiliations {', '.join(str(a) for a in source_affiliations)} have been merged into {target_affiliation}, and the old affiliation entries have been deleted.",
+            )
+            messages.success(
+                request, f"{merge_results['update_results']} authorships updated"
+            )
             return redirect("affiliation_edit", pk=target_affiliation.pk)
         else:
             for error in raw_form.errors:
@@ -1776,29 +1904,21 @@ def affiliation_multi_merge(request):
 
 
 @user_is_staff
-@transaction.atomic
 def wipe_unused(request):
-    deletion_dict = {
-        "Author": Author.objects.exclude(authorships__isnull=False),
-        "Affiliation": Affiliation.objects.exclude(
-            asserted_by__isnull=False
-        ),
-        "Institution": Institution.objects.exclude(
-            Q(affiliations__asserted_by__isnull=False) | Q(conferences__isnull=False)
-        ),
-        "Keyword": Keyword.objects.exclude(works__isnull=False),
-        "Appellation": Appellation.objects.exclude(
-            asserted_by__isnull=False
-        ),
-    }
+    # Each batch of deletions commits on its own, so that a large sweep doesn't hold locks for the whole request
+    sweeper = OrphanSweeper()
 
     if request.method == "POST":
-        for k, v in deletion_dict.items():
-            res = v.delete()
-            if res[0] > 0:
-                messages.success(request, f"{k}: {res[0]} objects deleted")
+        for k, n_deleted in sweeper.sweep().items():
+            if n_deleted > 0:
+                messages.success(request, f"{k}: {n_deleted} objects deleted")
 
-    any_hanging_items = any([v.exists() for k, v in deletion_dict.items()])
+    counts = sweeper.counts()
+    deletion_dict = {
+        k: {"count": n, "sample": sweeper.sample(k) if n > 0 else []}
+        for k, n in counts.items()
+    }
+    any_hanging_items = any(n > 0 for n in counts.values())
     context = {"deletions": deletion_dict, "hanging_items": any_hanging_items}
 
     return render(request, "wipe_unused.html", context)
@@ -1944,67 +2064,70 @@ class ConferenceXMLLoad(StaffRequiredMixin, DetailView):
     template_name = "conference_xml_load.html"
     extra_context = {"form": ConferenceXMLUploadForm()}
 
-    @transaction.atomic
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["import_jobs"] = self.object.import_jobs.all()[:10]
+        return context
+
     def post(self, request, *args, **kwargs):
         raw_form = ConferenceXMLUploadForm(request.POST, request.FILES)
-        conference = self.get_object()
-        if raw_form.is_valid():
-            with TemporaryDirectory() as upload_dir:
-
-                # Write uploaded zip to tempdir
-                with NamedTemporaryFile(dir=upload_dir, suffix=".zip") as tei_zip:
-                    with open(tei_zip.name, "wb") as upload_zip:
-                        for chunk in request.FILES["file"]:
-                            upload_zip.write(chunk)
-
-                    if not zipfile.is_zipfile(tei_zip.name):
-                        messages.error(request, "That is not a valid zipfile.")
-                        return render(
-                            request,
-                            "conference_xml_load.html",
-                            {
-                                "object": self.get_object(),
-                                "form": ConferenceXMLUploadForm(),
-                            },
-                        )
-
-                    # Extract all the files within
-                    with zipfile.ZipFile(tei_zip.name) as zip_ref:
-                        zip_ref.extractall(upload_dir)
-
-                    # Import all XML
-                    import_results = conference.import_xml_directory(upload_dir)
-                    n_success = len(import_results["successful_files"])
-                    n_failed = len(import_results["failed_files"])
-                    messages.info(
-                        request,
-                        f"{n_success} of {n_success + n_failed} files valid.",
-                    )
-                    for err in import_results["failed_files"]:
-                        messages.error(
-                            request, f"{basename(err['filepath'])}: {err['error']}"
-                        )
-                    if n_failed == 0:
-                        messages.success(request, f"All files imported successfully.")
-                    else:
-                        messages.info(
-                            request,
-                            "Please fix errors or remove malformed files, and re-upload zip. All TEI documents must be valid in order to complete the import.",
-                        )
-
-            return render(
-                request,
-                "conference_xml_load.html",
-                {"object": self.get_object(), "form": ConferenceXMLUploadForm()},
-            )
-        else:
+        self.object = self.get_object()
+        if not raw_form.is_valid():
             for f, e in raw_form.errors.items():
                 messages.error(request, f"{f}: {e}")
-            return render(
-                request,
-                "conference_xml_load.html",
-                {"object": self.get_object(), "form": ConferenceXMLUploadForm()},
-            )
+            return self.render_to_response(self.get_context_data())
+
+        if not zipfile.is_zipfile(request.FILES["file"]):
+            messages.error(request, "That is not a valid zipfile.")
+            return self.render_to_response(self.get_context_data())
+        # Reject oversized archives now, from the zip's directory alone, rather than once the job runs
+        try:
+            with zipfile.ZipFile(request.FILES["file"]) as zf:
+                zip_tei_members(
+                    zf,
+                    max_members=settings.TEI_ZIP_MAX_MEMBERS,
+                    max_member_size=settings.TEI_ZIP_MAX_MEMBER_SIZE,
+                    max_total_size=settings.TEI_ZIP_MAX_TOTAL_SIZE,
+                )
+        except TEIZipError as e:
+            messages.error(request, str(e))
+            return self.render_to_response(self.get_context_data())
+
+        # Keep the upload where the import worker can read it, and hand the import off to that worker
+        makedirs(settings.IMPORT_JOB_PATH, exist_ok=True)
+        with NamedTemporaryFile(
+            dir=settings.IMPORT_JOB_PATH, suffix=".zip", delete=False
+        ) as tei_zip:
+            for chunk in request.FILES["file"].chunks():
+                tei_zip.write(chunk)
+        job = ImportJob.objects.create(
+            conference=self.object, user=request.user, upload_path=tei_zip.name
+        )
+        messages.info(
+            request,
+            "Your files have been queued for import. This page will update as they are processed.",
+        )
+        return redirect(job)
+
+
+class ImportJobDetail(StaffRequiredMixin, DetailView):
+    model = ImportJob
+    template_name = "import_job_detail.html"
+    queryset = ImportJob.objects.select_related("conference", "user")
+
+
+@user_is_staff
+def import_job_status(request, pk):
+    job = get_object_or_404(ImportJob, pk=pk)
+    return JsonResponse(
+        {
+            "status": job.status,
+            "status_display": job.get_status_display(),
+            "is_finished": job.is_finished,
+            "n_files": job.n_files,
+            "n_processed": job.n_processed,
+        }
+    )
 
 
 @login_required
@@ -2236,7 +2359,7 @@ class KeywordList(LoginRequiredMixin, ListView):
 @transaction.atomic
 def keyword_merge(request, keyword_id):
     keyword = get_object_or_404(Keyword, pk=keyword_id)
-    affected_works = Work.objects.filter(keywords=keyword).all()
+    affected_works = Work.objects.for_list().filter(keywords=keyword)
     sample_works = affected_works[:15]
     count_elements = affected_works.count() - 15
     context = {
@@ -2305,20 +2428,17 @@ def keyword_multi_merge(request):
         raw_form = KeywordMultiMergeForm(request.POST)
         if raw_form.is_valid():
             target_keyword = raw_form.cleaned_data["into"]
-            source_keywords = raw_form.cleaned_data["sources"].exclude(
-                pk=target_keyword.pk
+            source_keywords = list(
+                raw_form.cleaned_data["sources"].exclude(pk=target_keyword.pk)
+            )
+            merge_results = Keyword.multi_merge(source_keywords, target_keyword)
+            messages.success(
+                request,
+                f"Keywords {', '.join(t.title for t in source_keywords)} have been merged into {target_keyword}, and the old keyword entries have been deleted.",
+            )
+            messages.success(
+                request, f"{merge_results['update_results']} works updated"
             )
-
-            for keyword in source_keywords:
-                old_keyword_id = keyword.title
-                merge_results = keyword.merge(target_keyword)
-                messages.success(
-                    request,
-                    f"Keyword {old_keyword_id} has been merged into {target_keyword}, and the old keyword entry has been deleted.",
-                )
-                messages.success(
-                    request, f"{merge_results['update_results']} keywords updated"
-                )
             return redirect("keyword_edit", pk=target_keyword.pk)
         else:
             for error in raw_form.errors:
@@ -2407,7 +2527,7 @@ class TopicList(LoginRequiredMixin, ListView):
 @transaction.atomic
 def topic_merge(request, topic_id):
     topic = get_object_or_404(Topic, pk=topic_id)
-    affected_elements = topic.works.all()
+    affected_elements = topic.works.for_list()
     count_elements = affected_elements.count() - 10
     sample_elements = affected_elements[:10]
     context = {
@@ -2477,18 +2597,17 @@ def topic_multi_merge(request):
         raw_form = TopicMultiMergeForm(request.POST)
         if raw_form.is_valid():
             target_topic = raw_form.cleaned_data["into"]
-            source_topics = raw_form.cleaned_data["sources"].exclude(pk=target_topic.pk)
-
-            for topic in source_topics:
-                old_topic_id = topic.title
-                merge_results = topic.merge(target_topic)
-                messages.success(
-                    request,
-                    f"Topic {old_topic_id} has been merged into {target_topic}, and the old topic entry has been deleted.",
-                )
-                messages.success(
-                    request, f"{merge_results['update_results']} topics updated"
-                )
+            source_topics = list(
+                raw_form.cleaned_data["sources"].exclude(pk=target_topic.pk)
+            )
+            merge_results = Topic.multi_merge(source_topics, target_topic)
+            messages.success(
+                request,
+                f"Topics {', '.join(t.title for t in source_topics)} have been merged into {target_topic}, and the old topic entries have been deleted.",
+            )
+            messages.success(
+                request, f"{merge_results['update_results']} works updated"
+            )
             return redirect("topic_edit", pk=target_topic.pk)
         else:
             for error in raw_form.errors:
@@ -2548,6 +2667,7 @@ class LanguageList(LoginRequiredMixin, ListView):
         "tag_create_view": "language_create",
         "tag_filter_form": TagForm,
         "tag_list_view": "full_language_list",
+        "multi_merge": "language_multi_merge",
         "filter_param_name": "languages",
     }
 
@@ -2582,7 +2702,7 @@ class LanguageList(LoginRequiredMixin, ListView):
 @transaction.atomic
 def language_merge(request, language_id):
     language = get_object_or_404(Language, pk=language_id)
-    affected_elements = language.works.all()
+    affected_elements = language.works.for_list()
     count_elements = affected_elements.count() - 10
     sample_elements = affected_elements[:10]
     context = {
@@ -2636,6 +2756,38 @@ def language_merge(request, language_id):
             return render(request, "tag_merge.html", context)
 
 
+@user_is_staff
+@transaction.atomic
+def language_multi_merge(request):
+    context = {
+        "tag_merge_form": LanguageMultiMergeForm,
+        "tag_category": "Language",
+        "multi_merge_view": "language_multi_merge",
+    }
+
+    if request.method == "POST":
+        raw_form = LanguageMultiMergeForm(request.POST)
+        if raw_form.is_valid():
+            target_language = raw_form.cleaned_data["into"]
+            source_languages = list(
+                raw_form.cleaned_data["sources"].exclude(pk=target_language.pk)
+            )
+            merge_results = Language.multi_merge(source_languages, target_language)
+            messages.success(
+                request,
+                f"Languages {', '.join(t.title for t in source_languages)} have been merged into {target_language}, and the old language entries have been deleted.",
+            )
+            messages.success(
+                request, f"{merge_results['update_results']} works updated"
+            )
+            return redirect("language_edit", pk=target_language.pk)
+        else:
+            for error in raw_form.errors:
+                messages.error(request, error)
+
+    return render(request, "tag_multi_merge.html", context)
+
+
 class WorkTypeCreate(StaffRequiredMixin, SuccessMessageMixin, CreateView):
     model = WorkType
     template_name = "generic_form.html"
@@ -2721,7 +2873,7 @@ class WorkTypeList(LoginRequiredMixin, ListView):
 @transaction.atomic
 def work_type_merge(request, work_type_id):
     work_type = get_object_or_404(WorkType, pk=work_type_id)
-    affected_elements = work_type.works.all()
+    affected_elements = work_type.works.for_list()
     count_elements = affected_elements.count() - 10
     sample_elements = affected_elements[:10]
     context = {
@@ -60,6 +60,7 @@ INSTALLED_APPS = [
 CRISPY_TEMPLATE_PACK = "bootstrap4"
 
 MIDDLEWARE = [
+    "abstracts.instrumentation.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -120,7 +121,7 @@ DATABASES = {
 
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
+        "BACKEND": "abstracts.instrumentation.InstrumentedMemcachedCache",
         "LOCATION": "memcached:11211",
         "TIMEOUT": 60 * 10,
     }
@@ -166,8 +167,69 @@ LOGIN_REDIRECT_URL = "/"
 
 DATA_OUTPUT_PATH = "/vol/data"
 
+# Number of processes used to parse and validate TEI files during a directory import
+TEI_IMPORT_WORKERS = int(os.environ.get("TEI_IMPORT_WORKERS", os.cpu_count() or 1))
+
+# Uploaded TEI zip files wait here until the run_import_jobs worker imports them
+IMPORT_JOB_PATH = os.environ.get("IMPORT_JOB_PATH", "/vol/import_jobs")
+
+# Seconds without a progress report after which an unfinished import job is
+# assumed to have lost its worker, and is marked as failed. Writing to the
+# database reports no progress until it is done, so this must exceed the
+# longest write of a single job.
+IMPORT_JOB_TIMEOUT = int(os.environ.get("IMPORT_JOB_TIMEOUT", 2 * 60 * 60))
+
+# Limits on an uploaded TEI zip, checked before anything in it is decompressed
+TEI_ZIP_MAX_MEMBERS = int(os.environ.get("TEI_ZIP_MAX_MEMBERS", 5000))
+TEI_ZIP_MAX_MEMBER_SIZE = int(os.environ.get("TEI_ZIP_MAX_MEMBER_SIZE", 10 * 1024**2))
+TEI_ZIP_MAX_TOTAL_SIZE = int(os.environ.get("TEI_ZIP_MAX_TOTAL_SIZE", 1024**3))
+
+# zlib compression level (0-9) used when writing the export zip archives
+DATA_ZIP_COMPRESSLEVEL = int(os.environ.get("DATA_ZIP_COMPRESSLEVEL", 9))
+
+# When set, data downloads are handed off to nginx by responding with an
+# X-Accel-Redirect to this internal location (which must alias DATA_OUTPUT_PATH)
+# instead of streaming the file through Django
+DATA_DOWNLOAD_ACCEL_PREFIX = os.environ.get("DATA_DOWNLOAD_ACCEL_PREFIX", "")
+
 DENORMALIZED_WORKS_NAME = "dh_conferences_works"
 
+# Written by export_tables next to the archives; describes their contents for the downloads page
+DATA_MANIFEST_NAME = "manifest.json"
+
+# Filtered works exports smaller than this many bytes are cached for repeat
+# requests by anonymous visitors, who may see them up to the cache timeout
+# after the data changes. Keep it under memcached's 1 MB item limit.
+EXPORT_CACHE_MAX_BYTES = 900_000
+
+# Limits on the queries, database time and template time (in milliseconds) of
+# a single request, keyed by view name. "default" applies to every view, and
+# RequestMetricsMiddleware logs a warning for each limit a request goes over.
+REQUEST_BUDGETS = {
+    "default": {"queries": 50, "db_ms": 500, "template_ms": 500},
+    "work_detail": {"queries": 25},
+    **{
+        f"{name}-autocomplete": {"queries": 5}
+        for name in [
+            "keyword",
+            "language",
+            "topic",
+            "country",
+            "appellation",
+            "work",
+            "institution",
+            "affiliation",
+            "author",
+            "conference",
+        ]
+    },
+}
+
+# Whether responses carry their request metrics in a Server-Timing header.
+# Off by default, as it shows every visitor the site's query counts and cache
+# statistics; turn it on for profiling.
+SERVER_TIMING_HEADER = os.environ.get("SERVER_TIMING_HEADER", "False") == "True"
+
 DENORMALIZED_HEADERS = [
     {"name": "work_id", "description": "Unique ID number", "required": True},
     {"name": "conference_label", "description": "Conference label", "required": True},
@@ -483,7 +545,13 @@ LOGGING = {
     "handlers": {"console": {"class": "logging.StreamHandler"}},
     "root": {"handlers": ["console"], "level": "WARNING"},
     "loggers": {
-        "django": {"handlers": ["console"], "level": "WARNING", "propagate": False}
+        "django": {"handlers": ["console"], "level": "WARNING", "propagate": False},
+        # Budget overruns at WARNING; set REQUEST_METRICS_LOG_LEVEL=INFO for one JSON line of metrics per request
+        "abstracts.instrumentation": {
+            "handlers": ["console"],
+            "level": os.environ.get("REQUEST_METRICS_LOG_LEVEL", "WARNING"),
+            "propagate": False,
+        },
     },
 }
 
@@ -1,13 +1,88 @@
+"""
+Load test workload for the site.
+
+Three kinds of users run side by side, in proportion to their weights:
+
+- AnonymousUser browses, searches and downloads like a visitor, and mostly gets
+  cached pages.
+- CrawlerUser walks every work and author page and the sitemaps without pause,
+  mostly missing the cache.
+- EditorUser logs in, so none of their pages are cached, and edits: authorship
+  forms, merge previews, autocomplete keystroke bursts and, when enabled, TEI
+  uploads and merges.
+
+URLs are drawn from the IDs in ../data/all_ids.json, written by
+`python manage.py dump_ids` or `generate_corpus`. Set these environment
+variables:
+
+- LOCUST_EDITOR_USERNAME and LOCUST_EDITOR_PASSWORD: a staff account for
+  EditorUser. Without them, editors stop straight away.
+- LOCUST_EDITOR_WRITES=1: let editors upload TEI zips and merge keywords, which
+  changes the database. Only use it against a disposable copy.
+- LOCUST_SLOS: the objectives to check at the end of the run, slos.json by
+  default. The run exits with status 1 if any endpoint missed them.
+"""
+
+import io
+import json
+import logging
+import os
 import random
-from locust import HttpUser, task, between
+import re
+import zipfile
+from glob import glob
+
+import gevent
 from faker import Faker
-import json
+from locust import HttpUser, between, events, task
+from locust.exception import StopUser
+from locust.runners import WorkerRunner
+
+import slo
+
+HERE = os.path.dirname(os.path.abspath(__file__))
 
 all_ids = json.load(open("../data/all_ids.json", "r"))
+slos = slo.load_slos(os.environ.get("LOCUST_SLOS", os.path.join(HERE, "slos.json")))
 fake = Faker()
 
+EDITOR_USERNAME = os.environ.get("LOCUST_EDITOR_USERNAME")
+EDITOR_PASSWORD = os.environ.get("LOCUST_EDITOR_PASSWORD")
+EDITOR_WRITES = os.environ.get("LOCUST_EDITOR_WRITES") == "1"
+
+# The sample documents the TEI import is tested with
+TEI_FILES = sorted(
+    glob(os.path.join(HERE, "../dh_abstracts/app/abstracts/static/tei/valid_tei/*.xml"))
+)
+
+# Keywords already merged away by an editor in this run
+merged_keywords = set()
+
 
-class QuickstartUser(HttpUser):
+def tei_zip():
+    """
+    A zip of the sample TEI files, each made unique so that the import can't skip them as unchanged
+    """
+    buffer = io.BytesIO()
+    marker = f"<!-- locust {random.getrandbits(64):x} -->"
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for path in TEI_FILES:
+            with open(path, "r") as f:
+                zf.writestr(os.path.basename(path), f.read() + marker)
+    return buffer.getvalue()
+
+
+def type_query(client, path, text, name):
+    """
+    Request an autocomplete once per keystroke, the way the select2 widgets do while someone types
+    """
+    for i in range(1, len(text) + 1):
+        client.get(path, params={"q": text[:i]}, name=name)
+        gevent.sleep(random.uniform(0.1, 0.3))
+
+
+class AnonymousUser(HttpUser):
+    weight = 10
     wait_time = between(5, 9)
 
     @task(10)
@@ -21,7 +96,7 @@ class QuickstartUser(HttpUser):
     @task(4)
     def view_work(self):
         item_id = random.choice(all_ids["works"])
-        self.client.get(f"/works/{item_id}", name="/works")
+        self.client.get(f"/works/{item_id}", name="/works/[id]")
 
     @task(4)
     def view_work_pages(self):
@@ -31,7 +106,7 @@ class QuickstartUser(HttpUser):
     @task(3)
     def view_author(self):
         item_id = random.choice(all_ids["authors"])
-        self.client.get(f"/authors/{item_id}", name="/authors")
+        self.client.get(f"/authors/{item_id}", name="/authors/[id]")
 
     @task(4)
     def view_author_pages(self):
@@ -82,9 +157,11 @@ class QuickstartUser(HttpUser):
 
     @task(4)
     def author_autocomplete_q(self):
-        self.client.get(
-            f"/author-autocomplete?q={fake.random_lowercase_letter()}",
-            name="/author-autocomplete?q",
+        type_query(
+            self.client,
+            "/author-autocomplete",
+            fake.last_name(),
+            "/author-autocomplete?q",
         )
 
     @task(4)
@@ -93,9 +170,11 @@ class QuickstartUser(HttpUser):
 
     @task(4)
     def affiliation_autocomplete_q(self):
-        self.client.get(
-            f"/affiliation-autocomplete?q={fake.random_lowercase_letter()}",
-            name="/affiliation-autocomplete?q",
+        type_query(
+            self.client,
+            "/affiliation-autocomplete",
+            fake.word(),
+            "/affiliation-autocomplete?q",
         )
 
     @task(4)
@@ -104,8 +183,274 @@ class QuickstartUser(HttpUser):
 
     @task(4)
     def institution_autocomplete_q(self):
+        type_query(
+            self.client,
+            "/institution-autocomplete",
+            fake.city(),
+            "/institution-autocomplete?q",
+        )
+
+    @task(2)
+    def keyword_autocomplete_q(self):
+        type_query(
+            self.client, "/keyword-autocomplete", fake.word(), "/keyword-autocomplete?q"
+        )
+
+    @task(1)
+    def downloads(self):
+        self.client.get("/downloads")
+
+    @task(1)
+    def download_tables(self):
+        with self.client.get(
+            random.choice(["/downloads/public", "/downloads/dh_conferences_works.csv"]),
+            stream=True,
+        ) as response:
+            # Only the time to the first byte matters here, not the size of the archive
+            response.close()
+
+    @task(1)
+    def export_conference(self):
+        conference_id = random.choice(all_ids["conferences"])
         self.client.get(
-            f"/institution-autocomplete?q={fake.random_lowercase_letter()}",
-            name="/institution-autocomplete?q",
+            f"/works/export.csv?conference={conference_id}",
+            name="/works/export.csv?conference",
         )
 
+
+class CrawlerUser(HttpUser):
+    """
+    A search engine or scraper, following links as fast as it gets answers
+    """
+
+    weight = 2
+    wait_time = between(0.2, 1)
+
+    def on_start(self):
+        self.client.headers["User-Agent"] = "Mozilla/5.0 (compatible; LocustBot/1.0)"
+        self.work_ids = random.sample(all_ids["works"], len(all_ids["works"]))
+        self.author_ids = random.sample(all_ids["authors"], len(all_ids["authors"]))
+
+    @task(10)
+    def crawl_work(self):
+        item_id = (
+            self.work_ids.pop() if self.work_ids else random.choice(all_ids["works"])
+        )
+        self.client.get(f"/works/{item_id}", name="/works/[id]")
+
+    @task(3)
+    def crawl_work_xml(self):
+        item_id = random.choice(all_ids["works"])
+        self.client.get(f"/works/{item_id}/xml", name="/works/[id]/xml")
+
+    @task(6)
+    def crawl_author(self):
+        item_id = (
+            self.author_ids.pop()
+            if self.author_ids
+            else random.choice(all_ids["authors"])
+        )
+        self.client.get(f"/authors/{item_id}", name="/authors/[id]")
+
+    @task(3)
+    def crawl_pages(self):
+        page = random.randint(1, 500)
+        path = random.choice(["/works", "/authors"])
+        self.client.get(f"{path}?page={page}", name=f"{path}?page")
+
+    @task(2)
+    def crawl_filters(self):
+        field, ids = random.choice(
+            [
+                ("keywords", all_ids["keywords"]),
+                ("topics", all_ids["topics"]),
+                ("conference", all_ids["conferences"]),
+                ("institution", all_ids["institutions"]),
+            ]
+        )
+        self.client.get(
+            f"/works?{field}={random.choice(ids)}&page={random.randint(1, 5)}",
+            name=f"/works?{field}",
+        )
+
+    @task(1)
+    def crawl_sitemap(self):
+        self.client.get("/sitemap.xml")
+        section = random.choice(["work", "author", "series", "core"])
+        self.client.get(f"/sitemap-{section}.xml", name="/sitemap-[section].xml")
+
+    @task(1)
+    def crawl_export(self):
+        conference_id = random.choice(all_ids["conferences"])
+        self.client.get(
+            f"/works/export.csv?conference={conference_id}",
+            name="/works/export.csv?conference",
+        )
+
+
+class EditorUser(HttpUser):
+    """
+    A logged-in editor. Request names start with "editor " to keep their uncached latencies apart from anonymous ones.
+    """
+
+    weight = 1
+    wait_time = between(2, 6)
+
+    def on_start(self):
+        if EDITOR_USERNAME is None or EDITOR_PASSWORD is None:
+            logging.warning(
+                "Set LOCUST_EDITOR_USERNAME and LOCUST_EDITOR_PASSWORD to run editors"
+            )
+            raise StopUser()
+        self.client.get("/accounts/login/", name="editor /accounts/login")
+        with self.post(
+            "/accounts/login/",
+            {"username": EDITOR_USERNAME, "password": EDITOR_PASSWORD, "next": "/"},
+            name="editor /accounts/login",
+            catch_response=True,
+        ) as response:
+            if "sessionid" not in self.client.cookies:
+                response.failure("Editor login failed")
+                raise StopUser()
+
+    def get(self, path, name=None, **kwargs):
+        return self.client.get(path, name=f"editor {name or path}", **kwargs)
+
+    def post(self, path, data, name=None, **kwargs):
+        # Django checks the CSRF token, and the referer over HTTPS
+        data = {**data, "csrfmiddlewaretoken": self.client.cookies.get("csrftoken", "")}
+        return self.client.post(
+            path,
+            data=data,
+            name=f"editor {name or path}",
+            headers={"Referer": f"{self.host}{path}"},
+            **kwargs,
+        )
+
+    @task(4)
+    def browse_works(self):
+        conference_id = random.choice(all_ids["conferences"])
+        self.get(f"/works?conference={conference_id}", name="/works")
+
+    @task(4)
+    def view_work(self):
+        item_id = random.choice(all_ids["works"])
+        self.get(f"/works/{item_id}", name="/works/[id]")
+
+    @task(4)
+    def edit_work(self):
+        item_id = random.choice(all_ids["works"])
+        self.get(f"/editor/works/{item_id}/edit", name="/editor/works/[id]/edit")
+
+    @task(6)
+    def edit_authorships(self):
+        """
+        Open the authorship form and look up a replacement author and affiliation, as when correcting a name
+        """
+        item_id = random.choice(all_ids["works"])
+        self.get(
+            f"/editor/works/{item_id}/edit/authorship",
+            name="/editor/works/[id]/edit/authorship",
+        )
+        type_query(
+            self.client,
+            "/author-autocomplete",
+            fake.last_name(),
+            "editor /author-autocomplete?q",
+        )
+        author_id = random.choice(all_ids["authors"])
+        self.get(f"/author-info-json/{author_id}", name="/author-info-json/[id]")
+        type_query(
+            self.client,
+            "/affiliation-autocomplete",
+            fake.word(),
+            "editor /affiliation-autocomplete?q",
+        )
+
+    @task(2)
+    def tag_work(self):
+        type_query(
+            self.client,
+            "/keyword-autocomplete",
+            fake.word(),
+            "editor /keyword-autocomplete?q",
+        )
+        type_query(
+            self.client,
+            "/institution-autocomplete",
+            fake.city(),
+            "editor /institution-autocomplete?q",
+        )
+
+    @task(2)
+    def preview_author_merge(self):
+        author_id = random.choice(all_ids["authors"])
+        self.get(f"/authors/{author_id}/merge", name="/authors/[id]/merge")
+
+    @task(2)
+    def preview_keyword_merge(self):
+        keyword_id = random.choice(all_ids["keywords"])
+        self.get(
+            f"/editor/keywords/{keyword_id}/merge", name="/editor/keywords/[id]/merge"
+        )
+
+    @task(1)
+    def review_lists(self):
+        self.get("/editor/keywords")
+        self.get("/editor/institutions")
+        conference_id = random.choice(all_ids["conferences"])
+        self.get(
+            f"/editor/conferences/{conference_id}/edit",
+            name="/editor/conferences/[id]/edit",
+        )
+
+    @task(1)
+    def merge_keyword(self):
+        if not EDITOR_WRITES:
+            return
+        source, target = random.sample(all_ids["keywords"], 2)
+        if source in merged_keywords or target in merged_keywords:
+            return
+        merged_keywords.add(source)
+        self.post(
+            f"/editor/keywords/{source}/merge",
+            {"into": target},
+            name="/editor/keywords/[id]/merge",
+        )
+
+    @task(1)
+    def upload_tei(self):
+        """
+        Upload a TEI zip to a conference and poll the import job's progress until it finishes
+        """
+        if not EDITOR_WRITES:
+            return
+        conference_id = random.choice(all_ids["conferences"])
+        path = f"/conference/{conference_id}/import_xml"
+        self.get(path, name="/conference/[id]/import_xml")
+        response = self.post(
+            path,
+            {},
+            name="/conference/[id]/import_xml",
+            files={"file": ("locust.zip", tei_zip(), "application/zip")},
+        )
+        job = re.search(r"/conference/import_jobs/(\d+)", response.url)
+        if job is None:
+            return
+        for i in range(30):
+            gevent.sleep(2)
+            status = self.get(
+                f"/conference/import_jobs/{job.group(1)}/status",
+                name="/conference/import_jobs/[id]/status",
+            )
+            if status.ok and status.json().get("is_finished"):
+                break
+
+
+@events.quitting.add_listener
+def check_slos(environment, **kwargs):
+    # Workers only hold part of the stats, the master reports on all of them
+    if isinstance(environment.runner, WorkerRunner):
+        return
+    if len(slo.report(environment.stats, slos)) > 0:
+        environment.process_exit_code = 1
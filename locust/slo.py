@@ -0,0 +1,68 @@
+"""
+Service level objectives for the locust workload.
+
+slos.json sets p50, p95 and p99 response time limits in milliseconds, and a
+failure ratio limit, under "default" and per request name under "endpoints".
+At the end of a run, report() prints every endpoint's percentiles against its
+limits and returns the endpoints that missed any of them. Endpoints with fewer
+than "min_requests" requests are listed but never fail the run.
+"""
+
+import json
+
+PERCENTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+
+def load_slos(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def slo_for(slos, name):
+    """
+    The objectives for a request name: the "default" limits, overridden by any set for that name
+    """
+    return {**slos.get("default", {}), **slos.get("endpoints", {}).get(name, {})}
+
+
+def measure(entry):
+    measurements = {
+        p: entry.get_response_time_percentile(q) for p, q in PERCENTILES.items()
+    }
+    measurements["failure_ratio"] = entry.fail_ratio
+    return measurements
+
+
+def breaches(slo, measurements):
+    return [
+        f"{measure} {measurements[measure]:g} > {limit:g}"
+        for measure, limit in slo.items()
+        if measure in measurements and measurements[measure] > limit
+    ]
+
+
+def report(stats, slos):
+    """
+    Print a line per endpoint in the locust stats, and return {endpoint: [breaches]} for those that missed their objectives
+    """
+    min_requests = slos.get("min_requests", 0)
+    failed = {}
+    print(
+        f"{'Endpoint':<48} {'reqs':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'fail%':>6}  SLO"
+    )
+    for (name, method), entry in sorted(stats.entries.items()):
+        label = f"{method} {name}"
+        measurements = measure(entry)
+        entry_breaches = breaches(slo_for(slos, name), measurements)
+        if entry.num_requests < min_requests:
+            verdict = "too few requests"
+        elif len(entry_breaches) > 0:
+            verdict = "MISSED: " + ", ".join(entry_breaches)
+            failed[label] = entry_breaches
+        else:
+            verdict = "met"
+        print(
+            f"{label:<48} {entry.num_requests:>7} {measurements['p50']:>7.0f} {measurements['p95']:>7.0f} {measurements['p99']:>7.0f} {measurements['failure_ratio'] * 100:>6.1f}  {verdict}"
+        )
+    print(f"{len(failed)} endpoints missed their objectives")
+    return failed